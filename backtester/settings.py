@@ -137,6 +137,47 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'aggregates/')
 FILE_UPLOAD_MAX_MEMORY_SIZE = 52428800
 
 
+# Data ingestion
+# Number of crawler files downloaded at the same time in ingest view,
+# and number of retries for a single file before ingestion fails
+
+INGEST_DOWNLOAD_WORKERS = 8
+INGEST_DOWNLOAD_RETRIES = 3
+
+# Number of worker processes preparing price data of assets in parallel
+
+INGEST_PREPARE_WORKERS = os.cpu_count() or 1
+
+# Number of worker processes writing the data bundle in a full ingestion
+
+INGEST_BUNDLE_WORKERS = os.cpu_count() or 1
+
+# Minutes after the daily crawler cutoff (00:20 UTC) at which the
+# ingest_scheduler command ingests new data
+
+INGEST_SCHEDULE_DELAY = 10
+
+# Keep uncompressed copies of minute bar columns next to the bundle, which
+# the minute bar reader memory-maps. Reads of single minutes then do not
+# decompress a whole chunk, and gunicorn workers share the pages in the
+# page cache. Takes 20 bytes per asset and minute of disk space
+
+MINUTE_BARS_UNCOMPRESSED = False
+
+# Seconds per bar of optional sub-minute bars, e.g. 10, built from crawler
+# data in addition to minute bars. None to build minute bars only.
+# Must divide 60, other periods are rejected when the bars are written.
+# The bars are only stored, read them with BcolzBarReader of
+# zipline.data.minute_bars: backtests and data downloads use minute bars
+
+BAR_PERIOD_SECONDS = None
+
+# Directory standing in for Google Cloud Storage, with one subdirectory per
+# bucket, e.g. for running ingestion offline. GCS is used if not set
+
+OBJECT_STORE_ROOT = os.environ.get('OBJECT_STORE_ROOT')
+
+
 # Logging configuration
 # Writes all logging of level 'WARNING' 'ERROR' 'CRITICAL' to a log file
 # https://docs.djangoproject.com/en/1.11/topics/logging/
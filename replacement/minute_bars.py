@@ -63,6 +63,8 @@ OHLC_RATIO = 1000
 # asset safely, first clean all ingests, then calculate sids for all assets,
 # then update this dict accordingly, finally do the ingestion for all assets.
 # If daily data should be used, add the same dict to daily_bars.py
+# Full ingestions of testapp pass the OHLC ratios of all assets by symbol
+# from the symbol registry instead, see testapp/symbol_registry.py.
 
 # BTCUSDT: sid 0, uses default OHLC_RATIO = 1000
 # ETHBTC: sid 1, 10^6
@@ -99,6 +101,101 @@ def _calc_minute_index(market_opens, minutes_per_day):
     return pd.to_datetime(minutes, utc=True, box=True)
 
 
+def _is_continuous(market_open_values, market_close_values, minutes_per_day):
+    """
+    Whether sessions given as minute epochs follow each other without gaps
+    and all have ``minutes_per_day`` minutes, as with a calendar that is
+    open around the clock.
+    """
+    if minutes_per_day != 24 * 60:
+        return False
+    if len(market_open_values) == 0:
+        return False
+    return bool(
+        np.all(market_close_values - market_open_values ==
+               minutes_per_day - 1) and
+        np.all(np.diff(market_open_values) == minutes_per_day)
+    )
+
+
+class _ContinuousMinuteIndex(object):
+    """
+    The minutes of a continuous calendar, see ``_is_continuous``, as a
+    drop-in for the DatetimeIndex of ``_calc_minute_index``. Minutes are
+    calculated from the first market open when they are looked up, instead
+    of materialising every minute of every session.
+
+    Supports ``len``, indexing with ints and slices, ``get_loc``,
+    ``searchsorted`` and ``values``.
+
+    Parameters
+    ----------
+    first_minute : int
+        Minute epoch of the first market open.
+    length : int
+        Number of minutes.
+    """
+    def __init__(self, first_minute, length):
+        self._first_minute = first_minute
+        self._length = length
+
+    def __len__(self):
+        return self._length
+
+    @property
+    def size(self):
+        return self._length
+
+    @property
+    def values(self):
+        minutes = self._first_minute + np.arange(self._length, dtype=np.int64)
+        return minutes.astype('datetime64[m]').astype('datetime64[ns]')
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self._length)
+            if step != 1:
+                return pd.DatetimeIndex(self.values[key], tz='UTC')
+            return _ContinuousMinuteIndex(
+                self._first_minute + start, max(stop - start, 0))
+        pos = int(key)
+        if pos < 0:
+            pos += self._length
+        if not 0 <= pos < self._length:
+            raise IndexError(
+                'index {} is out of bounds for size {}'.format(
+                    key, self._length))
+        return pd.Timestamp(
+            (self._first_minute + pos) * NANOS_IN_MINUTE, tz='UTC')
+
+    def _offsets(self, value):
+        # nanoseconds from the first minute, for one or many datetimes
+        if np.ndim(value) == 0:
+            nanos = pd.Timestamp(value).value
+        else:
+            nanos = pd.DatetimeIndex(value).values.\
+                astype('datetime64[ns]').astype(np.int64)
+        return nanos - self._first_minute * NANOS_IN_MINUTE
+
+    def get_loc(self, key):
+        pos, rest = divmod(self._offsets(key), NANOS_IN_MINUTE)
+        if rest or not 0 <= pos < self._length:
+            raise KeyError(key)
+        return int(pos)
+
+    def searchsorted(self, value, side='left'):
+        offsets = self._offsets(value)
+        if side == 'left':
+            # first minute at or after the value
+            positions = -(-offsets // NANOS_IN_MINUTE)
+        else:
+            positions = offsets // NANOS_IN_MINUTE + 1
+        positions = np.clip(positions, 0, self._length)
+        if np.ndim(positions) == 0:
+            return int(positions)
+        return positions
+
+
 def _sid_subdir_path(sid):
     """
     Format subdir path to limit the number directories in any given
@@ -130,6 +227,30 @@ def _sid_subdir_path(sid):
     )
 
 
+# Directory of the uncompressed copies of the minute bar columns, see
+# BcolzMinuteBarWriter.write_uncompressed
+UNCOMPRESSED_DIRNAME = 'uncompressed'
+
+# Number of minutes copied to an uncompressed column file at a time
+UNCOMPRESSED_CHUNK_LEN = 1440 * 30
+
+
+def _uncompressed_path(rootdir, sid, field):
+    """
+    Path of the flat uint32 file holding the uncompressed ``field`` column
+    of ``sid``, e.g. uncompressed/00/00/000001/close.u32 for sid 1.
+    """
+    padded_sid = format(sid, '06')
+    return os.path.join(
+        rootdir,
+        UNCOMPRESSED_DIRNAME,
+        padded_sid[0:2],
+        padded_sid[2:4],
+        padded_sid,
+        "{0}.u32".format(field),
+    )
+
+
 def convert_cols(cols, scale_factor, sid, invalid_data_behavior):
     """Adapt OHLCV columns into uint32 columns.
 
@@ -482,9 +603,6 @@ class BcolzMinuteBarWriter(object):
         self._default_ohlc_ratio = default_ohlc_ratio
         self._ohlc_ratios_per_sid = ohlc_ratios_per_sid
 
-        self._minute_index = _calc_minute_index(
-            self._schedule.market_open, self._minutes_per_day)
-
         if write_metadata:
             metadata = BcolzMinuteBarMetadata(
                 self._default_ohlc_ratio,
@@ -522,6 +640,27 @@ class BcolzMinuteBarWriter(object):
     def first_trading_day(self):
         return self._start_session
 
+    @property
+    def rootdir(self):
+        return self._rootdir
+
+    @lazyval
+    def _minute_index(self):
+        market_opens = self._schedule.market_open
+        market_open_values = market_opens.values.\
+            astype('datetime64[m]').astype(np.int64)
+        market_close_values = self._schedule.market_close.values.\
+            astype('datetime64[m]').astype(np.int64)
+        if _is_continuous(market_open_values,
+                          market_close_values,
+                          self._minutes_per_day):
+            # e.g. AOC, years of minutes are not materialised
+            return _ContinuousMinuteIndex(
+                int(market_open_values[0]),
+                len(market_open_values) * self._minutes_per_day,
+            )
+        return _calc_minute_index(market_opens, self._minutes_per_day)
+
     def ohlc_ratio_for_sid(self, sid):
         if self._ohlc_ratios_per_sid is not None:
             try:
@@ -575,6 +714,111 @@ class BcolzMinuteBarWriter(object):
             return pd.NaT
         return self._session_labels[num_days - 1]
 
+    def last_minute_in_output_for_sid(self, sid):
+        """
+        Parameters
+        ----------
+        sid : int
+            Asset identifier.
+
+        Returns
+        -------
+        out : pd.Timestamp
+            The last minute written in to the output for the given sid,
+            NaT if nothing has been written yet.
+        """
+        sizes_path = "{0}/close/meta/sizes".format(self.sidpath(sid))
+        if not os.path.exists(sizes_path):
+            return pd.NaT
+        with open(sizes_path, mode='r') as f:
+            sizes = f.read()
+        num_rec_mins = json.loads(sizes)['shape'][0]
+        if num_rec_mins == 0:
+            return pd.NaT
+        return self._minute_index[num_rec_mins - 1]
+
+    def write_uncompressed(self, sid, start_dt=None):
+        """
+        Copy the columns of ``sid`` to flat, uncompressed uint32 files,
+        which BcolzMinuteBarReader memory-maps instead of reading the
+        compressed carrays. Scalar and slice reads are then plain page
+        cache reads, and processes reading the same data share the pages.
+
+        Only minutes from ``start_dt`` on are copied if the files already
+        hold the minutes before. Appending is done in place, a file whose
+        minutes changed before its end is replaced by a new one, so that a
+        reader never sees a file shrink. A copy older than its carray, e.g.
+        after ``truncate_sid`` without ``write_uncompressed``, is not read.
+
+        Parameters
+        ----------
+        sid : int
+            Asset identifier.
+        start_dt : datetime-like, optional
+            The first minute that changed since the files were written,
+            e.g. the ``dt`` given to ``truncate_sid``. By default all
+            minutes are copied.
+        """
+        sid_path = self.sidpath(sid)
+        if not os.path.exists(sid_path):
+            return
+        if start_dt is None:
+            start = 0
+        else:
+            start_dt = pd.Timestamp(start_dt)
+            if start_dt.tzinfo is None:
+                start_dt = start_dt.tz_localize('UTC')
+            start = self._minute_index.searchsorted(start_dt)
+
+        for field in self.COL_NAMES:
+            carray = bcolz.carray(rootdir=join(sid_path, field), mode='r')
+            path = _uncompressed_path(self._rootdir, sid, field)
+            if os.path.exists(path):
+                written = os.path.getsize(path) // 4
+            else:
+                written = 0
+                if not os.path.exists(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+            keep = min(written, start, len(carray))
+            if keep == written:
+                target, mode = path, 'ab'
+            else:
+                target, mode, keep = path + '.tmp', 'wb', 0
+            with open(target, mode) as f:
+                for pos in range(keep, len(carray), UNCOMPRESSED_CHUNK_LEN):
+                    carray[pos:pos + UNCOMPRESSED_CHUNK_LEN].tofile(f)
+            if target != path:
+                os.replace(target, path)
+            else:
+                # newer than the carray, see BcolzMinuteBarReader
+                os.utime(path)
+
+    def truncate_sid(self, sid, dt):
+        """
+        Drop all minutes at or after ``dt`` from the ctable of the given
+        sid, so that they can be written again.
+
+        Parameters
+        ----------
+        sid : int
+            Asset identifier.
+        dt : datetime-like
+            The first minute to drop.
+        """
+        sid_path = self.sidpath(sid)
+        if not os.path.exists(sid_path):
+            return
+        dt = pd.Timestamp(dt)
+        if dt.tzinfo is None:
+            dt = dt.tz_localize('UTC')
+        truncate_slice_end = self._minute_index.searchsorted(dt)
+        table = bcolz.open(rootdir=sid_path)
+        if table.len > truncate_slice_end:
+            logger.info(
+                "Truncating sid={0} at dt={1}", sid, dt
+            )
+            table.resize(truncate_slice_end)
+
     def _init_ctable(self, path):
         """
         Create empty ctable for given path.
@@ -588,9 +832,9 @@ class BcolzMinuteBarWriter(object):
         # This is not to be confused with the `.bcolz` directory, but is the
         # directory up one level from the `.bcolz` directories.
         sid_containing_dirname = os.path.dirname(path)
-        if not os.path.exists(sid_containing_dirname):
-            # Other sids may have already created the containing directory.
-            os.makedirs(sid_containing_dirname)
+        # Other sids may have already created the containing directory,
+        # or create it at the same time in another process.
+        os.makedirs(sid_containing_dirname, exist_ok=True)
         initial_array = np.empty(0, np.uint32)
         table = ctable(
             rootdir=path,
@@ -963,10 +1207,25 @@ class BcolzMinuteBarReader(MinuteBarReader):
 
         self._minutes_per_day = metadata.minutes_per_day
 
+        # With a calendar open around the clock, e.g. AOC, the position of a
+        # minute is its distance from the first market open, so positions
+        # are calculated instead of searched for in the market opens.
+        self._continuous = _is_continuous(
+            self._market_open_values,
+            self._market_close_values,
+            self._minutes_per_day,
+        )
+        if self._continuous:
+            self._first_open_minute = int(self._market_open_values[0])
+            self._num_minutes = (
+                len(self._market_open_values) * self._minutes_per_day)
+
         self._carrays = {
             field: LRU(sid_cache_sizes[field])
             for field in self.FIELDS
         }
+        # columns of sids, all opened at once with the ctable of a sid
+        self._ctables = LRU(max(sid_cache_sizes.values()))
 
         self._last_get_value_dt_position = None
         self._last_get_value_dt_value = None
@@ -1069,6 +1328,9 @@ class BcolzMinuteBarReader(MinuteBarReader):
         List of tuples of (start, stop) which represent the ranges of minutes
         which should be excluded when a market minute window is requested.
         """
+        if self._continuous:
+            # a calendar open around the clock has no early closes
+            return None
         itree = self._minute_exclusion_tree
         if itree.overlaps(start_idx, end_idx):
             ranges = []
@@ -1084,19 +1346,60 @@ class BcolzMinuteBarReader(MinuteBarReader):
         # carrays are subdirectories of the sid's rootdir
         return os.path.join(self._rootdir, sid_subdir, field)
 
+    def _open_uncompressed(self, field, sid, length):
+        """
+        Memory-map the uncompressed copy of a column written by
+        BcolzMinuteBarWriter.write_uncompressed, None if there is no copy
+        or it is not up to date with the carray.
+        """
+        path = _uncompressed_path(self._rootdir, sid, field)
+        sizes_path = os.path.join(
+            self._get_carray_path(sid, field), 'meta', 'sizes')
+        try:
+            stat = os.stat(path)
+            carray_mtime = os.path.getmtime(sizes_path)
+        except OSError:
+            return None
+        if (length == 0 or stat.st_size != length * 4 or
+                stat.st_mtime < carray_mtime):
+            return None
+        return np.memmap(path, dtype=np.uint32, mode='r', shape=(length,))
+
+    def _open_minute_table(self, sid):
+        """
+        Columns of ``sid``, a dict of field -> carray, opened at once with
+        the ctable of the sid. Up to date uncompressed copies of columns are
+        memory-mapped instead, see BcolzMinuteBarWriter.write_uncompressed.
+        """
+        sid = int(sid)
+
+        try:
+            return self._ctables[sid]
+        except KeyError:
+            pass
+        try:
+            table = bcolz.ctable(
+                rootdir=os.path.join(self._rootdir, _sid_subdir_path(sid)),
+                mode='r',
+            )
+        except IOError:
+            raise NoDataForSid('No minute data for sid {}.'.format(sid))
+        columns = {}
+        for field in self.FIELDS:
+            carray = table.cols[field]
+            values = self._open_uncompressed(field, sid, len(carray))
+            columns[field] = carray if values is None else values
+        self._ctables[sid] = columns
+        return columns
+
     def _open_minute_file(self, field, sid):
         sid = int(sid)
 
         try:
             carray = self._carrays[field][sid]
         except KeyError:
-            try:
-                carray = self._carrays[field][sid] = bcolz.carray(
-                    rootdir=self._get_carray_path(sid, field),
-                    mode='r',
-                )
-            except IOError:
-                raise NoDataForSid('No minute data for sid {}.'.format(sid))
+            carray = self._open_minute_table(sid)[field]
+            self._carrays[field][sid] = carray
 
         return carray
 
@@ -1166,6 +1469,117 @@ class BcolzMinuteBarReader(MinuteBarReader):
             value *= self._ohlc_ratio_inverse_for_sid(sid)
         return value
 
+    def get_values(self, sids, dts, fields):
+        """
+        Retrieve the pricing info for many sids, dts and fields at once.
+
+        Parameters
+        ----------
+        sids : iterable of int
+            Asset identifiers.
+        dts : iterable of datetime-like
+            The minutes to look up, in any order.
+        fields : iterable of str
+            'open', 'high', 'low', 'close', or 'volume'
+
+        Returns
+        -------
+        out : np.ndarray
+            An array of float64 with shape (fields, dts, sids). OHLC values
+            are scaled by the sid's OHLC ratio and are np.nan where no trade
+            occurred, volumes are 0 where no trade occurred.
+
+        Raises
+        ------
+        NoDataOnDate
+            If any of the dts is not a trading minute of the reader.
+        NoDataForSid
+            If there is no data for any of the sids.
+        """
+        sids = list(sids)
+        fields = list(fields)
+        minutes = pd.DatetimeIndex(dts).values.\
+            astype('datetime64[m]').astype(np.int64)
+        try:
+            positions = self._find_positions_of_minutes(minutes)
+        except ValueError:
+            raise NoDataOnDate()
+
+        out = np.empty((len(fields), len(positions), len(sids)))
+        for i, field in enumerate(fields):
+            for j, sid in enumerate(sids):
+                values = self._read_positions(
+                    self._open_minute_file(field, sid),
+                    positions,
+                )
+                if field != 'volume':
+                    values = np.where(
+                        values != 0,
+                        values * self._ohlc_ratio_inverse_for_sid(sid),
+                        np.nan,
+                    )
+                out[i, :, j] = values
+        return out
+
+    def _find_positions_of_minutes(self, minute_vals):
+        """
+        Vectorized ``_find_position_of_minute``, for an array of minute
+        epochs. Raises ValueError if any minute is not between an open and
+        a close.
+        """
+        minute_vals = np.asarray(minute_vals, dtype=np.int64)
+        if not len(minute_vals):
+            return minute_vals
+        if self._continuous:
+            positions = minute_vals - self._first_open_minute
+            if positions.min() < 0 or positions.max() >= self._num_minutes:
+                raise ValueError(
+                    "Given minute is not between an open and a close")
+            return positions
+
+        market_open_locs = np.searchsorted(
+            self._market_open_values, minute_vals, side='right') - 1
+        if market_open_locs.min() < 0:
+            raise ValueError(
+                "Given minute is not between an open and a close")
+        market_opens = self._market_open_values[market_open_locs]
+        market_closes = self._market_close_values[market_open_locs]
+        deltas = minute_vals - market_opens
+        if deltas.max() >= self._minutes_per_day:
+            raise ValueError(
+                "Given minute is not between an open and a close")
+        # minutes after an early close are adjusted to the close
+        return (market_open_locs * self._minutes_per_day +
+                np.minimum(deltas, market_closes - market_opens))
+
+    def _read_positions(self, carray, positions):
+        """
+        Values of a column at the given positions, 0 past its end. Positions
+        are read in order with one slice per chunk of the carray, so every
+        chunk is decompressed once.
+        """
+        out = np.zeros(len(positions), dtype=np.uint32)
+        valid = np.flatnonzero(positions < len(carray))
+        if isinstance(carray, np.ndarray):
+            # an uncompressed copy has no chunks
+            out[valid] = carray[positions[valid]]
+            return out
+
+        order = valid[np.argsort(positions[valid], kind='mergesort')]
+        sorted_positions = positions[order]
+        breaks = np.flatnonzero(
+            np.diff(sorted_positions // carray.chunklen)) + 1
+        starts = np.r_[0, breaks]
+        stops = np.r_[breaks, len(order)]
+        for start, stop in zip(starts, stops):
+            if start == stop:
+                continue
+            low = sorted_positions[start]
+            high = sorted_positions[stop - 1] + 1
+            out[order[start:stop]] = (
+                carray[low:high][sorted_positions[start:stop] - low])
+        return out
+
     def get_last_traded_dt(self, asset, dt):
         minute_pos = self._find_last_traded_position(asset, dt)
         if minute_pos == -1:
@@ -1187,14 +1601,21 @@ class BcolzMinuteBarReader(MinuteBarReader):
         if dt_minute < earliest_dt_to_search:
             return -1
 
-        pos = find_last_traded_position_internal(
-            self._market_open_values,
-            self._market_close_values,
-            dt_minute,
-            earliest_dt_to_search,
-            volumes,
-            self._minutes_per_day,
-        )
+        if self._continuous:
+            pos = self._find_last_traded_position_continuous(
+                volumes,
+                dt_minute,
+                earliest_dt_to_search,
+            )
+        else:
+            pos = find_last_traded_position_internal(
+                self._market_open_values,
+                self._market_close_values,
+                dt_minute,
+                earliest_dt_to_search,
+                volumes,
+                self._minutes_per_day,
+            )
 
         if pos == -1:
             # if we didn't find any volume before this dt, save it to avoid
@@ -1209,12 +1630,33 @@ class BcolzMinuteBarReader(MinuteBarReader):
 
         return pos
 
+    def _find_last_traded_position_continuous(self, volumes, dt_minute,
+                                              earliest_minute):
+        """
+        Position of the last minute with volume at or before ``dt_minute``
+        and not before ``earliest_minute``, -1 if there is none, for
+        continuous calendars. Volumes are searched backwards one day at a
+        time instead of minute by minute.
+        """
+        end = min(int(dt_minute) - self._first_open_minute + 1, len(volumes))
+        stop = max(0, int(np.ceil(earliest_minute)) - self._first_open_minute)
+        while end > stop:
+            start = max(stop, end - self._minutes_per_day)
+            traded = np.flatnonzero(volumes[start:end])
+            if len(traded):
+                return start + int(traded[-1])
+            end = start
+        return -1
+
     def _pos_to_minute(self, pos):
-        minute_epoch = minute_value(
-            self._market_open_values,
-            pos,
-            self._minutes_per_day
-        )
+        if self._continuous:
+            minute_epoch = self._first_open_minute + pos
+        else:
+            minute_epoch = minute_value(
+                self._market_open_values,
+                pos,
+                self._minutes_per_day
+            )
 
         return pd.Timestamp(minute_epoch, tz='UTC', unit="m")
 
@@ -1237,6 +1679,12 @@ class BcolzMinuteBarReader(MinuteBarReader):
         int: The position of the given minute in the list of all trading
         minutes since market open on the first trading day.
         """
+        if self._continuous:
+            pos = minute_dt.value // NANOS_IN_MINUTE - self._first_open_minute
+            if pos < 0 or pos >= self._num_minutes:
+                raise ValueError(
+                    "Given minute is not between an open and a close")
+            return pos
         return find_position_of_minute(
             self._market_open_values,
             self._market_close_values,
@@ -1245,7 +1693,7 @@ class BcolzMinuteBarReader(MinuteBarReader):
             False,
         )
 
-    def load_raw_arrays(self, fields, start_dt, end_dt, sids):
+    def load_raw_arrays(self, fields, start_dt, end_dt, sids, out=None):
         """
         Parameters
         ----------
@@ -1257,6 +1705,10 @@ class BcolzMinuteBarReader(MinuteBarReader):
            End of the window range.
         sids : list of int
            The asset identifiers in the window.
+        out : list of np.ndarray, optional
+           Arrays to write the values to instead of allocating new ones,
+           one per field, with shape (minutes in range, sids), e.g. the
+           results of a previous call for a window of the same length.
 
         Returns
         -------
@@ -1270,42 +1722,676 @@ class BcolzMinuteBarReader(MinuteBarReader):
 
         num_minutes = (end_idx - start_idx + 1)
 
-        results = []
-
         indices_to_exclude = self._exclusion_indices_for_range(
             start_idx, end_idx)
+        keep = None
         if indices_to_exclude is not None:
+            # one mask of the minutes to keep, for every field and sid
+            keep = np.ones(num_minutes, dtype=bool)
             for excl_start, excl_stop in indices_to_exclude:
-                length = excl_stop - excl_start + 1
-                num_minutes -= length
+                keep[max(excl_start - start_idx, 0):
+                     excl_stop - start_idx + 1] = False
+            num_minutes = int(keep.sum())
 
         shape = num_minutes, len(sids)
 
-        for field in fields:
-            if field != 'volume':
-                out = np.full(shape, np.nan)
-            else:
-                out = np.zeros(shape, dtype=np.uint32)
-
-            for i, sid in enumerate(sids):
-                carray = self._open_minute_file(field, sid)
-                values = carray[start_idx:end_idx + 1]
-                if indices_to_exclude is not None:
-                    for excl_start, excl_stop in indices_to_exclude[::-1]:
-                        excl_slice = np.s_[
-                            excl_start - start_idx:excl_stop - start_idx + 1]
-                        values = np.delete(values, excl_slice)
+        if out is None:
+            results = [
+                np.full(shape, np.nan) if field != 'volume'
+                else np.zeros(shape, dtype=np.uint32)
+                for field in fields
+            ]
+        else:
+            if len(out) != len(fields):
+                raise ValueError(
+                    'Expected {} output arrays, got {}.'.format(
+                        len(fields), len(out)))
+            for field, result in zip(fields, out):
+                if result.shape != shape:
+                    raise ValueError(
+                        'Expected output array of shape {}, got {}.'.format(
+                            shape, result.shape))
+                result.fill(np.nan if field != 'volume' else 0)
+            results = out
+
+        # the columns of all fields of a sid come from its ctable, opened
+        # once, and each requested column is sliced over the same range
+        for i, sid in enumerate(sids):
+            ohlc_ratio_inverse = self._ohlc_ratio_inverse_for_sid(sid)
+            columns = self._open_minute_table(sid)
+            for field, result in zip(fields, results):
+                values = columns[field][start_idx:end_idx + 1]
+                if keep is not None:
+                    values = values[keep[:len(values)]]
 
                 where = values != 0
                 # first slice down to len(where) because we might not have
                 # written data for all the minutes requested
                 if field != 'volume':
-                    out[:len(where), i][where] = (
-                        values[where] * self._ohlc_ratio_inverse_for_sid(sid))
+                    result[:len(where), i][where] = (
+                        values[where] * ohlc_ratio_inverse)
                 else:
-                    out[:len(where), i][where] = values[where]
+                    result[:len(where), i][where] = values[where]
 
-            results.append(out)
+        return results
+
+
+class BcolzBarMetadata(object):
+    """
+    Metadata of bars written by BcolzBarWriter.
+
+    Parameters
+    ----------
+    default_ohlc_ratio : int
+         The factor by which the pricing data is multiplied so that the
+         float data can be stored as an integer.
+    ohlc_ratios_per_sid : dict or None
+        Ratios of single sids, see BcolzMinuteBarWriter.
+    calendar :  trading_calendars.trading_calendar.TradingCalendar
+        The TradingCalendar on which the bars are based.
+    start_session : datetime
+        The first trading session in the data set.
+    end_session : datetime
+        The last trading session in the data set.
+    bar_period : int
+        The number of seconds per bar.
+    """
+    FORMAT_VERSION = 1
+
+    METADATA_FILENAME = 'metadata.json'
+
+    @classmethod
+    def metadata_path(cls, rootdir):
+        return os.path.join(rootdir, cls.METADATA_FILENAME)
+
+    @classmethod
+    def read(cls, rootdir):
+        with open(cls.metadata_path(rootdir)) as fp:
+            raw_data = json.load(fp)
+
+        ohlc_ratios_per_sid = raw_data['ohlc_ratios_per_sid']
+        if ohlc_ratios_per_sid is not None:
+            ohlc_ratios_per_sid = keymap(int, ohlc_ratios_per_sid)
+        return cls(
+            raw_data['ohlc_ratio'],
+            ohlc_ratios_per_sid,
+            get_calendar(raw_data['calendar_name']),
+            pd.Timestamp(raw_data['start_session'], tz='UTC'),
+            pd.Timestamp(raw_data['end_session'], tz='UTC'),
+            raw_data['bar_period'],
+            version=raw_data['version'],
+        )
+
+    def __init__(
+        self,
+        default_ohlc_ratio,
+        ohlc_ratios_per_sid,
+        calendar,
+        start_session,
+        end_session,
+        bar_period,
+        version=FORMAT_VERSION,
+    ):
+        self.calendar = calendar
+        self.start_session = start_session
+        self.end_session = end_session
+        self.default_ohlc_ratio = default_ohlc_ratio
+        self.ohlc_ratios_per_sid = ohlc_ratios_per_sid
+        self.bar_period = bar_period
+        self.version = version
+
+    def write(self, rootdir):
+        """
+        Write the metadata to a JSON file in the rootdir.
+        """
+        metadata = {
+            'version': self.version,
+            'ohlc_ratio': self.default_ohlc_ratio,
+            'ohlc_ratios_per_sid': self.ohlc_ratios_per_sid,
+            'calendar_name': self.calendar.name,
+            'start_session': str(self.start_session.date()),
+            'end_session': str(self.end_session.date()),
+            'bar_period': self.bar_period,
+        }
+        if not os.path.exists(rootdir):
+            os.makedirs(rootdir)
+        with open(self.metadata_path(rootdir), 'w+') as fp:
+            json.dump(metadata, fp)
+
+
+class _BarIndex(object):
+    """
+    Arithmetic positions of the bars of a continuous calendar: bar ``i``
+    starts ``i * bar_period`` seconds after the market open of the first
+    session.
+    """
+
+    def __init__(self, calendar, start_session, end_session, bar_period):
+        if bar_period <= 0 or 60 % bar_period != 0:
+            raise ValueError(
+                'bar_period={0} must be a divisor of 60 seconds'.format(
+                    bar_period))
+        slicer = calendar.schedule.index.slice_indexer(
+            start_session, end_session)
+        schedule = calendar.schedule[slicer]
+        market_opens = schedule.market_open.values.astype('datetime64[m]')
+        market_closes = schedule.market_close.values.astype('datetime64[m]')
+        if not _is_continuous(market_opens.astype(np.int64),
+                              market_closes.astype(np.int64), 24 * 60):
+            raise ValueError(
+                'Bars of {0} seconds need a calendar open around the clock, '
+                '{1} is not'.format(bar_period, calendar.name))
+        self.bar_period = bar_period
+        self.period_nanos = bar_period * 10 ** 9
+        self.start_nanos = market_opens[0].astype('datetime64[ns]').astype(
+            np.int64)
+        end_nanos = (market_closes[-1] + np.timedelta64(1, 'm')).astype(
+            'datetime64[ns]').astype(np.int64)
+        self.num_bars = int((end_nanos - self.start_nanos) //
+                            self.period_nanos)
+
+    def positions(self, dts):
+        """Positions of the bars starting at or before ``dts``."""
+        nanos = np.asarray(dts).astype('datetime64[ns]').astype(np.int64)
+        return (nanos - self.start_nanos) // self.period_nanos
+
+    def position(self, dt):
+        return int((pd.Timestamp(dt).value - self.start_nanos) //
+                   self.period_nanos)
+
+    def bar(self, pos):
+        return pd.Timestamp(self.start_nanos + pos * self.period_nanos,
+                            tz='UTC')
+
+
+class BcolzBarWriter(object):
+    """
+    Class capable of writing OHLCV bars of a configurable period, e.g. 10
+    seconds, to disk into a compact bcolz format. A variant of
+    BcolzMinuteBarWriter for calendars that are open around the clock,
+    like AOC.
+
+    Parameters
+    ----------
+    rootdir : string
+        Path to the root directory into which to write the metadata and
+        bcolz subdirectories.
+    calendar : trading_calendars.trading_calendar.TradingCalendar
+        The trading calendar on which to base the bars. Sessions must
+        follow each other without gaps.
+    start_session : datetime
+        The first trading session in the data set.
+    end_session : datetime
+        The last trading session in the data set.
+    bar_period : int
+        The number of seconds per bar, a divisor of 60.
+    default_ohlc_ratio : int, optional
+        See BcolzMinuteBarWriter.
+    ohlc_ratios_per_sid : dict, optional
+        See BcolzMinuteBarWriter.
+    expectedlen : int, optional
+        The expected number of bars of a sid, used when creating its
+        bcolz ctable. Defaults to one year of bars.
+    write_metadata : bool, optional
+        If True, writes the metadata (on init of the writer).
+
+    Notes
+    -----
+    As with minute bars, each sid has a bcolz ctable with uint32 columns
+    open, high, low, close and volume, and the position of a bar in the
+    columns is its 'index'. Positions are not stored but calculated: bar
+    ``i`` starts ``i * bar_period`` seconds after the market open of the
+    first session.
+
+    To keep the larger number of bars affordable, the layout is compact:
+
+    - A sid's ctable starts at its first bar instead of being zero-filled
+      from the first session. The position of its first row is the ctable
+      attribute ``first_position``.
+    - Columns are compressed with bitshuffle at the highest compression
+      level, which packs the runs of zeros for bars without trades and the
+      small differences between neighbouring prices much better.
+
+    See Also
+    --------
+    zipline.data.minute_bars.BcolzBarReader
+    """
+    COL_NAMES = ('open', 'high', 'low', 'close', 'volume')
+
+    CPARAMS = bcolz.cparams(
+        clevel=9,
+        shuffle=getattr(bcolz, 'BITSHUFFLE', 1),
+    )
+
+    def __init__(self,
+                 rootdir,
+                 calendar,
+                 start_session,
+                 end_session,
+                 bar_period,
+                 default_ohlc_ratio=OHLC_RATIO,
+                 ohlc_ratios_per_sid=ohlc_ratios,
+                 expectedlen=None,
+                 write_metadata=True):
+
+        self._rootdir = rootdir
+        self._calendar = calendar
+        self._start_session = start_session
+        self._end_session = end_session
+        self._bar_period = bar_period
+        self._default_ohlc_ratio = default_ohlc_ratio
+        self._ohlc_ratios_per_sid = ohlc_ratios_per_sid
+        self._index = _BarIndex(
+            calendar, start_session, end_session, bar_period)
+        if expectedlen is None:
+            expectedlen = 365 * 24 * 3600 // bar_period
+        self._expectedlen = expectedlen
+
+        if write_metadata:
+            BcolzBarMetadata(
+                default_ohlc_ratio,
+                ohlc_ratios_per_sid,
+                calendar,
+                start_session,
+                end_session,
+                bar_period,
+            ).write(rootdir)
+
+    @classmethod
+    def open(cls, rootdir, end_session=None):
+        """
+        Open an existing ``rootdir`` for writing.
+
+        Parameters
+        ----------
+        end_session : Timestamp (optional)
+            When appending, the intended new ``end_session``.
+        """
+        metadata = BcolzBarMetadata.read(rootdir)
+        return cls(
+            rootdir,
+            metadata.calendar,
+            metadata.start_session,
+            end_session if end_session is not None else metadata.end_session,
+            metadata.bar_period,
+            metadata.default_ohlc_ratio,
+            metadata.ohlc_ratios_per_sid,
+            write_metadata=end_session is not None,
+        )
+
+    @property
+    def first_trading_day(self):
+        return self._start_session
+
+    @property
+    def rootdir(self):
+        return self._rootdir
+
+    @property
+    def bar_period(self):
+        return self._bar_period
+
+    def ohlc_ratio_for_sid(self, sid):
+        if self._ohlc_ratios_per_sid is not None:
+            try:
+                return self._ohlc_ratios_per_sid[sid]
+            except KeyError:
+                pass
+
+        # If no ohlc_ratios_per_sid dict is passed, or if the specified
+        # sid is not in the dict, fallback to the general ohlc_ratio.
+        return self._default_ohlc_ratio
+
+    def sidpath(self, sid):
+        """
+        Parameters
+        ----------
+        sid : int
+            Asset identifier.
+
+        Returns
+        -------
+        out : string
+            Full path to the bcolz rootdir for the given sid.
+        """
+        sid_subdir = _sid_subdir_path(sid)
+        return join(self._rootdir, sid_subdir)
+
+    def _init_ctable(self, path, first_position):
+        """
+        Create empty ctable for given path, starting at ``first_position``.
+        """
+        sid_containing_dirname = os.path.dirname(path)
+        # Other sids may have already created the containing directory,
+        # or create it at the same time in another process.
+        os.makedirs(sid_containing_dirname, exist_ok=True)
+        initial_array = np.empty(0, np.uint32)
+        table = ctable(
+            rootdir=path,
+            columns=[initial_array] * len(self.COL_NAMES),
+            names=list(self.COL_NAMES),
+            expectedlen=self._expectedlen,
+            cparams=self.CPARAMS,
+            mode='w',
+        )
+        table.attrs['first_position'] = int(first_position)
+        table.flush()
+        return table
+
+    def _open_ctable(self, sid):
+        """The ctable of ``sid`` for appending, None if there is none."""
+        sidpath = self.sidpath(sid)
+        if not os.path.exists(sidpath):
+            return None
+        return bcolz.ctable(rootdir=sidpath, mode='a')
+
+    def last_dt_in_output_for_sid(self, sid):
+        """
+        Parameters
+        ----------
+        sid : int
+            Asset identifier.
+
+        Returns
+        -------
+        out : pd.Timestamp
+            The start of the last bar written for the given sid, NaT if
+            nothing has been written yet.
+        """
+        table = self._open_ctable(sid)
+        if table is None or len(table) == 0:
+            return pd.NaT
+        return self._index.bar(table.attrs['first_position'] + len(table) - 1)
+
+    def truncate_sid(self, sid, dt):
+        """
+        Drop all bars starting at or after ``dt`` from the ctable of the
+        given sid, so that they can be written again.
+
+        Parameters
+        ----------
+        sid : int
+            Asset identifier.
+        dt : datetime-like
+            The start of the first bar to drop.
+        """
+        table = self._open_ctable(sid)
+        if table is None:
+            return
+        # the first bar starting at or after dt
+        period = self._index.period_nanos
+        pos = -((self._index.start_nanos - pd.Timestamp(dt).value) // period)
+        keep = max(0, pos - table.attrs['first_position'])
+        if len(table) > keep:
+            logger.info("Truncating sid={0} at dt={1}", sid, dt)
+            table.resize(keep)
+
+    def write(self, data, show_progress=False, invalid_data_behavior='warn'):
+        """Write a stream of bars.
+
+        Parameters
+        ----------
+        data : iterable[(int, pd.DataFrame)]
+            The data to write, see BcolzMinuteBarWriter.write. The index of
+            a DataFrame holds the start of each bar.
+        show_progress : bool, optional
+            Whether or not to show a progress bar while writing.
+        """
+        ctx = maybe_show_progress(
+            data,
+            show_progress=show_progress,
+            item_show_func=lambda e: e if e is None else str(e[0]),
+            label="Merging bar files:",
+        )
+        write_sid = self.write_sid
+        with ctx as it:
+            for e in it:
+                write_sid(*e, invalid_data_behavior=invalid_data_behavior)
+
+    def write_sid(self, sid, df, invalid_data_behavior='warn'):
+        """
+        Write the OHLCV data for the given sid, see
+        BcolzMinuteBarWriter.write_sid.
+        """
+        cols = {
+            'open': df.open.values,
+            'high': df.high.values,
+            'low': df.low.values,
+            'close': df.close.values,
+            'volume': df.volume.values,
+        }
+        self._write_cols(sid, df.index.values, cols, invalid_data_behavior)
+
+    def write_cols(self, sid, dts, cols, invalid_data_behavior='warn'):
+        """
+        Write the OHLCV data for the given sid, see
+        BcolzMinuteBarWriter.write_cols.
+        """
+        if not all(len(dts) == len(cols[name]) for name in self.COL_NAMES):
+            raise BcolzMinuteWriterColumnMismatch(
+                "Length of dts={0} should match cols: {1}".format(
+                    len(dts),
+                    " ".join("{0}={1}".format(name, len(cols[name]))
+                             for name in self.COL_NAMES)))
+        self._write_cols(sid, dts, cols, invalid_data_behavior)
+
+    def _write_cols(self, sid, dts, cols, invalid_data_behavior):
+        """
+        Internal method for `write_cols` and `write`. Bars between the
+        last bar written and the first bar of ``dts`` are filled with 0s.
+        """
+        if len(dts) == 0:
+            return
+        positions = self._index.positions(dts)
+        if positions[0] < 0 or positions[-1] >= self._index.num_bars:
+            raise ValueError(
+                "dts from {0} to {1} are not within sessions {2} to "
+                "{3}".format(dts[0], dts[-1], self._start_session,
+                             self._end_session))
+        if np.any(np.diff(positions) <= 0):
+            raise ValueError(
+                "dts for sid={0} must be increasing, one per bar of {1} "
+                "seconds".format(sid, self._bar_period))
+
+        table = self._open_ctable(sid)
+        if table is None:
+            table = self._init_ctable(self.sidpath(sid), positions[0])
+        elif len(table) == 0:
+            table.attrs['first_position'] = int(positions[0])
+        next_position = table.attrs['first_position'] + len(table)
+        if positions[0] < next_position:
+            raise BcolzMinuteOverlappingData(dedent("""
+            Data with last_dt={0} already includes input start={1} for
+            sid={2}""".strip()).format(
+                self._index.bar(next_position - 1), pd.Timestamp(dts[0]),
+                sid))
+
+        count = positions[-1] - next_position + 1
+        dt_ixs = positions - next_position
+        out = [np.zeros(count, dtype=np.uint32) for _ in self.COL_NAMES]
+        converted = convert_cols(
+            cols, self.ohlc_ratio_for_sid(sid), sid, invalid_data_behavior)
+        for col, values in zip(out, converted):
+            col[dt_ixs] = values
+
+        table.append(out)
+        table.flush()
+
+
+class BcolzBarReader(BarReader):
+    """
+    Reader for data written by BcolzBarWriter.
+
+    Parameters
+    ----------
+    rootdir : string
+        The root directory containing the metadata and asset bcolz
+        directories.
+
+    See Also
+    --------
+    zipline.data.minute_bars.BcolzBarWriter
+    """
+    FIELDS = ('open', 'high', 'low', 'close', 'volume')
+
+    def __init__(self, rootdir):
+        self._rootdir = rootdir
+
+        metadata = BcolzBarMetadata.read(rootdir)
+        self._start_session = metadata.start_session
+        self._end_session = metadata.end_session
+        self.calendar = metadata.calendar
+        self._bar_period = metadata.bar_period
+        self._index = _BarIndex(
+            self.calendar, self._start_session, self._end_session,
+            self._bar_period)
+
+        self._default_ohlc_inverse = 1.0 / metadata.default_ohlc_ratio
+        ohlc_ratios = metadata.ohlc_ratios_per_sid
+        if ohlc_ratios:
+            self._ohlc_inverses_per_sid = (
+                valmap(lambda x: 1.0 / x, ohlc_ratios))
+        else:
+            self._ohlc_inverses_per_sid = None
+
+        # sid -> (first position, ctable)
+        self._tables = {}
+
+    @property
+    def data_frequency(self):
+        return "{0}s".format(self._bar_period)
+
+    @property
+    def bar_period(self):
+        return self._bar_period
+
+    @property
+    def trading_calendar(self):
+        return self.calendar
+
+    @lazyval
+    def last_available_dt(self):
+        return self._index.bar(self._index.num_bars - 1)
+
+    @property
+    def first_trading_day(self):
+        return self._start_session
+
+    def _ohlc_ratio_inverse_for_sid(self, sid):
+        if self._ohlc_inverses_per_sid is not None:
+            try:
+                return self._ohlc_inverses_per_sid[sid]
+            except KeyError:
+                pass
+        return self._default_ohlc_inverse
+
+    def _open_table(self, sid):
+        sid = int(sid)
+        try:
+            return self._tables[sid]
+        except KeyError:
+            pass
+        path = os.path.join(self._rootdir, _sid_subdir_path(sid))
+        try:
+            table = bcolz.ctable(rootdir=path, mode='r')
+        except IOError:
+            raise NoDataForSid('No bar data for sid {}.'.format(sid))
+        self._tables[sid] = entry = (table.attrs['first_position'], table)
+        return entry
+
+    def _position(self, dt):
+        pos = self._index.position(dt)
+        if pos < 0 or pos >= self._index.num_bars:
+            raise NoDataOnDate()
+        return pos
+
+    def get_value(self, sid, dt, field):
+        """
+        Retrieve the pricing info for the given sid, dt, and field, see
+        BcolzMinuteBarReader.get_value. dt may be any time within a bar.
+        """
+        pos = self._position(dt)
+        first, table = self._open_table(sid)
+        if first <= pos < first + len(table):
+            value = table.cols[field][pos - first]
+        else:
+            value = 0
+        if value == 0:
+            if field == 'volume':
+                return 0
+            else:
+                return np.nan
+
+        if field != 'volume':
+            value *= self._ohlc_ratio_inverse_for_sid(sid)
+        return value
+
+    def get_last_traded_dt(self, asset, dt):
+        """
+        The start of the last bar with volume at or before ``dt``, NaT if
+        there is none.
+        """
+        pos = min(self._index.position(dt), self._index.num_bars - 1)
+        first, table = self._open_table(asset)
+        volumes = table.cols['volume']
+        end = min(pos - first + 1, len(volumes))
+        # search backwards, one day of bars at a time
+        step = 24 * 3600 // self._bar_period
+        while end > 0:
+            start = max(0, end - step)
+            traded = np.flatnonzero(volumes[start:end])
+            if len(traded):
+                return self._index.bar(first + start + traded[-1])
+            end = start
+        return pd.NaT
+
+    def load_raw_arrays(self, fields, start_dt, end_dt, sids):
+        """
+        Parameters
+        ----------
+        fields : list of str
+           'open', 'high', 'low', 'close', or 'volume'
+        start_dt: Timestamp
+           Beginning of the window range.
+        end_dt: Timestamp
+           End of the window range.
+        sids : list of int
+           The asset identifiers in the window.
+
+        Returns
+        -------
+        list of np.ndarray
+            A list with an entry per field of ndarrays with shape
+            (bars in range, sids) with a dtype of float64, containing the
+            values for the respective field over start and end dt range.
+        """
+        start_pos = self._position(start_dt)
+        end_pos = self._position(end_dt)
+        shape = end_pos - start_pos + 1, len(sids)
+
+        results = []
+        for field in fields:
+            if field != 'volume':
+                out = np.full(shape, np.nan)
+            else:
+                out = np.zeros(shape, dtype=np.uint32)
+            results.append(out)
+
+        for i, sid in enumerate(sids):
+            first, table = self._open_table(sid)
+            lo = max(start_pos, first)
+            hi = min(end_pos + 1, first + len(table))
+            if lo >= hi:
+                continue
+            for field, out in zip(fields, results):
+                values = table.cols[field][lo - first:hi - first]
+                where = values != 0
+                dest = out[lo - start_pos:hi - start_pos, i]
+                if field != 'volume':
+                    dest[where] = (
+                        values[where] * self._ohlc_ratio_inverse_for_sid(sid))
+                else:
+                    dest[where] = values[where]
         return results
 
 
@@ -0,0 +1,119 @@
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+# Get an instance of a logger
+logger = logging.getLogger('django')
+
+
+def _with_retry(fetch, blob, retries, backoff):
+	"""Call fetch(blob), retry with exponential backoff if it fails.
+
+	Parameters:
+	fetch : callable, takes a blob
+	blob : object with a name attribute, e.g. google.cloud.storage.Blob
+	retries : int, number of retries after the first failed attempt
+	backoff : float, seconds to wait before the first retry, doubled after
+			every further failed attempt
+
+	Returns:
+	Return value of fetch(blob)
+	"""
+	attempt = 0
+	while True:
+		try:
+			return fetch(blob)
+		except Exception:
+			if attempt >= retries:
+				raise
+			logger.warning('Retry downloading '+blob.name)
+			time.sleep(backoff * 2**attempt)
+			attempt += 1
+
+
+def _run_concurrently(blobs, fetch, handler, max_workers, retries, backoff):
+	"""Run fetch for all blobs in a bounded thread pool.
+	handler is called in the calling thread as soon as a blob is fetched,
+	so its work overlaps with the downloads still running. If a blob still
+	fails after all retries, the remaining downloads are cancelled and the
+	exception of that blob is raised.
+
+	Parameters:
+	blobs : list, blobs to fetch
+	fetch : callable, takes a blob, returns (size in bytes, result)
+	handler : callable, takes a blob and its result
+	max_workers : int, maximum number of downloads running at the same time
+	retries : int, number of retries per blob
+	backoff : float, seconds to wait before the first retry of a blob
+
+	Returns:
+	outputs : list, return values of handler, in the order of blobs
+	"""
+	start = time.time()
+	total_bytes = 0
+	outputs = [None] * len(blobs)
+
+	with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+		futures = {executor.submit(_with_retry, fetch, blob, retries, backoff): idx
+					for idx, blob in enumerate(blobs)}
+		try:
+			for future in as_completed(futures):
+				idx = futures[future]
+				size, result = future.result()
+				total_bytes += size
+				outputs[idx] = handler(blobs[idx], result)
+		except:
+			for future in futures:
+				future.cancel()
+			raise
+
+	duration = max(time.time() - start, 1e-6)
+	logger.info('Downloaded {0} files, {1} bytes in {2:.1f} s ({3:.0f} bytes/s)'
+				.format(len(blobs), total_bytes, duration, total_bytes/duration))
+	return outputs
+
+
+def download_blobs(blobs, dest_path, max_workers=8, retries=3, backoff=1.0):
+	"""Download blobs concurrently to files in dest_path.
+
+	Parameters:
+	blobs : list, blobs to download, each with a name attribute and
+			download_to_filename(), e.g. google.cloud.storage.Blob
+	dest_path : string, path of the directory to save the files to
+	max_workers, retries, backoff : see _run_concurrently
+
+	Returns:
+	names : list, names of downloaded blobs, in the order of blobs
+	"""
+	def fetch(blob):
+		filename = os.path.join(dest_path, blob.name)
+		blob.download_to_filename(filename)
+		return os.path.getsize(filename), blob.name
+
+	return _run_concurrently(blobs, fetch, lambda blob, name: name,
+							max_workers, retries, backoff)
+
+
+def fetch_blobs(blobs, handler, max_workers=8, retries=3, backoff=1.0):
+	"""Download blobs concurrently into memory, without temp files.
+
+	Parameters:
+	blobs : list, blobs to download, each with a name attribute and
+			download_as_string(), e.g. google.cloud.storage.Blob
+	handler : callable, takes the name and the content (bytes) of a blob.
+			Called in the calling thread as soon as the blob arrives
+	max_workers, retries, backoff : see _run_concurrently
+
+	Returns:
+	outputs : list, return values of handler, in the order of blobs
+	"""
+	def fetch(blob):
+		raw = blob.download_as_string()
+		return len(raw), raw
+
+	return _run_concurrently(blobs, fetch,
+							lambda blob, raw: handler(blob.name, raw),
+							max_workers, retries, backoff)
+
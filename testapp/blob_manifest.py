@@ -0,0 +1,139 @@
+import calendar
+import logging
+import re
+import sqlite3
+from datetime import datetime
+
+from .get_prefixes import get_prefixes
+from .object_store import list_objects
+
+
+# Get an instance of a logger
+logger = logging.getLogger('django')
+
+# listed ranges are extended backwards by this many seconds on every update,
+# in case files of the last minutes were uploaded late
+LIST_OVERLAP = 600
+
+# a filename uses a UNIX timestamp as prefix
+_timestamp_prefix = re.compile(r'^(\d{10})')
+
+
+def to_timestamp(timestr):
+	"""Convert a string in format of "2018-11-01 00:20:00", UTC, to a UNIX timestamp."""
+	return calendar.timegm(datetime.strptime(timestr, '%Y-%m-%d %H:%M:%S').timetuple())
+
+
+def _format_time(timestamp):
+	return datetime.utcfromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def blob_timestamp(blob):
+	"""UNIX timestamp of a crawler file.
+	Taken from the filename, or from the creation time of the blob if the
+	filename does not start with a timestamp.
+	"""
+	match = _timestamp_prefix.match(blob.name)
+	if match is not None:
+		return int(match.group(1))
+	created = getattr(blob, 'time_created', None)
+	if created is None:
+		return None
+	return calendar.timegm(created.utctimetuple())
+
+
+class BlobManifest(object):
+	"""Persistent local index of crawler files in idp_crypto bucket.
+	Keeps name, timestamp, size and generation of every listed blob and the
+	time range that has been listed, so that files of a time range are
+	found with an indexed query and the bucket is only listed for times
+	not seen before.
+
+	Parameters:
+	db_path : string, path of the SQLite file
+	"""
+
+	def __init__(self, db_path):
+		self.db_path = db_path
+		with self._connect() as conn:
+			conn.execute('CREATE TABLE IF NOT EXISTS blobs ('
+						'name TEXT PRIMARY KEY, timestamp INTEGER, '
+						'size INTEGER, generation INTEGER)')
+			conn.execute('CREATE INDEX IF NOT EXISTS blobs_timestamp '
+						'ON blobs (timestamp)')
+			conn.execute('CREATE TABLE IF NOT EXISTS listed ('
+						'key TEXT PRIMARY KEY, value INTEGER)')
+
+	def _connect(self):
+		return sqlite3.connect(self.db_path, timeout=60)
+
+	def listed_range(self):
+		"""Time range covered by listing, (None, None) if nothing was listed."""
+		with self._connect() as conn:
+			values = dict(conn.execute('SELECT key, value FROM listed').fetchall())
+		return values.get('from'), values.get('until')
+
+	def add(self, blobs):
+		"""Insert or update blobs in the manifest.
+
+		Returns:
+		count : int, number of blobs added
+		"""
+		rows = [(blob.name, blob_timestamp(blob), getattr(blob, 'size', None),
+				getattr(blob, 'generation', None)) for blob in blobs]
+		with self._connect() as conn:
+			conn.executemany('INSERT OR REPLACE INTO blobs VALUES (?,?,?,?)', rows)
+		return len(rows)
+
+	def _list(self, bucket, start, end):
+		"""List blobs of files created in [start, end) from bucket."""
+		# names start with the timestamp, without listing from a name on
+		# only the date prefixes of the range are listed
+		return list_objects(bucket, start=str(start), end=str(end),
+					fallback_prefixes=get_prefixes(_format_time(start),
+												end=_format_time(end)))
+
+	def update(self, bucket, start, end):
+		"""List the parts of [start, end) that are not in the manifest yet.
+
+		Parameters:
+		bucket : crawler data bucket, see object_store.py
+		start : int, UNIX timestamp
+		end : int, UNIX timestamp
+		"""
+		listed_from, listed_until = self.listed_range()
+		if listed_from is None:
+			ranges = [(start, end)]
+		else:
+			ranges = []
+			if start < listed_from:
+				ranges.append((start, listed_from))
+			if end > listed_until - LIST_OVERLAP:
+				ranges.append((listed_until - LIST_OVERLAP, end))
+
+		for range_start, range_end in ranges:
+			count = self.add(self._list(bucket, range_start, range_end))
+			logger.info('Listed {0} blobs from {1} to {2}'.format(count,
+						_format_time(range_start), _format_time(range_end)))
+
+		if ranges:
+			if listed_from is not None:
+				start = min(start, listed_from)
+				end = max(end, listed_until)
+			with self._connect() as conn:
+				conn.executemany('INSERT OR REPLACE INTO listed VALUES (?,?)',
+								[('from', start), ('until', end)])
+
+	def select(self, start, end, suffix=''):
+		"""Names of files created in [start, end), in the order of names.
+
+		Parameters:
+		start : int, UNIX timestamp
+		end : int, UNIX timestamp
+		suffix : string, only return names ending with suffix
+		"""
+		with self._connect() as conn:
+			rows = conn.execute('SELECT name FROM blobs '
+						'WHERE timestamp >= ? AND timestamp < ? ORDER BY name',
+						(start, end)).fetchall()
+		return [name for name, in rows if name.endswith(suffix)]
@@ -0,0 +1,413 @@
+import logging
+import os
+import shutil
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+from zipline.data.bar_reader import NoDataForSid
+from zipline.data.bundles.core import (
+	asset_db_path,
+	ingestions_for_bundle,
+	minute_equity_path,
+	to_bundle_ingest_dirname,
+)
+from zipline.data.minute_bars import (
+	BcolzBarMetadata,
+	BcolzBarWriter,
+	BcolzMinuteBarMetadata,
+	BcolzMinuteBarWriter,
+)
+
+from . import price_store
+
+
+# Get an instance of a logger
+logger = logging.getLogger('django')
+
+# minute bar writers of a worker process of ingest_parallel, by directory
+_worker_writers = {}
+
+
+def latest_ingestion(bundle_name, environ=None):
+	"""Directory name of the latest ingestion of a bundle, None if there is none."""
+	try:
+		ingestions = ingestions_for_bundle(bundle_name, environ=environ)
+	except OSError:  # bundle directory does not exist
+		return None
+	if not ingestions:
+		return None
+	return to_bundle_ingest_dirname(ingestions[0])
+
+
+def read_sids(db_path):
+	"""Read sids of all assets from an asset db.
+
+	Returns:
+	sids : dict, symbol -> sid
+	"""
+	with sqlite3.connect(db_path) as conn:
+		rows = conn.execute('SELECT symbol, sid FROM equity_symbol_mappings').fetchall()
+	return dict(rows)
+
+
+def update_end_dates(db_path, end_dates):
+	"""Set end date and auto close date of assets in an asset db, in the
+	same way as the csvdir bundle does.
+
+	Parameters:
+	db_path : string, path of the asset db
+	end_dates : dict, sid -> pd.Timestamp of the last minute with data
+	"""
+	with sqlite3.connect(db_path) as conn:
+		for sid, end_date in end_dates.items():
+			auto_close_date = end_date + pd.Timedelta(days=1)
+			conn.execute('UPDATE equities SET end_date=?, auto_close_date=? '
+						'WHERE sid=?', (end_date.value, auto_close_date.value, sid))
+			conn.execute('UPDATE equity_symbol_mappings SET end_date=? '
+						'WHERE sid=?', (end_date.value, sid))
+
+
+def ingest_incremental(bundle_name, store_path, symbols, since=None, environ=None,
+					uncompressed=False):
+	"""Append new price data to the latest ingestion of a bundle in place,
+	instead of rebuilding the whole bundle with zipline ingest.
+
+	For every asset, minutes at or after since[symbol] are dropped from the
+	bundle, then all price data after the last minute left in the bundle is
+	read from the price store and appended. End dates in the asset db and
+	the end session in minute bar metadata are updated.
+
+	Parameters:
+	bundle_name : string, name of the bundle
+	store_path : string, path of the price store
+	symbols : list, asset symbols
+	since : dict, symbol -> first date changed in the price store, optional
+	environ : mapping, environment variables for locating zipline data
+	uncompressed : bool, also update the uncompressed copies of minute bar
+			columns that readers memory-map, see write_uncompressed
+
+	Returns:
+	done : bool, False if there is no ingestion to update or an asset is
+			not in the bundle yet. Nothing is written then, and a full
+			ingestion is needed.
+	"""
+	since = since or {}
+	timestr = latest_ingestion(bundle_name, environ=environ)
+	if timestr is None:
+		return False
+
+	db_path = asset_db_path(bundle_name, timestr, environ=environ)
+	minute_path = minute_equity_path(bundle_name, timestr, environ=environ)
+
+	sids = read_sids(db_path)
+	if any(symbol not in sids for symbol in symbols):
+		logger.info('New assets, bundle '+bundle_name+' needs a full ingestion')
+		return False
+
+	# extend the end session in metadata if new data goes beyond it
+	metadata = BcolzMinuteBarMetadata.read(minute_path)
+	end_session = None
+	for symbol in symbols:
+		last = price_store.last_date(store_path, symbol)
+		if last is None:
+			continue
+		last_session = metadata.calendar.minute_to_session_label(
+								last.tz_localize('UTC'), direction='previous')
+		if last_session > metadata.end_session:
+			end_session = max(end_session or last_session, last_session)
+	writer = BcolzMinuteBarWriter.open(minute_path, end_session=end_session)
+
+	end_dates = {}
+	for symbol in symbols:
+		sid = sids[symbol]
+		if since.get(symbol) is not None:
+			writer.truncate_sid(sid, since[symbol])
+
+		last_minute = writer.last_minute_in_output_for_sid(sid)
+		if pd.isnull(last_minute):
+			start = None
+		else:
+			start = last_minute.tz_convert('UTC').tz_localize(None) + pd.Timedelta('1 min')
+		data = price_store.read_frame(store_path, symbol, start=start)
+		if len(data):
+			data = data.set_index('date')
+			data.index = data.index.tz_localize('UTC')
+			writer.write_sid(sid, data)
+			end_dates[sid] = data.index[-1]
+			logger.info('Bundle '+bundle_name+': appended {0} minutes of {1}'
+						.format(len(data), symbol))
+		if uncompressed:
+			changed = since.get(symbol)
+			writer.write_uncompressed(sid, start if changed is None else changed)
+
+	update_end_dates(db_path, end_dates)
+	return True
+
+
+def write_uncompressed(bundle_name, environ=None):
+	"""Write uncompressed copies of all minute bar columns of the latest
+	ingestion of a bundle, e.g. after a full ingestion. BcolzMinuteBarReader
+	memory-maps them instead of decompressing the bcolz carrays.
+
+	Parameters:
+	bundle_name : string, name of the bundle
+	environ : mapping, environment variables for locating zipline data
+	"""
+	timestr = latest_ingestion(bundle_name, environ=environ)
+	if timestr is None:
+		return
+	sids = read_sids(asset_db_path(bundle_name, timestr, environ=environ))
+	writer = BcolzMinuteBarWriter.open(
+					minute_equity_path(bundle_name, timestr, environ=environ))
+	for sid in sorted(sids.values()):
+		writer.write_uncompressed(sid)
+	logger.info('Bundle '+bundle_name+': wrote uncompressed minute bars of '
+				'{0} assets'.format(len(sids)))
+
+
+def ingest_bars(bundle_name, rootdir, store_path, symbols, bar_period,
+				since=None, environ=None):
+	"""Write sub-minute bars from a price store of bars, e.g. of 10
+	seconds, with BcolzBarWriter. Assets have the same sids as in the latest
+	ingestion of a bundle, and bars are based on its calendar.
+
+	Bars are appended in place, as in ingest_incremental. If there are no
+	bars in rootdir yet, or bars of another period, all stored bars are
+	written.
+
+	Nothing in the app reads these bars yet, backtests and data downloads
+	use minute bars. Read them with BcolzBarReader.
+
+	Parameters:
+	bundle_name : string, name of the bundle
+	rootdir : string, directory of the bars
+	store_path : string, path of the price store of bars
+	symbols : list, asset symbols, assets not in the bundle are skipped
+	bar_period : int, seconds per bar
+	since : dict, symbol -> first date changed in the price store, optional
+	environ : mapping, environment variables for locating zipline data
+
+	Returns:
+	done : bool, False if there is no ingestion of the bundle
+	"""
+	since = since or {}
+	timestr = latest_ingestion(bundle_name, environ=environ)
+	if timestr is None:
+		return False
+	sids = read_sids(asset_db_path(bundle_name, timestr, environ=environ))
+	minute_metadata = BcolzMinuteBarMetadata.read(
+					minute_equity_path(bundle_name, timestr, environ=environ))
+	calendar = minute_metadata.calendar
+
+	# bars end with the session of the latest stored bar
+	end_session = None
+	for symbol in symbols:
+		last = price_store.last_date(store_path, symbol)
+		if last is not None:
+			last_session = calendar.minute_to_session_label(
+								last.tz_localize('UTC'), direction='previous')
+			end_session = max(end_session or last_session, last_session)
+	if end_session is None:
+		return True
+
+	try:
+		metadata = BcolzBarMetadata.read(rootdir)
+	except IOError:
+		metadata = None
+	if metadata is not None and metadata.bar_period == bar_period:
+		writer = BcolzBarWriter.open(rootdir,
+						end_session=max(end_session, metadata.end_session))
+	else:
+		if os.path.exists(rootdir):
+			shutil.rmtree(rootdir)
+		writer = BcolzBarWriter(rootdir, calendar,
+						minute_metadata.start_session, end_session, bar_period,
+						minute_metadata.default_ohlc_ratio,
+						minute_metadata.ohlc_ratios_per_sid)
+		since = {}
+
+	period = pd.Timedelta(seconds=bar_period)
+	first_bar = writer.first_trading_day.tz_localize(None)
+	for symbol in symbols:
+		if symbol not in sids:
+			continue
+		sid = sids[symbol]
+		if since.get(symbol) is not None:
+			writer.truncate_sid(sid, since[symbol])
+
+		last_bar = writer.last_dt_in_output_for_sid(sid)
+		if pd.isnull(last_bar):
+			start = first_bar
+		else:
+			start = last_bar.tz_convert('UTC').tz_localize(None) + period
+		data = price_store.read_frame(store_path, symbol, start=start)
+		if len(data) == 0:
+			continue
+		data = data.set_index('date')
+		data.index = data.index.tz_localize('UTC')
+		writer.write_sid(sid, data)
+		logger.info('Bars of {0}s: appended {1} bars of {2}'
+					.format(bar_period, len(data), symbol))
+	return True
+
+
+def _write_stored_prices(rootdir, store_path, symbol, sid):
+	"""Read the price data of an asset from the price store and write its
+	minute bars, in a worker process of ingest_parallel.
+
+	Returns:
+	start_date, end_date : pd.Timestamp, first and last minute with data
+	"""
+	writer = _worker_writers.get(rootdir)
+	if writer is None:
+		# the minute index is computed once per worker process
+		writer = _worker_writers[rootdir] = BcolzMinuteBarWriter.open(rootdir)
+	data = price_store.read_frame(store_path, symbol)
+	if len(data) == 0:
+		raise ValueError('No price data of '+symbol)
+	data = data.set_index('date')
+	data.index = data.index.tz_localize('UTC')
+	writer.write_sid(sid, data)
+	return data.index[0], data.index[-1]
+
+
+def parallel_store_bundle(store_path, max_workers=None, ohlc_ratios=None):
+	"""Ingest function for a bundle of minute data like the csvdir bundle,
+	that reads the price store and writes minute bars in worker processes.
+	Every sid has its own ctable, so assets are written independently.
+	Asset metadata is merged and written when all assets are done.
+
+	Assets get sids in order of symbol, as with the csvdir bundle, and no
+	adjustments. With ohlc_ratios, the OHLC ratio of every sid is written to
+	minute bar metadata before any bars, and symbols without a ratio are
+	skipped.
+
+	Parameters:
+	store_path : string, path of the price store, every asset in it is
+			ingested
+	max_workers : int, number of worker processes, number of CPUs by default
+	ohlc_ratios : dict, symbol -> OHLC ratio, optional. By default the
+			ohlc_ratios of minute_bars.py are used by sid
+
+	Returns:
+	ingest : function, to register as a bundle
+	"""
+	def ingest(environ, asset_db_writer, minute_bar_writer, daily_bar_writer,
+			adjustment_writer, calendar, start_session, end_session, cache,
+			show_progress, output_dir):
+		symbols = price_store.list_symbols(store_path)
+		if ohlc_ratios is not None:
+			skipped = [symbol for symbol in symbols if symbol not in ohlc_ratios]
+			if skipped:
+				logger.warning('No OHLC ratio, not ingested: '+', '.join(skipped))
+			symbols = [symbol for symbol in symbols if symbol in ohlc_ratios]
+			# rewrite metadata with ratios by sid, workers open the writer from it
+			minute_metadata = BcolzMinuteBarMetadata.read(minute_bar_writer.rootdir)
+			BcolzMinuteBarWriter(minute_bar_writer.rootdir,
+						minute_metadata.calendar,
+						minute_metadata.start_session,
+						minute_metadata.end_session,
+						minute_metadata.minutes_per_day,
+						minute_metadata.default_ohlc_ratio,
+						{sid: ohlc_ratios[symbol] for sid, symbol in enumerate(symbols)})
+
+		with ProcessPoolExecutor(max_workers=max_workers) as pool:
+			futures = [pool.submit(_write_stored_prices, minute_bar_writer.rootdir,
+								store_path, symbol, sid)
+						for sid, symbol in enumerate(symbols)]
+			dates = [future.result() for future in futures]
+
+		# index of metadata is the sid
+		metadata = pd.DataFrame({
+			'symbol': symbols,
+			'start_date': [start for start, _ in dates],
+			'end_date': [end for _, end in dates],
+		}, columns=['start_date', 'end_date', 'symbol'])
+		metadata['auto_close_date'] = metadata['end_date'] + pd.Timedelta(days=1)
+		metadata['exchange'] = 'CSVDIR'
+		asset_db_writer.write(equities=metadata)
+		adjustment_writer.write()
+		logger.info('Wrote minute bars of {0} assets with {1} processes'
+					.format(len(symbols), max_workers or os.cpu_count()))
+	return ingest
+
+
+def ingest_parallel(bundle_name, store_path, max_workers=None, environ=None,
+					ohlc_ratios=None):
+	"""Rebuild a bundle from the price store, like zipline ingest with the
+	csvdir bundle from exported asset price files, but in this process and
+	with assets read and written in parallel by parallel_store_bundle.
+
+	Parameters:
+	bundle_name : string, name of the bundle
+	store_path : string, path of the price store
+	max_workers : int, number of worker processes, number of CPUs by default
+	environ : mapping, environment variables for locating zipline data
+	ohlc_ratios : dict, symbol -> OHLC ratio, see parallel_store_bundle
+	"""
+	from zipline.data import bundles
+	from zipline.utils.run_algo import load_extensions
+
+	if environ is None:
+		environ = os.environ
+	# the bundle may be registered in extension.py, as for zipline ingest
+	load_extensions(True, (), False, environ)
+	registered = bundles.bundles.get(bundle_name)
+	options = {}
+	if registered is not None:
+		options = dict(calendar_name=registered.calendar_name,
+					start_session=registered.start_session,
+					end_session=registered.end_session,
+					minutes_per_day=registered.minutes_per_day)
+		bundles.unregister(bundle_name)
+	bundles.register(bundle_name, parallel_store_bundle(store_path, max_workers,
+										ohlc_ratios=ohlc_ratios),
+					**options)
+	try:
+		bundles.ingest(bundle_name, environ=environ)
+	finally:
+		bundles.unregister(bundle_name)
+		if registered is not None:
+			bundles.register(bundle_name, registered.ingest,
+							create_writers=registered.create_writers, **options)
+
+
+def prewarm_bundle(bundle_name, days=30, environ=None):
+	"""Open the readers of the latest ingestion of a bundle and read the
+	last days of minute bars of every asset, so that the files a backtest
+	reads first are in the OS page cache when the first backtest runs.
+	Files are read one asset and field at a time and the values are
+	discarded, so that memory use does not grow with the number of assets.
+
+	Parameters:
+	bundle_name : string, name of the bundle
+	days : int, number of days of minute bars to read
+	environ : mapping, environment variables for locating zipline data
+
+	Returns:
+	minutes : int, number of minutes read per asset and field, 0 if there
+			is no ingestion
+	"""
+	from zipline.data.bundles import load
+
+	if latest_ingestion(bundle_name, environ=environ) is None:
+		return 0
+	bundle_data = load(bundle_name, environ=environ)
+	sids = list(bundle_data.asset_finder.sids)
+	if not sids:
+		return 0
+	bundle_data.asset_finder.retrieve_all(sids)
+
+	reader = bundle_data.equity_minute_bar_reader
+	end = reader.last_available_dt
+	start = max(reader.first_trading_day, end - pd.Timedelta(days=days))
+	start_pos = reader._find_position_of_minute(start)
+	end_pos = reader._find_position_of_minute(end) + 1
+	for sid in sids:
+		for field in ('open', 'high', 'low', 'close', 'volume'):
+			try:
+				reader._open_minute_file(field, sid)[start_pos:end_pos]
+			except NoDataForSid:
+				continue
+	return end_pos - start_pos
@@ -1,10 +1,15 @@
 import gc
 import logging
 import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from io import BytesIO
 
-from google.cloud import storage
+import numpy as np
 import pandas as pd
 
+from . import price_store
+from .object_store import get_bucket
+
 
 # Get an instance of a logger
 logger = logging.getLogger('django')
@@ -13,105 +18,329 @@ default_symbols = ['BTCUSDT','ETHBTC','XLMBTC','XRPBTC']
 
 GS_ASSETS_BUCKET_NAME = 'idp_backtest_assets'
 
+# columns read from *-aggregates.csv files and their types
+MUST_HAVE_COLS = ['symbol','eventTime','openPrice',
+				'highPrice','lowPrice','price','volume']
+AGGREGATES_DTYPES = {'symbol': str, 'eventTime': str, 'openPrice': np.float64,
+					'highPrice': np.float64, 'lowPrice': np.float64,
+					'price': np.float64, 'volume': np.float64}
+# format of eventTime written by the crawler. Parsing with an explicit
+# format is much faster than letting pandas infer it
+EVENT_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def repair_timestamps(dates):
+	"""Fix duplicate and skewed minute timestamps in one columnar pass.
+
+	Same rule as repair_timestamps_loop: compared to the previous (already
+	repaired) timestamp, a duplicate, a gap of 2 or 3 minutes or a negative
+	gap is replaced with previous + 1 min; every other row is kept.
+
+	With e_i = repaired_i - i (in minutes), a kept row sets e_i = c_i where
+	c_i = raw_i - i, and a shifted row keeps e_i = e_(i-1). A row is kept
+	only if c_i > e_(i-1) + 2. c is constant wherever the raw data advances
+	by exactly one minute, so the recurrence only has to be evaluated at the
+	rows where c changes; the result is then forward filled.
+
+	Parameters:
+	dates : pd.Series, datetimes floored to minutes
+
+	Returns:
+	dates : pd.Series, repaired datetimes with the same index
+	"""
+	if len(dates) == 0:
+		return dates
+
+	minutes = dates.values.astype('datetime64[m]').astype(np.int64)
+	c = minutes - np.arange(len(minutes), dtype=np.int64)
+
+	# rows where c changes, the first row always starts a run
+	starts = np.flatnonzero(np.diff(c)) + 1
+	starts = np.concatenate(([0], starts))
+
+	run_e = np.empty(len(starts), dtype=np.int64)
+	e = c[0]
+	for j, c_start in enumerate(c[starts].tolist()):
+		if c_start > e + 2:
+			e = c_start
+		run_e[j] = e
+
+	e = np.repeat(run_e, np.diff(np.append(starts, len(c))))
+	shift = pd.to_timedelta(e - c, unit='m')
+	return dates + shift.values
+
+
+def repair_timestamps_loop(data):
+	"""Row by row version of repair_timestamps, kept for checking results.
+
+	Parameters:
+	data : pd.DataFrame, with a 'date' column floored to minutes and a
+			default RangeIndex. Repaired in place.
+	"""
+	# to compare to the 1st row, set the initial as time of 1st row minus 1min
+	row1_date = data.at[0,'date'] - pd.Timedelta('1 min')
+	okay = pd.Timedelta('1 min')
+	too_far = pd.Timedelta('3 min')  # too_close = 0
+	for row2 in data.itertuples():  # should work faster than iterrows
+		if row2.date == row1_date:  # duplicate timestamps: the latter one += 1 min
+			data.at[row2.Index,'date'] += okay
+		else:
+			time_diff = row2.date - row1_date
+			# diff = 2, 3, or diff < 0
+			if not (time_diff == okay or time_diff > too_far):
+				data.at[row2.Index, 'date'] = row1_date + okay
+		row1_date = data.at[row2.Index,'date']
+
+
+def to_bars(data, bar_period):
+	"""Bars of bar_period seconds from crawler rows of one asset.
+	Rows are kept at the resolution of eventTime, floored to the bar
+	period, instead of being shifted to free minutes. Of several rows in one
+	bar, the latest is kept.
+
+	Parameters:
+	data : pd.DataFrame, with a 'date' column of eventTime, in the order of
+			the *-aggregates.csv files
+	bar_period : int, seconds per bar
+
+	Returns:
+	data : pd.DataFrame, one row per bar, sorted by date
+	"""
+	data['date'] = data['date'].dt.floor('{0}s'.format(bar_period))
+	# stable, so that the last row of a bar is the latest collected
+	data = data.sort_values('date', kind='mergesort')
+	return data.drop_duplicates('date', keep='last').reset_index(drop=True)
+
+
+def parse_aggregates(raw, name=''):
+	"""Parse the content of one *-aggregates.csv file.
+	Only the columns in MUST_HAVE_COLS are read, with fixed dtypes.
+
+	Parameters:
+	raw : bytes, content of a *-aggregates.csv file
+	name : string, name of the file, for logging
+
+	Returns:
+	part : pd.DataFrame with columns MUST_HAVE_COLS and eventTime parsed
+			to datetime, or None if the file is empty or a defect
+	"""
+	try:
+		part = pd.read_csv(BytesIO(raw), usecols=MUST_HAVE_COLS,
+						dtype=AGGREGATES_DTYPES)
+	except pd.errors.EmptyDataError:  # *-aggregates.csv empty due to crawler error
+		return None
+	except ValueError:
+		# a file must contain all cols in MUST_HAVE_COLS, otherwise it is a defect
+		# ignore defects for now
+		logger.info('Defect: '+name)
+		return None
+	# usecols keeps the order of columns in the file
+	part = part[MUST_HAVE_COLS]
+
+	try:
+		part['eventTime'] = pd.to_datetime(part['eventTime'],
+										format=EVENT_TIME_FORMAT)
+	except ValueError:  # not in EVENT_TIME_FORMAT, let pandas infer the format
+		part['eventTime'] = pd.to_datetime(part['eventTime'])
+	return part
+
+
+def split_by_symbol(part, symbols=None):
+	"""Separate parsed crawler data according to assets in one grouped pass,
+	so that the cost does not grow with the number of assets.
 
-def concat_new_csvs(csv_path, csv_names, arranged_path, symbols=default_symbols):
+	Parameters:
+	part : pd.DataFrame, returned by parse_aggregates, may be None
+	symbols : list, asset symbols to keep, optional, all assets are kept
+			by default
+
+	Returns:
+	frames : dict, symbol -> pd.DataFrame without symbol column
+	"""
+	frames = {}
+	if part is None:
+		return frames
+	wanted = None if symbols is None else set(symbols)
+	for sym, group in part.groupby('symbol', sort=False):
+		if wanted is None or sym in wanted:
+			frames[sym] = group.drop(columns=['symbol'])
+	return frames
+
+
+def concat_new_csvs(csv_path, csv_names, store_path,
+					symbols=default_symbols, vectorized=True):
 	"""Price data preparation process.
-	Clean newly downloaded data and concat to old price files.
+	Clean newly downloaded data and concat to old price data.
 
 	Parameters:
 	csv_path : string, path of newly downloaded *-aggregates.csv files
 	csv_names : list, names of newly downloaded *-aggregates.csv files
-	arranged_path : string, path of old asset price files
+	store_path : string, path of the price store, see price_store.py
 	symbols : list, asset symbols
+	vectorized : bool, see concat_new_frames
 
 	Returns:
-	No return values. New price files are saved to arranged_path.
+	first_dates : dict, see concat_new_frames
 	"""
-	dataset = [[] for symbol in symbols]  # init an empty list
-	must_have_cols = ['symbol','eventTime','openPrice',
-					'highPrice','lowPrice','price','volume']
-
-	if not os.path.exists(arranged_path):
-		os.makedirs(arranged_path)
-	
 	os.chdir(csv_path)
 	
 	# sort csv files by asset type and remove unwanted columns
+	parts = []
 	for csv_name in csv_names:
-		try:
-			part = pd.read_csv(csv_path + csv_name)
-		except:  # mostly EmptyDataError: *-aggregates.csv empty due to crawler error
-			continue
-
-		# a file must contain all cols in must_have_cols, otherwise it is a defect
-		# ignore defects for now. maybe log the filenames later
-		if any(col not in part.columns for col in must_have_cols):
-			logger.info('Defect: '+csv_name)
-			continue
-
-		# keep OHLCV columns, date column and symbol column, drop the rest ones
-		part = part[must_have_cols]
-		# seperate dataset according to assets, drop symbol column
-		for idx,sym in enumerate(symbols):
-			dataset[idx].append((part[part.symbol==sym]).drop(columns=['symbol']))
+		with open(csv_path + csv_name, 'rb') as f:
+			raw = f.read()
+		parts.append(split_by_symbol(parse_aggregates(raw, csv_name), symbols))
 
-	# get GCS bucket for asset files
-	client = storage.Client()
-	bucket = client.get_bucket(GS_ASSETS_BUCKET_NAME)
+	return concat_new_frames(parts, store_path, symbols=symbols,
+							vectorized=vectorized)
 
-	# for every asset: change column names, deal with (possibly) wrong timestamps, 
-	# and concat to old asset file
-	for idx,symbol in enumerate(symbols):
-		# concat data for every single asset
-		data = pd.concat(dataset[idx], ignore_index=True)
-		
-		# this part is moved from the above cell considering time performance
-		# change column names
-		data.columns = ['date','open','high','low','close','volume']
-		# change time format to <YYYY-MM-DD HH:TT:SS> to use dt.floor() directly
-		data['date'] = pd.to_datetime(data['date'])
+
+def _assets_bucket():
+	"""Bucket for asset files, one client per process.
+	A worker process does not use the client inherited from its parent.
+	"""
+	global _bucket
+	if _bucket is None or _bucket[0] != os.getpid():
+		_bucket = (os.getpid(), get_bucket(GS_ASSETS_BUCKET_NAME))
+	return _bucket[1]
+
+# (pid, bucket)
+_bucket = None
+
+
+def _prepare_symbol(store_path, symbol, frames, vectorized, cache,
+					bar_period=None, store_prefix=price_store.GS_STORE_PREFIX):
+	"""Clean new data of one asset and concat it to old price data.
+	Run in a worker process of concat_new_frames.
+
+	Parameters:
+	store_path : string, path of the price store
+	symbol : string, asset symbol
+	frames : list, pd.DataFrame of the asset from split_by_symbol, in the
+			order of the *-aggregates.csv files
+	vectorized : bool, see concat_new_frames
+	cache : ObjectCache or None, see concat_new_frames
+	bar_period : int or None, see concat_new_frames
+	store_prefix : string, see concat_new_frames
+
+	Returns:
+	first_date : pd.Timestamp, date of the first new row
+	months : list, months changed in the price store, or with changes
+			not uploaded yet
+	"""
+	# concat data for every single asset
+	data = pd.concat(frames, ignore_index=True)
+	del frames
+
+	# this part is moved from the above cell considering time performance
+	# change column names
+	data.columns = ['date','open','high','low','close','volume']
+	# eventTime is already parsed, this is a no-op for datetime columns
+	data['date'] = pd.to_datetime(data['date'])
+	if bar_period is not None:
+		data = to_bars(data, bar_period)
+	else:
 		# remove seconds in timestamps to get data in minute frequency
 		data['date'] = data.date.dt.floor('min')
-		
+
 		# deal with (possibly) wrong timestamps
-		# to compare to the 1st row, set the initial as time of 1st row minus 1min
-		row1_date = data.at[0,'date'] - pd.Timedelta('1 min')
-		okay = pd.Timedelta('1 min')
-		too_far = pd.Timedelta('3 min')  # too_close = 0
-		count = 0
-		for row2 in data.itertuples():  # should work faster than iterrows
-			if row2.date == row1_date:  # duplicate timestamps: the latter one += 1 min
-				data.at[row2.Index,'date'] += okay
-			else:
-				time_diff = row2.date - row1_date
-				# diff = 2, 3, or diff < 0
-				if not (time_diff == okay or time_diff > too_far):
-					data.at[row2.Index, 'date'] = row1_date + okay
-			row1_date = data.at[row2.Index,'date']
-				
-		# concat to old file
-		try:
-			old = pd.read_csv(arranged_path+symbol+'.csv')
-		except:  # FileNotFoundError
-			# retrieve old file from GCS bucket
-			fblob = bucket.get_blob(symbol+'.csv')
-			fblob.download_to_filename(arranged_path+symbol+'.csv')
-
-			old = pd.read_csv(arranged_path+symbol+'.csv')
-
-		# drop the last rows if timestamps are not continuous
-		while pd.to_datetime(old.iloc[-1,0]) >= data.iloc[0,0]:
-			old = old[:-1]
-		# concat and rewrite
-		old = pd.concat([old,data], ignore_index=True)
-		old.to_csv(os.path.join(arranged_path,symbol+'.csv'), 
-					index=False, float_format='%.10f')
-
-		# rewrite new asset file to GCS bucket
-		fblob = bucket.blob(symbol+'.csv')
-		fblob.upload_from_filename(arranged_path+symbol+'.csv', 
-									content_type='text/csv')
+		if vectorized:
+			data['date'] = repair_timestamps(data['date'])
+		else:
+			repair_timestamps_loop(data)
+
+	# retrieve old price data from GCS bucket on a fresh instance,
+	# or the objects changed in the bucket if there is a cache. Local
+	# changes a failed upload left behind are uploaded with the new data
+	pending = []
+	if not price_store.has_symbol(store_path, symbol):
+		price_store.download_symbol(_assets_bucket(), store_path, symbol,
+									cache=cache, prefix=store_prefix)
+	elif cache is not None:
+		pending = price_store.sync_symbol(_assets_bucket(), store_path, symbol,
+										cache, prefix=store_prefix)
+
+	# concat to old price data, new rows of an existing month are saved
+	# as a segment, so that only new rows are uploaded
+	months = price_store.append_frame(store_path, symbol, data, segments=True)
+	return data.iloc[0,0], sorted(set(months) | set(pending))
+
+
+def concat_new_frames(parts, store_path, symbols=default_symbols,
+					vectorized=True, max_workers=None, on_prepared=None,
+					cache=None, bar_period=None,
+					store_prefix=price_store.GS_STORE_PREFIX):
+	"""Clean parsed crawler data and concat to old price data.
+	Assets are independent of each other and are prepared in a pool of
+	worker processes. Changed months of an asset are uploaded to GCS in a
+	separate thread, while the workers go on with other assets.
+
+	Parameters:
+	parts : list, dicts returned by split_by_symbol, in the order of the
+			*-aggregates.csv files
+	store_path : string, path of the price store, see price_store.py
+	symbols : list, asset symbols. Assets without new data are skipped
+	vectorized : bool, repair timestamps with repair_timestamps (default)
+			or with the old row by row repair_timestamps_loop
+	max_workers : int, number of worker processes, optional, defaults to
+			the number of CPU cores
+	on_prepared : callable, optional, called with the symbol and the first
+			new date of an asset once its data is saved and uploaded
+	cache : ObjectCache, optional, for syncing old price data with GCS
+			bucket, see price_store.download_symbol
+	bar_period : int, optional, seconds per bar. By default data is
+			prepared in minute frequency with its timestamps repaired,
+			with a bar period data is kept as bars of that period, see
+			to_bars
+	store_prefix : string, prefix of the store objects in GCS bucket
 
+	Returns:
+	first_dates : dict, symbol -> date of the first new row. Stored data
+			from this date on has changed. New price data is saved to
+			store_path.
+	"""
+	first_dates = {}
+	symbols = [symbol for symbol in symbols
+			if any(symbol in part for part in parts)]
+	if not os.path.exists(store_path):
+		os.makedirs(store_path)
+	if not symbols:
+		return first_dates
+	if max_workers is None:
+		max_workers = os.cpu_count() or 1
+	max_workers = max(1, min(max_workers, len(symbols)))
+
+	# get GCS bucket for asset files
+	bucket = _assets_bucket()
+
+	def finish(symbol, months):
+		"""Upload an asset prepared by a worker."""
+		# upload changed months to GCS bucket
+		price_store.upload_months(bucket, store_path, symbol, months,
+								cache=cache, prefix=store_prefix)
 		logger.info('Asset '+symbol+' ok')
+		if on_prepared is not None:
+			on_prepared(symbol, first_dates[symbol])
+
+	# for every asset: change column names, deal with (possibly) wrong timestamps, 
+	# and concat to old price data
+	with ProcessPoolExecutor(max_workers=max_workers) as pool, \
+			ThreadPoolExecutor(max_workers=1) as uploader:
+		futures = {}
+		for symbol in symbols:
+			frames = [part[symbol] for part in parts if symbol in part]
+			futures[pool.submit(_prepare_symbol, store_path, symbol,
+								frames, vectorized, cache, bar_period,
+								store_prefix)] = symbol
+		del frames
+
+		uploads = []
+		for future in as_completed(futures):
+			symbol = futures[future]
+			first_dates[symbol], months = future.result()
+			uploads.append(uploader.submit(finish, symbol, months))
+		for upload in uploads:
+			upload.result()
 
-	gc.collect()
\ No newline at end of file
+	gc.collect()
+	return first_dates
@@ -1,6 +1,9 @@
 import calendar
 import datetime
 
+# collection of a day's data is finished at this time of the next day, UTC
+CUTOFF_TIME = '00:20:00'
+
 def get_prefixes(start, end=None):
 	"""Generate prefixes for searching files in idp_crypto bucket.
 	A filename uses a UNIX timestamp as prefix. Thus we are able to 
@@ -53,7 +56,7 @@ def get_prefixes(start, end=None):
 
 	if end is None:
 		end = datetime.datetime.utcnow().date().strftime('%Y-%m-%d')
-		end = end + ' 00:20:00'
+		end = end + ' ' + CUTOFF_TIME
 	endstamp = calendar.timegm(datetime.datetime.strptime(end, '%Y-%m-%d %H:%M:%S').timetuple())
 	endstamp = int(endstamp)
 
@@ -0,0 +1,91 @@
+"""Checkpoints of an ingest, so that an ingest retried after a failure
+resumes instead of starting over from last_ingest.txt.
+
+Checkpoints are kept under MEDIA_ROOT/checkpoint/:
+blobs/<blob name>.pkl : crawler file already downloaded, parsed and split
+		by asset. Content of a crawler file never changes, so these are
+		kept until an ingest completes, whatever its time range.
+state.json : time range of the ingest and assets already prepared in it,
+		with the first date changed in the price store.
+"""
+import json
+import logging
+import os
+import shutil
+from urllib.parse import quote
+
+import pandas as pd
+
+
+# Get an instance of a logger
+logger = logging.getLogger('django')
+
+
+class IngestCheckpoint(object):
+	"""Checkpoints of an ingest of data from starttime to endtime.
+	Asset checkpoints of an ingest of another time range are discarded.
+
+	Parameters:
+	root : string, path of the checkpoint directory
+	starttime : string, e.g. "2018-11-01 00:20:00", UTC
+	endtime : string, UTC
+	"""
+
+	def __init__(self, root, starttime, endtime):
+		self.root = root
+		self.blobs_path = os.path.join(root, 'blobs/')
+		self.state_file = os.path.join(root, 'state.json')
+		if not os.path.exists(self.blobs_path):
+			os.makedirs(self.blobs_path)
+
+		self.state = {'start': starttime, 'end': endtime, 'symbols': {}}
+		try:
+			with open(self.state_file, 'r') as f:
+				state = json.load(f)
+			if state['start'] == starttime and state['end'] == endtime:
+				self.state = state
+				if state['symbols']:
+					logger.info('Resume ingestion, assets already prepared: '
+								+', '.join(sorted(state['symbols'])))
+		except (IOError, ValueError, KeyError):
+			pass
+
+	def _write_state(self):
+		tmp_file = self.state_file+'.tmp'
+		with open(tmp_file, 'w') as f:
+			json.dump(self.state, f)
+		os.replace(tmp_file, self.state_file)
+
+	def _part_file(self, name):
+		return os.path.join(self.blobs_path, quote(name, safe='')+'.pkl')
+
+	def has_part(self, name):
+		"""Whether crawler file name has been downloaded and parsed."""
+		return os.path.isfile(self._part_file(name))
+
+	def load_part(self, name):
+		"""Parsed crawler file, dict returned by split_by_symbol."""
+		return pd.read_pickle(self._part_file(name))
+
+	def save_part(self, name, part):
+		tmp_file = self._part_file(name)+'.tmp'
+		pd.to_pickle(part, tmp_file)
+		os.replace(tmp_file, self._part_file(name))
+
+	def prepared_symbols(self):
+		"""Assets already prepared.
+
+		Returns:
+		first_dates : dict, symbol -> pd.Timestamp of the first new row
+		"""
+		return {symbol: pd.Timestamp(date)
+				for symbol, date in self.state['symbols'].items()}
+
+	def symbol_prepared(self, symbol, first_date):
+		"""Record an asset whose new data is saved to the price store."""
+		self.state['symbols'][symbol] = str(first_date)
+		self._write_state()
+
+	def clear(self):
+		"""Remove all checkpoints, after the ingest completed."""
+		shutil.rmtree(self.root, ignore_errors=True)
@@ -0,0 +1,238 @@
+"""Background ingest jobs.
+A job runs the ingest_data management command in its own process and
+reports its progress to a JSON file under MEDIA_ROOT/jobs/, so that any
+gunicorn worker can answer status requests.
+
+Only one ingest runs at a time. The process running it holds an exclusive
+lock on MEDIA_ROOT/jobs/running.lock, which the OS releases when the
+process exits, and start_job returns the id of the job in flight instead
+of starting another one.
+"""
+import fcntl
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings as djangoSettings
+
+
+# Get an instance of a logger
+logger = logging.getLogger('django')
+
+jobs_path = os.path.join(djangoSettings.MEDIA_ROOT, 'jobs/')
+
+# job files older than this many seconds are removed when a new job starts
+JOB_FILE_MAX_AGE = 7*24*3600
+# minimum seconds between two writes of progress within the same stage
+PROGRESS_INTERVAL = 0.5
+# a queued job that has not started running after this many seconds
+# is considered lost, e.g. the process could not be started
+QUEUED_TIMEOUT = 60
+
+# serializes start_job across gunicorn workers
+_start_lock_file = os.path.join(jobs_path, 'start.lock')
+# held by the process running an ingest
+_running_lock_file = os.path.join(jobs_path, 'running.lock')
+# id of the latest job started
+_current_file = os.path.join(jobs_path, 'current')
+
+
+def _job_file(job_id):
+	return os.path.join(jobs_path, job_id+'.json')
+
+
+def _load_job(job_id):
+	try:
+		with open(_job_file(job_id), 'r') as f:
+			return json.load(f)
+	except (IOError, ValueError):
+		return None
+
+
+def _write_job(job):
+	job['updated'] = time.time()
+	tmp_file = _job_file(job['id'])+'.tmp'
+	with open(tmp_file, 'w') as f:
+		json.dump(job, f)
+	os.replace(tmp_file, _job_file(job['id']))
+
+
+def read_job(job_id):
+	"""Read the state of a job.
+	A job still queued or running while no process holds the running lock
+	was lost, e.g. its process was killed, and is marked failed.
+
+	Returns:
+	job : dict, None if there is no job with this id
+	"""
+	# job ids are generated by new_job_id, refuse anything else
+	if not job_id or not job_id.isalnum():
+		return None
+	job = _load_job(job_id)
+	if job is None or job['state'] in ('done', 'failed') or _is_ingest_running():
+		return job
+	# the process of a queued job may not hold the lock yet
+	if job['state'] == 'queued' and time.time() - job['updated'] < QUEUED_TIMEOUT:
+		return job
+	# the job may have finished between reading it and checking the lock
+	job = _load_job(job_id)
+	if job is not None and job['state'] in ('queued', 'running'):
+		logger.warning('Ingest job '+job_id+' lost')
+		job.update(state='failed', message='Error: Ingestion stopped unexpectedly. '
+					'Please refresh the page and try to ingest again.')
+		_write_job(job)
+	return job
+
+
+class JobProgress(object):
+	"""Progress of an ingest job.
+	With job_id None nothing is written, so the ingest can also run
+	without a job, e.g. from the command line.
+
+	The state written to the job file contains:
+	id : string, job id
+	state : string, 'queued', 'running', 'done' or 'failed'
+	stage : string, e.g. 'listing', 'downloading', 'preparing'
+	done, total : int or None, e.g. number of files downloaded so far
+	detail : string, e.g. the asset being prepared
+	message : string, result of the ingest when finished
+	started, updated : float, UNIX time
+	"""
+
+	def __init__(self, job_id=None):
+		self.job_id = job_id
+		self._state = {'id': job_id, 'state': 'queued', 'stage': '',
+					'done': None, 'total': None, 'detail': '', 'message': '',
+					'started': time.time(), 'updated': time.time()}
+		self._last_write = 0
+
+	def _write(self):
+		if self.job_id is None:
+			return
+		_write_job(self._state)
+		self._last_write = time.time()
+
+	def stage(self, stage, done=None, total=None, detail=''):
+		"""Report the current stage of the ingest."""
+		same_stage = stage == self._state['stage']
+		self._state.update(state='running', stage=stage, done=done,
+						total=total, detail=detail)
+		if not same_stage:
+			logger.info('Ingest stage: '+stage+' '+detail)
+		# frequent updates within a stage, e.g. per downloaded file,
+		# are written at most every PROGRESS_INTERVAL seconds
+		if (not same_stage or done == total
+				or time.time() - self._last_write >= PROGRESS_INTERVAL):
+			self._write()
+
+	def finish(self, message):
+		self._state.update(state='done', message=message)
+		self._write()
+
+	def fail(self, message):
+		self._state.update(state='failed', message=message)
+		self._write()
+
+
+def new_job_id():
+	return uuid.uuid4().hex
+
+
+@contextmanager
+def _flock(path, blocking=True):
+	"""Hold an exclusive lock on a file.
+	Yields False instead of waiting if blocking is False and the lock is
+	held by another process.
+	"""
+	if not os.path.exists(jobs_path):
+		os.makedirs(jobs_path)
+	with open(path, 'a') as f:
+		try:
+			fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+		except BlockingIOError:
+			yield False
+			return
+		try:
+			yield True
+		finally:
+			fcntl.flock(f, fcntl.LOCK_UN)
+
+
+@contextmanager
+def ingest_lock(progress=None):
+	"""Hold the lock for running an ingest, wait if another ingest runs,
+	e.g. one started from the command line.
+	"""
+	with _flock(_running_lock_file, blocking=False) as locked:
+		if locked:
+			yield
+			return
+	if progress is not None:
+		progress.stage('waiting', detail='for the running ingest')
+	with _flock(_running_lock_file):
+		yield
+
+
+def _is_ingest_running():
+	with _flock(_running_lock_file, blocking=False) as locked:
+		return not locked
+
+
+def current_job():
+	"""Id of the ingest job in flight, None if there is none."""
+	try:
+		with open(_current_file, 'r') as f:
+			job_id = f.read().strip()
+	except IOError:
+		return None
+	job = read_job(job_id)
+	if job is None or job['state'] in ('done', 'failed'):
+		return None
+	return job_id
+
+
+def start_job():
+	"""Start an ingest job in a new process, or attach to the job in flight.
+
+	Returns:
+	job_id : string
+	"""
+	with _flock(_start_lock_file):
+		job_id = current_job()
+		if job_id is not None:
+			logger.info('Attached to running ingest job '+job_id)
+			return job_id
+		return _start_new_job()
+
+
+def _start_new_job():
+	# remove files of old jobs, lock files are kept
+	for name in os.listdir(jobs_path):
+		if not name.endswith('.json'):
+			continue
+		path = os.path.join(jobs_path, name)
+		try:
+			if time.time() - os.path.getmtime(path) > JOB_FILE_MAX_AGE:
+				os.remove(path)
+		except OSError:
+			pass
+
+	job_id = new_job_id()
+	JobProgress(job_id)._write()  # queued
+	with open(_current_file, 'w') as f:
+		f.write(job_id)
+
+	cmd = [sys.executable, os.path.join(djangoSettings.BASE_DIR, 'manage.py'),
+			'ingest_data', '--job', job_id]
+	subprocess.Popen(cmd, cwd=djangoSettings.BASE_DIR,
+					stdin=subprocess.DEVNULL,
+					stdout=subprocess.DEVNULL,
+					stderr=subprocess.DEVNULL,
+					start_new_session=True)
+	logger.info('Started ingest job '+job_id)
+	return job_id
@@ -0,0 +1,372 @@
+"""Data (collection and) ingestion, run as a background job by ingest view.
+"""
+import calendar
+import gc
+import logging
+import os
+import requests
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings as djangoSettings
+
+from .blob_download import fetch_blobs
+from .blob_manifest import BlobManifest, to_timestamp
+from .bundle_ingest import (ingest_bars, ingest_incremental, ingest_parallel,
+						write_uncompressed)
+from .csv_concat import (concat_new_frames, default_symbols, parse_aggregates,
+						split_by_symbol)
+from .get_prefixes import CUTOFF_TIME
+from .ingest_checkpoint import IngestCheckpoint
+from .ingest_jobs import JobProgress
+from .object_cache import ObjectCache
+from .object_store import get_bucket, put
+from . import price_store
+from . import symbol_registry
+from .zipline_commands import check_not_empty
+
+
+# Get an instance of a logger
+logger = logging.getLogger('django')
+
+# for using Google Cloud Storage
+GS_CRAWLERDATA_BUCKET_NAME = 'idp_crypto'
+GS_ASSETS_BUCKET_NAME = 'idp_backtest_assets'
+
+# for saving *aggregates.csv
+aggr_path = djangoSettings.MEDIA_ROOT
+# record file of ingest time
+record_name = 'last_ingest.txt'
+record_file = aggr_path+record_name
+# columnar price store, source of truth of asset price files
+store_path = os.path.join(aggr_path, 'store/')
+# registry of available trading pairs, see symbol_registry.py
+registry_file = aggr_path+'symbols.json'
+# record of objects downloaded from GCS, see object_cache.py
+object_cache_file = aggr_path+'object_cache.sqlite3'
+# local index of files in crawler data bucket
+manifest_file = aggr_path+'crawler_manifest.sqlite3'
+# path of asset price files exported from the store for download
+arranged_path = os.path.join(aggr_path, 'arranged/minute/')
+# checkpoints of an unfinished ingestion
+checkpoint_path = os.path.join(aggr_path, 'checkpoint/')
+
+
+def bars_store_path(bar_period):
+	"""Path of the price store of bars of bar_period seconds."""
+	return os.path.join(aggr_path, 'store-{0}s/'.format(bar_period))
+
+
+def bars_path(bar_period):
+	"""Path of the bcolz bars of bar_period seconds, see ingest_bars."""
+	return os.path.join(aggr_path, 'bars-{0}s/'.format(bar_period))
+# data bundle name. In case change, also change bundle_name in execute_backtest.py
+bname = 'csvdir'
+
+
+class IngestError(Exception):
+	"""Ingestion failed, the message is shown to the user."""
+	pass
+
+
+def available_assets():
+	"""Trading pairs in the symbol registry.
+	The registry is retrieved from GCS on a fresh instance, default
+	trading pairs are returned if that fails.
+	"""
+	symbols = symbol_registry.read_symbols(registry_file)
+	if symbols is None:
+		try:
+			bucket = get_bucket(GS_ASSETS_BUCKET_NAME)
+			symbol_registry.download_registry(bucket, registry_file,
+											cache=ObjectCache(object_cache_file))
+		except:
+			logger.exception('Cannot get symbol registry from Google Cloud Storage')
+		symbols = symbol_registry.read_symbols(registry_file)
+	return symbols or sorted(default_symbols)
+
+
+def _get_price_files(assets_list, cache):
+	"""Make sure there is price data of all assets for a full ingestion,
+	download price data missing on a fresh instance.
+	"""
+	download_list = [asset for asset in assets_list
+					if not price_store.has_symbol(store_path, asset)]
+	try:
+		bucket = get_bucket(GS_ASSETS_BUCKET_NAME)
+		for symbol in download_list:
+			price_store.download_symbol(bucket, store_path, symbol, cache=cache)
+	except requests.exceptions.ChunkedEncodingError:
+		logger.exception('Network fails')
+		raise IngestError('Error: Connection failed. '
+						'Please refresh the page and try to ingest again.')
+	except:
+		logger.exception('Cannot get assets data from Google Cloud Storage')
+		raise IngestError('Error: Cannot get pricing data from Cloud Storage bucket '
+					+GS_ASSETS_BUCKET_NAME)
+
+
+def _run_full_ingest(ohlc_ratios):
+	"""Rebuild the bundle from the price store in INGEST_BUNDLE_WORKERS
+	worker processes. Uncompressed minute bars are written if
+	MINUTE_BARS_UNCOMPRESSED is set.
+
+	Sids follow the order of symbols, so a new pair may shift the sids of
+	other pairs. The OHLC ratios are passed by symbol and mapped to the new
+	sids, zipline ingest would use the ratios hard-coded by sid in
+	minute_bars.py.
+
+	Parameters:
+	ohlc_ratios : dict, symbol -> OHLC ratio, see symbol_registry.py
+	"""
+	ingest_parallel(bname, store_path,
+					max_workers=djangoSettings.INGEST_BUNDLE_WORKERS,
+					ohlc_ratios=ohlc_ratios)
+	if djangoSettings.MINUTE_BARS_UNCOMPRESSED:
+		write_uncompressed(bname)
+
+
+def ingest_data(progress=None):
+	"""Data (collection and) ingestion.
+	Download crawler data collected since the last ingestion, add it to the
+	price data of all assets and ingest it into the data bundle.
+
+	Parameters:
+	progress : JobProgress, optional
+
+	Returns:
+	message : string, result to show to the user
+
+	Raises:
+	IngestError, with the error message to show to the user
+	"""
+	if progress is None:
+		progress = JobProgress()
+
+	# path for saving *aggregates.csv
+	if not os.path.exists(aggr_path):
+		os.makedirs(aggr_path)
+
+	# objects not changed in GCS are not downloaded again
+	cache = ObjectCache(object_cache_file)
+
+	start_ingest = time.time()  # start time of ingest
+
+
+	# retrieve latest ingest time from GCS
+	try:
+		bucket = get_bucket(GS_ASSETS_BUCKET_NAME)
+		if not cache.get(bucket, record_name, record_file):
+			raise IOError(record_name+' not found')
+
+		with open(record_file,'r') as record:
+			# time of last ingestion, UTC
+			starttime = record.read()
+		# remove possible line break char
+		starttime = starttime[:len('YYYY-MM-DD HH:MM:SS')]
+	except:
+		logger.exception('Cannot read last ingest time from file correctly')
+		raise IngestError('Error: Connection failed when '
+					'trying to access Google Cloud Storage. Please try again.')
+
+	# get and ingest data from starttime to endtime
+	starttimestamp = datetime.strptime(starttime, '%Y-%m-%d %H:%M:%S')
+	endtimestamp = datetime.utcnow()  # actual time
+	endtime = endtimestamp.date().strftime('%Y-%m-%d')+' '+CUTOFF_TIME
+
+	# last ingestion was less than 1 day ago
+	if endtimestamp - starttimestamp < timedelta(days=1):
+		# check if there is ingestion, if yes, return
+		if check_not_empty(bname):
+			return 'Data is already up to date'
+
+		# if no, check if there are price data, if no, download them
+		progress.stage('downloading', detail='price data')
+		_get_price_files(available_assets(), cache)
+
+		# do the ingestion, return
+		progress.stage('bundle')
+		_run_full_ingest(symbol_registry.read_ohlc_ratios(registry_file))
+		return 'Ingestion completed. Please refresh the page.'
+
+	# else: get new data and ingest
+	logger.info('Attempt to ingest data from '+starttime+' to '+endtime)
+
+	try:
+		progress.stage('listing')
+		# set bucket to crawler data bucket
+		bucket = get_bucket(GS_CRAWLERDATA_BUCKET_NAME)
+		# list files in bucket that are not in the manifest yet, then look up
+		# files collected between starttime and endtime in the manifest
+		manifest = BlobManifest(manifest_file)
+		manifest.update(bucket, to_timestamp(starttime),
+						calendar.timegm(endtimestamp.utctimetuple()))
+		aggr_names = manifest.select(to_timestamp(starttime), to_timestamp(endtime),
+									suffix='aggregates.csv')
+
+		# crawler files downloaded by a failed attempt are not downloaded again
+		checkpoint = IngestCheckpoint(checkpoint_path, starttime, endtime)
+		aggr_blobs = [bucket.blob(name) for name in aggr_names
+					if not checkpoint.has_part(name)]
+		if len(aggr_blobs) < len(aggr_names):
+			logger.info('Resume downloading, {0} of {1} files already downloaded'
+						.format(len(aggr_names)-len(aggr_blobs), len(aggr_names)))
+
+		# download *aggregates.csv into memory, parse and split by asset
+		# each file as soon as it arrives, and save it as a checkpoint
+		downloaded = [len(aggr_names)-len(aggr_blobs)]
+		def handle_blob(name, raw):
+			part = split_by_symbol(parse_aggregates(raw, name))
+			checkpoint.save_part(name, part)
+			downloaded[0] += 1
+			progress.stage('downloading', downloaded[0], len(aggr_names))
+			return part
+
+		progress.stage('downloading', downloaded[0], len(aggr_names))
+		fetched = fetch_blobs(aggr_blobs, handle_blob,
+				max_workers=djangoSettings.INGEST_DOWNLOAD_WORKERS,
+				retries=djangoSettings.INGEST_DOWNLOAD_RETRIES)
+		fetched = dict(zip([blob.name for blob in aggr_blobs], fetched))
+		# parts in the order of names, as crawler files were collected
+		parts = [fetched.pop(name) if name in fetched else checkpoint.load_part(name)
+				for name in aggr_names]
+	except requests.exceptions.ChunkedEncodingError:
+		logger.exception('Network fails')
+		raise IngestError('Error: Connection failed. '
+						'Please refresh the page and try to ingest again.')
+	except:
+		logger.exception('Cannot get crawler data from Google Cloud Storage')
+		raise IngestError('Error: Cannot get crawler data from Cloud Storage bucket '
+						+GS_CRAWLERDATA_BUCKET_NAME)
+
+	logger.info('Downloading completed')
+
+	# trading pairs seen in crawler data for the first time are added to
+	# the registry, with the time of their first data and an OHLC ratio
+	# that fits their prices. Pairs without a ratio are left out
+	known = set(available_assets())
+	ohlc_ratios = symbol_registry.read_ohlc_ratios(registry_file)
+	seen = {}
+	high_prices = {}
+	for part in parts:
+		for symbol, frame in part.items():
+			if symbol in known or not symbol_registry.is_valid_symbol(symbol):
+				continue
+			if symbol not in seen:
+				seen[symbol] = frame['eventTime'].iloc[0]
+			high_prices[symbol] = max(high_prices.get(symbol, 0),
+									frame['highPrice'].max())
+	for symbol in sorted(seen):
+		ratio = symbol_registry.ohlc_ratio_for_price(high_prices[symbol])
+		if ratio is None:
+			logger.warning('No prices of new trading pair '+symbol+', not ingested')
+			del seen[symbol]
+		else:
+			ohlc_ratios[symbol] = ratio
+	assets_list = sorted(known | set(seen))
+
+	# data preparation, assets prepared by a failed attempt are skipped
+	first_dates = checkpoint.prepared_symbols()
+	symbols = [symbol for symbol in assets_list if symbol not in first_dates
+			and any(symbol in part for part in parts)]
+	total = len(first_dates) + len(symbols)
+	def symbol_prepared(symbol, first_date):
+		checkpoint.symbol_prepared(symbol, first_date)
+		progress.stage('preparing', len(checkpoint.prepared_symbols()),
+					total, symbol)
+	try:
+		progress.stage('preparing', len(first_dates), total)
+		first_dates.update(concat_new_frames(parts, store_path, symbols=symbols,
+						max_workers=djangoSettings.INGEST_PREPARE_WORKERS,
+						on_prepared=symbol_prepared, cache=cache))
+	except requests.exceptions.ChunkedEncodingError:
+		logger.exception('Network fails')
+		raise IngestError('Error: Connection failed. '
+						'Please refresh the page and try to ingest again.')
+	except:
+		logger.exception('Cannot concat new csvs')
+		raise IngestError('Error in data preparation. '
+						'Please refresh the page and try to ingest again.')
+	logger.info('Data preparation completed')
+
+	# optional sub-minute bars, from the same crawler data. They are not
+	# needed for backtests, so a failure here does not fail the ingest
+	bar_period = djangoSettings.BAR_PERIOD_SECONDS
+	bar_dates = {}
+	if bar_period:
+		try:
+			progress.stage('preparing', detail='{0}-second bars'.format(bar_period))
+			bar_dates = concat_new_frames(parts, bars_store_path(bar_period),
+							symbols=assets_list,
+							max_workers=djangoSettings.INGEST_PREPARE_WORKERS,
+							cache=cache, bar_period=bar_period,
+							store_prefix=price_store.bars_prefix(bar_period))
+		except:
+			logger.exception('Cannot prepare {0}-second bars'.format(bar_period))
+	del parts
+
+	# # clean old data ingestion
+	# _, stderr = run_clean(bname, 'after', '2019-05-20')
+	# if stderr is not None:
+	# 	stderr = stderr.decode("utf-8")
+	# 	if stderr != "":
+	# 		logger.warning(stderr)
+
+	# append new data to the latest ingestion in place,
+	# fall back to a full zipline ingest if that is not possible
+	progress.stage('bundle')
+	try:
+		ingested = ingest_incremental(bname, store_path, assets_list,
+						since=first_dates,
+						uncompressed=djangoSettings.MINUTE_BARS_UNCOMPRESSED)
+	except:
+		logger.exception('Cannot do incremental ingestion')
+		ingested = False
+
+	if not ingested:
+		_get_price_files(assets_list, cache)
+		_run_full_ingest(ohlc_ratios)
+
+	if bar_dates:
+		try:
+			ingest_bars(bname, bars_path(bar_period), bars_store_path(bar_period),
+						assets_list, bar_period, since=bar_dates)
+		except:
+			logger.exception('Cannot write {0}-second bars'.format(bar_period))
+
+	# new trading pairs are available once they are ingested
+	try:
+		symbol_registry.register_symbols(registry_file, seen, ohlc_ratios)
+	except:
+		logger.exception('Cannot write symbol registry')
+
+	try:
+		with open(record_file,'w') as record:
+			print(endtime, file=record)
+		logger.info('Writing last ingest time to file completed')
+	except:
+		logger.exception('Cannot write last ingest time to file')
+
+	progress.stage('uploading')
+	try:
+		# rewrite new ingest time to GCS
+		bucket = get_bucket(GS_ASSETS_BUCKET_NAME)
+		fblob = put(bucket, record_name, record_file)
+		cache.record(fblob, record_file)
+		symbol_registry.upload_registry(bucket, registry_file, cache=cache)
+		# ingestion completed, nothing to resume
+		checkpoint.clear()
+	except:
+		logger.exception('Cannot upload last ingest to GCS')
+
+	# force the Garbage Collector to release unreferenced memory
+	gc.collect()
+	end_ingest = time.time()  # end time of ingest
+	duration = str(timedelta(seconds=int(end_ingest - start_ingest)))
+
+	msg = 'Ingestion of data from '+starttime+' to '+endtime+' completed in '+duration
+	logger.info(msg)
+
+	return ('Ingestion completed. Data range: ' + starttime
+				+ ' to ' + endtime + '. Duration: ' + duration
+				+ '. Please refresh the page.')
@@ -0,0 +1,204 @@
+import json
+import os
+import resource
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings as djangoSettings
+from django.core.management.base import BaseCommand
+
+from testapp.blob_download import fetch_blobs
+from testapp.blob_manifest import BlobManifest, to_timestamp
+from testapp.bundle_ingest import ingest_incremental, ingest_parallel
+from testapp.csv_concat import concat_new_frames, parse_aggregates, split_by_symbol
+from testapp.get_prefixes import get_prefixes
+from testapp.ingest_pipeline import GS_CRAWLERDATA_BUCKET_NAME, bname
+from testapp.object_store import get_bucket, list_objects
+from testapp.price_store import export_csv
+from testapp.synthetic_data import generate_aggregates, synthetic_symbols
+from testapp.zipline_commands import run_ingest
+
+
+def _rss_mb():
+	"""Resident set size of this process in MB, None if unknown."""
+	try:
+		with open('/proc/self/statm', 'r') as f:
+			pages = int(f.read().split()[1])
+		return pages * resource.getpagesize() / 2.0**20
+	except (IOError, IndexError, ValueError):
+		return None
+
+
+class StageTimer(object):
+	"""Measure time and peak RSS of one stage of ingestion.
+	RSS of this process is sampled in a thread during the stage. Peak RSS
+	of child processes, e.g. zipline ingest or preparation workers, is the
+	maximum over all children that have exited so far.
+	"""
+
+	def __init__(self, stage, interval=0.01, suppress=False):
+		self.stage = stage
+		self.interval = interval
+		self.suppress = suppress
+		self.rows = 0
+		self.result = None
+
+	def _sample(self):
+		while not self._stop.wait(self.interval):
+			rss = _rss_mb()
+			if rss is not None:
+				self._peak = max(self._peak, rss)
+
+	def __enter__(self):
+		self._peak = _rss_mb() or 0.0
+		self._stop = threading.Event()
+		self._sampler = threading.Thread(target=self._sample)
+		self._sampler.daemon = True
+		self._sampler.start()
+		self._start = time.time()
+		return self
+
+	def __exit__(self, exc_type, exc_value, tb):
+		seconds = time.time() - self._start
+		self._stop.set()
+		self._sampler.join()
+		children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024.0
+		self.result = {'stage': self.stage,
+					'seconds': round(seconds, 3),
+					'rows': self.rows,
+					'rows_per_sec': round(self.rows / max(seconds, 1e-6), 1),
+					'peak_rss_mb': round(max(self._peak, _rss_mb() or 0.0), 1),
+					'children_peak_rss_mb': round(children, 1),
+					'ok': exc_type is None}
+		if exc_type is not None:
+			self.result['error'] = repr(exc_value)
+		return self.suppress
+
+
+class Command(BaseCommand):
+	help = ('Benchmark ingestion stage by stage on synthetic crawler data in '
+			'a local object store, report the results as JSON')
+
+	def add_arguments(self, parser):
+		parser.add_argument('--days', type=int, default=1)
+		parser.add_argument('--symbols', type=int, default=4,
+						help='number of assets')
+		parser.add_argument('--files-per-day', type=int, default=96)
+		parser.add_argument('--seed', type=int, default=0)
+		parser.add_argument('--start', default='2018-11-01 00:20:00',
+						help='UTC time of the first row')
+		parser.add_argument('--workdir', default=None,
+						help='directory for buckets, store and bundle, '
+						'a temporary directory by default, removed afterwards')
+		parser.add_argument('--output', default=None,
+						help='file to write the JSON report to, stdout by default')
+		parser.add_argument('--skip-bundle', action='store_true',
+						help='skip the bundle stages')
+
+	def handle(self, *args, **options):
+		workdir = options['workdir'] or tempfile.mkdtemp(prefix='ingest_benchmark_')
+		keep = options['workdir'] is not None
+		try:
+			report = self.run(workdir, options)
+		finally:
+			if not keep:
+				shutil.rmtree(workdir, ignore_errors=True)
+
+		text = json.dumps(report, indent=2)
+		if options['output']:
+			with open(options['output'], 'w') as f:
+				f.write(text)
+		else:
+			self.stdout.write(text)
+
+	def run(self, workdir, options):
+		# everything runs against local directories, nothing touches GCS
+		djangoSettings.OBJECT_STORE_ROOT = os.path.join(workdir, 'buckets')
+		os.environ['ZIPLINE_ROOT'] = os.path.join(workdir, 'zipline')
+		store_path = os.path.join(workdir, 'store/')
+		ingest_path = os.path.join(workdir, 'arranged/')
+		arranged_path = os.path.join(ingest_path, 'minute/')
+		symbols = synthetic_symbols(options['symbols'])
+		start = options['start']
+		end = (datetime.strptime(start, '%Y-%m-%d %H:%M:%S')
+				+ timedelta(days=options['days'])).strftime('%Y-%m-%d %H:%M:%S')
+
+		bucket = get_bucket(GS_CRAWLERDATA_BUCKET_NAME)
+		stages = []
+		def stage(name, suppress=False):
+			timer = StageTimer(name, suppress=suppress)
+			stages.append(timer)
+			return timer
+
+		with stage('generate') as timer:
+			names, timer.rows = generate_aggregates(bucket.root, start=start,
+							days=options['days'], symbols=symbols,
+							files_per_day=options['files_per_day'],
+							seed=options['seed'])
+
+		with stage('listing') as timer:
+			blobs = []
+			for prefix in get_prefixes(start, end=end):
+				blobs += list_objects(bucket, prefix=prefix)
+			timer.rows = len(blobs)
+
+		with stage('listing_manifest') as timer:
+			manifest = BlobManifest(os.path.join(workdir, 'manifest.sqlite3'))
+			manifest.update(bucket, to_timestamp(start), to_timestamp(end))
+			aggr_names = manifest.select(to_timestamp(start), to_timestamp(end),
+										suffix='aggregates.csv')
+			timer.rows = len(aggr_names)
+
+		with stage('downloading') as timer:
+			parts = fetch_blobs([bucket.blob(name) for name in aggr_names],
+					lambda name, raw: split_by_symbol(parse_aggregates(raw, name)),
+					max_workers=djangoSettings.INGEST_DOWNLOAD_WORKERS,
+					retries=0)
+			timer.rows = sum(len(frame) for part in parts for frame in part.values())
+
+		with stage('preparing') as timer:
+			first_dates = concat_new_frames(parts, store_path, symbols=symbols,
+							max_workers=djangoSettings.INGEST_PREPARE_WORKERS)
+			timer.rows = sum(len(frame) for part in parts
+							for symbol, frame in part.items() if symbol in first_dates)
+		rows = timer.rows
+		del parts
+
+		if not options['skip_bundle']:
+			# zipline ingest of the csvdir bundle reads asset price files,
+			# exported from the store as getdata does
+			with stage('export') as timer:
+				if not os.path.exists(arranged_path):
+					os.makedirs(arranged_path)
+				for symbol in symbols:
+					export_csv(store_path, symbol,
+							os.path.join(arranged_path, symbol+'.csv'))
+				timer.rows = rows
+
+			# a failing bundle stage is reported instead of aborting
+			with stage('bundle', suppress=True) as timer:
+				timer.rows = rows
+				_, stderr = run_ingest(ingest_path, bname)
+				if stderr:
+					self.stderr.write(stderr.decode('utf-8'))
+
+			with stage('bundle_parallel', suppress=True) as timer:
+				timer.rows = rows
+				ingest_parallel(bname, store_path,
+								max_workers=djangoSettings.INGEST_BUNDLE_WORKERS)
+
+			with stage('bundle_incremental', suppress=True) as timer:
+				# rewrite all new data in place, as a daily ingestion does
+				timer.rows = rows
+				if not ingest_incremental(bname, store_path, symbols, since=first_dates):
+					raise RuntimeError('No ingestion to update')
+
+		return {'params': {key: options[key] for key in
+							('days', 'symbols', 'files_per_day', 'seed', 'start')},
+				'files': len(names),
+				'stages': [timer.result for timer in stages],
+				'total_seconds': round(sum(timer.result['seconds']
+										for timer in stages), 3)}
@@ -0,0 +1,36 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from testapp.ingest_jobs import JobProgress, ingest_lock
+from testapp.ingest_pipeline import IngestError, ingest_data
+
+
+# Get an instance of a logger
+logger = logging.getLogger('django')
+
+
+class Command(BaseCommand):
+	help = 'Download new crawler data and ingest it into the data bundle'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--job', default=None,
+						help='id of the ingest job to report progress to')
+
+	def handle(self, *args, **options):
+		progress = JobProgress(options['job'])
+		# only one ingest runs at a time, across all gunicorn workers
+		with ingest_lock(progress):
+			try:
+				message = ingest_data(progress)
+			except IngestError as e:
+				progress.fail(str(e))
+				self.stderr.write(str(e))
+				return
+			except:
+				logger.exception('Ingest job failed')
+				progress.fail('Error: Ingestion failed. '
+							'Please refresh the page and try to ingest again.')
+				raise
+			progress.finish(message)
+		self.stdout.write(message)
@@ -0,0 +1,120 @@
+import logging
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings as djangoSettings
+from django.core.management.base import BaseCommand
+
+from testapp.bundle_ingest import prewarm_bundle
+from testapp.get_prefixes import CUTOFF_TIME
+from testapp.ingest_jobs import current_job, read_job, start_job
+from testapp.ingest_pipeline import bname
+
+
+# Get an instance of a logger
+logger = logging.getLogger('django')
+
+# seconds between two checks of a running ingest job
+POLL_INTERVAL = 10
+# seconds to wait before trying again after a failed run
+RETRY_INTERVAL = 600
+
+
+def next_run_time(now, delay):
+	"""Time of the next scheduled ingest, delay after the daily cutoff.
+
+	Parameters:
+	now : datetime, current time, UTC
+	delay : timedelta, time after the cutoff
+
+	Returns:
+	run_time : datetime, UTC, after now
+	"""
+	cutoff = datetime.strptime(CUTOFF_TIME, '%H:%M:%S').time()
+	run_time = datetime.combine(now.date(), cutoff) + delay
+	while run_time <= now:
+		run_time += timedelta(days=1)
+	return run_time
+
+
+class Command(BaseCommand):
+	help = ('Run as a scheduler: ingest new crawler data every day shortly '
+			'after the crawler cutoff, then pre-warm the bundle readers')
+
+	def add_arguments(self, parser):
+		parser.add_argument('--delay', type=int,
+						default=djangoSettings.INGEST_SCHEDULE_DELAY,
+						help='minutes after the daily cutoff to ingest at')
+		parser.add_argument('--no-initial', action='store_true',
+						help='do not ingest when the scheduler starts, '
+						'only at the scheduled times')
+		parser.add_argument('--once', action='store_true',
+						help='ingest once now and exit')
+
+	def handle(self, *args, **options):
+		delay = timedelta(minutes=options['delay'])
+		if options['once']:
+			self.run_once()
+			return
+
+		ok = True
+		if not options['no_initial']:
+			# backtests run against stale data until the first ingest
+			ok = self.run_once()
+		while True:
+			now = datetime.utcnow()
+			run_time = next_run_time(now, delay)
+			if not ok:
+				# try again soon after a failed run
+				run_time = min(run_time, now + timedelta(seconds=RETRY_INTERVAL))
+			logger.info('Next scheduled ingest at {0} UTC'.format(run_time))
+			self.sleep_until(run_time)
+			ok = self.run_once()
+
+	def sleep_until(self, run_time):
+		# sleep in steps, so that clock changes do not delay the run
+		while True:
+			seconds = (run_time - datetime.utcnow()).total_seconds()
+			if seconds <= 0:
+				return
+			time.sleep(min(seconds, 60))
+
+	def run_once(self):
+		"""Run an ingest job, wait for it, pre-warm the bundle readers and
+		log the timings of the run.
+
+		Returns:
+		ok : bool, False if the ingest failed
+		"""
+		started = time.time()
+		try:
+			# attaches to a job started from the page, if there is one
+			job_id = start_job()
+		except:
+			logger.exception('Scheduled ingest could not be started')
+			return False
+		while current_job() == job_id:
+			time.sleep(POLL_INTERVAL)
+		ingest_seconds = time.time() - started
+
+		job = read_job(job_id)
+		if job is None or job['state'] != 'done':
+			logger.error('Scheduled ingest job {0} failed in {1:.1f}s: {2}'.format(
+						job_id, ingest_seconds,
+						job['message'] if job else 'job file not found'))
+			return False
+
+		started = time.time()
+		try:
+			minutes = prewarm_bundle(bname)
+		except:
+			logger.exception('Cannot pre-warm bundle '+bname)
+			minutes = None
+		prewarm_seconds = time.time() - started
+
+		message = ('Scheduled ingest job {0}: {1} Ingest {2:.1f}s, '
+				'pre-warm {3:.1f}s ({4} minutes per asset)').format(
+				job_id, job['message'], ingest_seconds, prewarm_seconds, minutes)
+		logger.info(message)
+		self.stdout.write(message)
+		return True
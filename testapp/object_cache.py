@@ -0,0 +1,109 @@
+import logging
+import os
+import sqlite3
+
+from .object_store import blob_version, get_if_changed
+
+
+# Get an instance of a logger
+logger = logging.getLogger('django')
+
+
+class ObjectCache(object):
+	"""Persistent record of objects downloaded from GCS to local files.
+	Keeps generation (or ETag) of every object downloaded or uploaded, and
+	size and modification time of its local copy, so that an object is
+	only downloaded again if it changed in the bucket or its local copy is
+	gone or changed. With MEDIA_ROOT on a persistent volume, a fresh
+	instance reuses what is on the volume.
+
+	Parameters:
+	db_path : string, path of the SQLite file
+	"""
+
+	def __init__(self, db_path):
+		self.db_path = db_path
+		with self._connect() as conn:
+			conn.execute('CREATE TABLE IF NOT EXISTS objects ('
+						'path TEXT PRIMARY KEY, name TEXT, version TEXT, '
+						'size INTEGER, mtime INTEGER)')
+
+	def _connect(self):
+		return sqlite3.connect(self.db_path, timeout=60)
+
+	def _row(self, name, path):
+		with self._connect() as conn:
+			row = conn.execute('SELECT name, version, size, mtime FROM objects '
+							'WHERE path=?', (os.path.abspath(path),)).fetchone()
+		if row is None or row[0] != name:
+			return None
+		return row
+
+	def recorded_version(self, name, path):
+		"""Version of object name last downloaded to or uploaded from path,
+		None if it was not recorded. path may have changed since."""
+		row = self._row(name, path)
+		return None if row is None else row[1]
+
+	def local_version(self, name, path):
+		"""Version of object name that path holds, None if it was not
+		recorded or path changed since."""
+		if not os.path.isfile(path):
+			return None
+		row = self._row(name, path)
+		if row is None:
+			return None
+		stat = os.stat(path)
+		if row[2] != stat.st_size or row[3] != stat.st_mtime_ns:
+			return None
+		return row[1]
+
+	def is_current(self, blob, path):
+		"""Whether path holds the current version of blob."""
+		version = blob_version(blob)
+		return version is not None and self.local_version(blob.name, path) == version
+
+	def record(self, blob, path):
+		"""Record that path holds the version of blob, e.g. after upload."""
+		version = blob_version(blob)
+		with self._connect() as conn:
+			if version is None:
+				conn.execute('DELETE FROM objects WHERE path=?',
+							(os.path.abspath(path),))
+			else:
+				stat = os.stat(path)
+				conn.execute('INSERT OR REPLACE INTO objects VALUES (?,?,?,?,?)',
+							(os.path.abspath(path), blob.name, version,
+							stat.st_size, stat.st_mtime_ns))
+
+	def download(self, blob, path):
+		"""Download blob to path unless path holds its current version.
+		blob must have its metadata loaded, e.g. from list_objects.
+
+		Returns:
+		downloaded : bool, False if the local copy was current
+		"""
+		if self.is_current(blob, path):
+			return False
+		tmp_file = path+'.tmp'
+		blob.download_to_filename(tmp_file)
+		os.replace(tmp_file, path)
+		self.record(blob, path)
+		return True
+
+	def get(self, bucket, name, path):
+		"""Download object name from bucket to path if it changed.
+		Only the metadata of the object is requested if it did not change.
+
+		Returns:
+		found : bool, False if there is no such object in the bucket
+		"""
+		blob, downloaded = get_if_changed(bucket, name, path,
+										self.local_version(name, path))
+		if blob is None:
+			return False
+		if downloaded:
+			self.record(blob, path)
+		else:
+			logger.info('Object '+name+' not changed, use local copy')
+		return True
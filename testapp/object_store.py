@@ -0,0 +1,204 @@
+"""Object store used by ingestion, Google Cloud Storage or a local directory.
+
+Ingestion works with buckets and blobs through the parts of the
+google.cloud.storage API below, so that a LocalBucket can stand in for a
+GCS bucket, e.g. for running and benchmarking a full ingestion offline:
+
+bucket.list_blobs(prefix='', start_offset=None, end_offset=None)
+bucket.blob(name), bucket.get_blob(name)
+blob.name, blob.size, blob.generation, blob.time_created
+blob.download_as_string(), blob.download_to_filename(filename)
+blob.upload_from_string(data), blob.upload_from_filename(filename)
+blob.delete()
+
+get_bucket returns a LocalBucket if OBJECT_STORE_ROOT is set in settings,
+otherwise a GCS bucket. The functions in this module are the operations
+ingestion needs on top of that: listing by prefix and name range, get,
+put and conditional get.
+"""
+import os
+import shutil
+from datetime import datetime, timezone
+
+
+def get_bucket(name):
+	"""Bucket name from the configured object store.
+
+	Parameters:
+	name : string, bucket name, e.g. 'idp_crypto'
+
+	Returns:
+	bucket : google.cloud.storage.Bucket or LocalBucket
+	"""
+	from django.conf import settings as djangoSettings
+	root = getattr(djangoSettings, 'OBJECT_STORE_ROOT', None)
+	if root:
+		return LocalBucket(os.path.join(root, name))
+	from google.cloud import storage
+	client = storage.Client()
+	return client.get_bucket(name)
+
+
+def blob_version(blob):
+	"""Generation of a blob, or its ETag if there is no generation."""
+	generation = getattr(blob, 'generation', None)
+	if generation is not None:
+		return str(generation)
+	return getattr(blob, 'etag', None)
+
+
+def list_objects(bucket, prefix='', start=None, end=None, fallback_prefixes=None):
+	"""Blobs with names starting with prefix, in [start, end) if given.
+	Older versions of google-cloud-storage cannot list from a name on, the
+	range is filtered after listing then. Only fallback_prefixes are listed
+	in that case if given, e.g. date prefixes of the range, instead of
+	everything under prefix.
+	"""
+	try:
+		blobs = list(bucket.list_blobs(prefix=prefix, start_offset=start,
+									end_offset=end))
+	except TypeError:
+		blobs = []
+		for fallback_prefix in (fallback_prefixes or [prefix]):
+			blobs += bucket.list_blobs(prefix=fallback_prefix)
+	return [blob for blob in blobs
+			if (start is None or blob.name >= start)
+			and (end is None or blob.name < end)]
+
+
+def get(bucket, name, filename):
+	"""Download an object to a file.
+
+	Returns:
+	blob : downloaded blob, None if there is no such object
+	"""
+	blob = bucket.get_blob(name)
+	if blob is None:
+		return None
+	blob.download_to_filename(filename)
+	return blob
+
+
+def put(bucket, name, filename):
+	"""Upload a file as object name.
+
+	Returns:
+	blob : uploaded blob, with the new generation
+	"""
+	blob = bucket.blob(name)
+	blob.upload_from_filename(filename)
+	return blob
+
+
+def get_if_changed(bucket, name, filename, version):
+	"""Conditional get, only download an object to a file if its version,
+	see blob_version, differs. The file is replaced when the download is
+	complete.
+
+	Returns:
+	blob : blob with metadata, None if there is no such object
+	downloaded : bool, False if the object still has the given version
+	"""
+	blob = bucket.get_blob(name)
+	if blob is None:
+		return None, False
+	if version is not None and blob_version(blob) == version:
+		return blob, False
+	tmp_file = filename+'.tmp'
+	blob.download_to_filename(tmp_file)
+	os.replace(tmp_file, filename)
+	return blob, True
+
+
+class LocalBlob(object):
+	"""A file in a LocalBucket, mimics the parts of
+	google.cloud.storage.Blob used by ingestion."""
+
+	def __init__(self, root, name):
+		self.name = name
+		self.path = os.path.join(root, name)
+		self.content_type = None
+		self.reload()
+
+	def reload(self):
+		"""Read metadata of the file, None if it does not exist."""
+		if os.path.isfile(self.path):
+			stat = os.stat(self.path)
+			self.size = stat.st_size
+			# modification time in ns changes with every write
+			self.generation = stat.st_mtime_ns
+			self.time_created = datetime.fromtimestamp(stat.st_mtime,
+													timezone.utc)
+		else:
+			self.size = self.generation = self.time_created = None
+
+	def exists(self):
+		return os.path.isfile(self.path)
+
+	def download_to_filename(self, filename):
+		shutil.copyfile(self.path, filename)
+
+	def download_as_string(self):
+		with open(self.path, 'rb') as f:
+			return f.read()
+
+	def _write(self, write):
+		directory = os.path.dirname(self.path)
+		if not os.path.exists(directory):
+			os.makedirs(directory)
+		tmp_file = self.path+'.tmp'
+		write(tmp_file)
+		os.replace(tmp_file, self.path)
+		self.reload()
+
+	def upload_from_filename(self, filename):
+		self._write(lambda tmp_file: shutil.copyfile(filename, tmp_file))
+
+	def upload_from_string(self, data):
+		if isinstance(data, str):
+			data = data.encode('utf-8')
+		def write(tmp_file):
+			with open(tmp_file, 'wb') as f:
+				f.write(data)
+		self._write(write)
+
+	def delete(self):
+		os.remove(self.path)
+
+
+class LocalBucket(object):
+	"""A local directory standing in for a GCS bucket. Object names may
+	contain '/', like in GCS, and are files in subdirectories then.
+
+	Parameters:
+	root : string, path of the directory holding the files
+	"""
+
+	def __init__(self, root):
+		self.root = root
+		self.name = os.path.basename(os.path.normpath(root))
+		if not os.path.exists(root):
+			os.makedirs(root)
+
+	def list_blobs(self, prefix='', start_offset=None, end_offset=None):
+		names = []
+		for dirpath, _, filenames in os.walk(self.root):
+			for filename in filenames:
+				if filename.endswith('.tmp'):  # upload in progress
+					continue
+				name = os.path.relpath(os.path.join(dirpath, filename), self.root)
+				name = name.replace(os.sep, '/')
+				if (name.startswith(prefix)
+						and (start_offset is None or name >= start_offset)
+						and (end_offset is None or name < end_offset)):
+					names.append(name)
+		return [LocalBlob(self.root, name) for name in sorted(names)]
+
+	def blob(self, name):
+		return LocalBlob(self.root, name)
+
+	def get_blob(self, name):
+		blob = LocalBlob(self.root, name)
+		if not blob.exists():
+			return None
+		return blob
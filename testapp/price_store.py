@@ -0,0 +1,562 @@
+"""Columnar binary store of asset prices, the source of truth for ingestion.
+
+Every asset has one directory per month holding one .npy file per column:
+
+	<root>/<SYMBOL>/<YYYY-MM>/date.npy    datetime64[ns], UTC
+	                          open.npy    float64
+	                          ...
+	                          volume.npy  float64
+
+Columns are memory-mapped when read, so nothing has to be parsed, and
+appending new data only rewrites the partitions from the month of the
+first new row on. Asset price csv files are exported from the store
+on demand.
+
+The <SYMBOL>.csv objects in the GCS bucket for asset files are only read
+once, to import an asset into an empty store, see download_symbol. They
+are no longer uploaded and go stale after that, so nothing outside the
+app should read them; the store objects are the current price data.
+
+Data appended to an existing month can instead be written as a segment,
+a separate file with the new rows only:
+
+	<root>/<SYMBOL>/<YYYY-MM>/seg-<YYYYmmddHHMMSS>.npz
+
+named after its first date. Reading a month applies its segments in
+order, each replacing the rows from its first date on. So a daily ingest
+only writes and uploads the new day, not the whole month. A month is
+compacted into its .npy columns once it has MAX_SEGMENTS segments, and
+when the next month starts.
+
+The store is not tied to minute frequency. Bars of a shorter period,
+e.g. 10 seconds, are kept in a store of their own, mirrored under the
+GCS prefix returned by bars_prefix.
+"""
+import logging
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from .object_store import blob_version, get, list_objects, put
+
+
+# Get an instance of a logger
+logger = logging.getLogger('django')
+
+COLUMNS = ['date','open','high','low','close','volume']
+
+# prefix of the store objects in GCS bucket for asset files
+GS_STORE_PREFIX = 'store/'
+
+# segments of a month before it is compacted
+MAX_SEGMENTS = 8
+SEGMENT_PREFIX = 'seg-'
+
+
+def bars_prefix(bar_period):
+	"""Prefix of the store objects of bars of bar_period seconds."""
+	return 'store-{0}s/'.format(bar_period)
+
+
+def _to_datetime64(ts):
+	"""Convert a datetime-like to a UTC datetime64[ns] without timezone."""
+	ts = pd.Timestamp(ts)
+	if ts.tzinfo is not None:
+		ts = ts.tz_convert('UTC').tz_localize(None)
+	return ts.to_datetime64()
+
+
+def _replace_dir(src, dst):
+	"""Move directory src to dst, replacing dst if it exists."""
+	if os.path.exists(dst):
+		old = dst + '.old'
+		if os.path.exists(old):
+			shutil.rmtree(old)
+		os.rename(dst, old)
+		os.rename(src, dst)
+		shutil.rmtree(old)
+	else:
+		os.rename(src, dst)
+
+
+def list_months(root, symbol):
+	"""Months stored for an asset.
+
+	Parameters:
+	root : string, path of the store
+	symbol : string, asset symbol
+
+	Returns:
+	months : list, sorted strings in format of 'YYYY-MM'
+	"""
+	path = os.path.join(root, symbol)
+	if not os.path.isdir(path):
+		return []
+	return sorted(month for month in os.listdir(path)
+				if len(month) == len('YYYY-MM') and '.' not in month)
+
+
+def has_symbol(root, symbol):
+	"""Check if there is any price data of an asset in the store."""
+	return len(list_months(root, symbol)) > 0
+
+
+def list_symbols(root):
+	"""Assets with price data in the store, sorted."""
+	if not os.path.isdir(root):
+		return []
+	return sorted(symbol for symbol in os.listdir(root)
+				if '.' not in symbol and has_symbol(root, symbol))
+
+
+def list_segments(root, symbol, month):
+	"""File names of the segments of one month, in the order of dates."""
+	path = os.path.join(root, symbol, month)
+	if not os.path.isdir(path):
+		return []
+	return sorted(name for name in os.listdir(path)
+				if name.startswith(SEGMENT_PREFIX) and name.endswith('.npz'))
+
+
+def _segment_name(first_date):
+	return (SEGMENT_PREFIX + pd.Timestamp(first_date).strftime('%Y%m%d%H%M%S')
+			+ '.npz')
+
+
+def read_partition(root, symbol, month, mmap_mode='r'):
+	"""Read all columns of one month, with its segments applied.
+
+	Parameters:
+	root : string, path of the store
+	symbol : string, asset symbol
+	month : string, in format of 'YYYY-MM'
+	mmap_mode : string or None, passed to np.load. By default columns are
+			memory-mapped read-only if the month has no segments
+
+	Returns:
+	cols : dict, column name -> np.ndarray
+	"""
+	path = os.path.join(root, symbol, month)
+	cols = {col: np.load(os.path.join(path, col+'.npy'), mmap_mode=mmap_mode)
+			for col in COLUMNS}
+	for name in list_segments(root, symbol, month):
+		with np.load(os.path.join(path, name)) as segment:
+			keep = np.searchsorted(cols['date'], segment['date'][0], 'left')
+			cols = {col: np.concatenate((cols[col][:keep], segment[col]))
+					for col in COLUMNS}
+	return cols
+
+
+def write_partition(root, symbol, month, cols):
+	"""Write all columns of one month, replacing the month if it exists.
+	Columns are written to a temporary directory first, so a partition is
+	never left half written.
+
+	Parameters:
+	root : string, path of the store
+	symbol : string, asset symbol
+	month : string, in format of 'YYYY-MM'
+	cols : dict, column name -> np.ndarray
+	"""
+	path = os.path.join(root, symbol, month)
+	tmp_path = path + '.tmp'
+	if os.path.exists(tmp_path):
+		shutil.rmtree(tmp_path)
+	os.makedirs(tmp_path)
+	for col in COLUMNS:
+		np.save(os.path.join(tmp_path, col+'.npy'), cols[col])
+	_replace_dir(tmp_path, path)
+
+
+def write_segment(root, symbol, month, cols):
+	"""Write new rows of an existing month as a segment. Segments starting
+	at or after the new rows are removed, the new rows replace them.
+
+	Parameters:
+	root : string, path of the store
+	symbol : string, asset symbol
+	month : string, in format of 'YYYY-MM'
+	cols : dict, column name -> np.ndarray, new rows of the month
+	"""
+	path = os.path.join(root, symbol, month)
+	name = _segment_name(cols['date'][0])
+	for old in list_segments(root, symbol, month):
+		if old >= name:
+			os.remove(os.path.join(path, old))
+	# np.savez adds .npz to names without it
+	tmp_file = os.path.join(path, name[:-len('.npz')] + '.tmp.npz')
+	np.savez(tmp_file, **{col: cols[col] for col in COLUMNS})
+	os.replace(tmp_file, os.path.join(path, name))
+
+
+def compact_partition(root, symbol, month):
+	"""Merge the segments of one month into its columns."""
+	write_partition(root, symbol, month,
+					read_partition(root, symbol, month, mmap_mode=None))
+
+
+def read_frame(root, symbol, start=None, end=None):
+	"""Read price data of an asset, only the months in range are loaded.
+
+	Parameters:
+	root : string, path of the store
+	symbol : string, asset symbol
+	start : datetime-like, first date to read (inclusive), optional
+	end : datetime-like, last date to read (inclusive), optional
+
+	Returns:
+	data : pd.DataFrame with COLUMNS, sorted by date
+	"""
+	months = list_months(root, symbol)
+	if start is not None:
+		start = _to_datetime64(start)
+		first_month = str(start.astype('datetime64[M]'))
+		months = [month for month in months if month >= first_month]
+	if end is not None:
+		end = _to_datetime64(end)
+		last_month = str(end.astype('datetime64[M]'))
+		months = [month for month in months if month <= last_month]
+
+	chunks = {col: [] for col in COLUMNS}
+	for month in months:
+		cols = read_partition(root, symbol, month)
+		dates = cols['date']
+		lo = 0 if start is None else np.searchsorted(dates, start, 'left')
+		hi = len(dates) if end is None else np.searchsorted(dates, end, 'right')
+		for col in COLUMNS:
+			chunks[col].append(np.asarray(cols[col][lo:hi]))
+
+	if not months:
+		return pd.DataFrame(columns=COLUMNS)
+	return pd.DataFrame({col: np.concatenate(chunks[col]) for col in COLUMNS},
+						columns=COLUMNS)
+
+
+def last_date(root, symbol):
+	"""Date of the last stored row of an asset, None if there is none."""
+	months = list_months(root, symbol)
+	if not months:
+		return None
+	dates = read_partition(root, symbol, months[-1])['date']
+	if len(dates) == 0:
+		return None
+	return pd.Timestamp(dates[-1])
+
+
+def append_frame(root, symbol, data, segments=False):
+	"""Merge new price data of an asset into the store.
+	Stored rows dated within the range of the new data are dropped, same as
+	trimming the end of an asset price file before concatenating. Stored
+	rows after the new data are kept, so backfilled data may also land in
+	the middle of history. Overlaps are found by binary search on the
+	sorted dates of the months at both ends of the new data, and only the
+	months from the first to the last new row are rewritten.
+
+	Parameters:
+	root : string, path of the store
+	symbol : string, asset symbol
+	data : pd.DataFrame with COLUMNS, sorted by date
+	segments : bool, write new rows at the end of an existing month as a
+			segment instead of rewriting the month, see write_segment
+
+	Returns:
+	months : list, months that were rewritten, removed or got a segment
+	"""
+	if len(data) == 0:
+		return []
+
+	dates = data['date'].values.astype('datetime64[ns]')
+	new_cols = {col: data[col].values.astype(np.float64)
+				for col in COLUMNS if col != 'date'}
+	new_cols['date'] = dates
+	first_month = str(dates[0].astype('datetime64[M]'))
+	last_month = str(dates[-1].astype('datetime64[M]'))
+
+	months = list_months(root, symbol)
+	stored_last = last_date(root, symbol)
+	# new data reaches the end of history, nothing after it is kept
+	at_tail = stored_last is None or dates[-1] >= _to_datetime64(stored_last)
+
+	# stored rows after new data, read before anything is rewritten
+	tail = None
+	if not at_tail and last_month in months:
+		old = read_partition(root, symbol, last_month)
+		hi = np.searchsorted(old['date'], dates[-1], 'right')
+		tail = {col: np.array(old[col][hi:]) for col in COLUMNS}
+
+	changed = []
+	for month in months:
+		# months within the new data, or after it at the tail, are replaced
+		if month > first_month and (at_tail or month < last_month):
+			shutil.rmtree(os.path.join(root, symbol, month))
+			changed.append(month)
+
+	if segments and at_tail:
+		# months before are complete now, compact the last one of them
+		earlier = [month for month in months if month < first_month]
+		if earlier and list_segments(root, symbol, earlier[-1]):
+			compact_partition(root, symbol, earlier[-1])
+			changed.append(earlier[-1])
+	if (segments and at_tail and first_month in months
+			and len(list_segments(root, symbol, first_month)) < MAX_SEGMENTS):
+		# rows of the first month go to a segment, later months are new
+		month_ids = dates.astype('datetime64[M]')
+		hi = np.searchsorted(month_ids, month_ids[0], 'right')
+		write_segment(root, symbol, first_month,
+					{col: new_cols[col][:hi] for col in COLUMNS})
+		changed.append(first_month)
+		new_cols = {col: new_cols[col][hi:] for col in COLUMNS}
+		first_month = None
+
+	if first_month in months:  # keep the rows before new data
+		old = read_partition(root, symbol, first_month)
+		keep = np.searchsorted(old['date'], dates[0], 'left')
+		new_cols = {col: np.concatenate((old[col][:keep], new_cols[col]))
+					for col in COLUMNS}
+	if tail is not None:  # keep the rows after new data
+		new_cols = {col: np.concatenate((new_cols[col], tail[col]))
+					for col in COLUMNS}
+
+	# split new data by month
+	dates = new_cols['date']
+	if len(dates) == 0:
+		return sorted(set(changed))
+	month_ids = dates.astype('datetime64[M]')
+	bounds = np.flatnonzero(month_ids[1:] != month_ids[:-1]) + 1
+	starts = np.concatenate(([0], bounds))
+	ends = np.concatenate((bounds, [len(dates)]))
+	for lo, hi in zip(starts, ends):
+		month = str(month_ids[lo])
+		write_partition(root, symbol, month,
+						{col: new_cols[col][lo:hi] for col in COLUMNS})
+		if month not in changed:
+			changed.append(month)
+	return sorted(set(changed))
+
+
+def import_csv(root, symbol, csv_path):
+	"""Replace the stored data of an asset with an asset price csv file.
+
+	Parameters:
+	root : string, path of the store
+	symbol : string, asset symbol
+	csv_path : string, path of an asset price file with COLUMNS
+	"""
+	data = pd.read_csv(csv_path, parse_dates=[0])
+	data.columns = COLUMNS
+	path = os.path.join(root, symbol)
+	if os.path.exists(path):
+		shutil.rmtree(path)
+	append_frame(root, symbol, data)
+
+
+def export_csv(root, symbol, csv_path):
+	"""Write stored price data of an asset to an asset price csv file.
+	The file is written month by month to a temporary file, which then
+	replaces the old file.
+
+	Parameters:
+	root : string, path of the store
+	symbol : string, asset symbol
+	csv_path : string, path of the csv file
+	"""
+	tmp_path = csv_path + '.tmp'
+	with open(tmp_path, 'w') as f:
+		f.write(','.join(COLUMNS) + '\n')
+	for month in list_months(root, symbol):
+		cols = read_partition(root, symbol, month)
+		pd.DataFrame(cols, columns=COLUMNS).to_csv(tmp_path, mode='a',
+							header=False, index=False, float_format='%.10f')
+	os.rename(tmp_path, csv_path)
+
+
+def is_exported(root, symbol, csv_path):
+	"""Check if an asset price csv file is newer than the stored data of
+	the asset. Every write to the store replaces a month directory or adds
+	a file to it, which changes the modification time of a directory.
+	"""
+	if not os.path.isfile(csv_path):
+		return False
+	path = os.path.join(root, symbol)
+	changed = max([os.path.getmtime(path)]
+				+ [os.path.getmtime(os.path.join(path, month))
+				for month in list_months(root, symbol)])
+	return os.path.getmtime(csv_path) >= changed
+
+
+def _blob_prefix(symbol, month, prefix=GS_STORE_PREFIX):
+	return prefix + symbol + '/' + month + '/'
+
+
+def _month_files(root, symbol, month):
+	"""Names of the files of one month, columns and segments."""
+	return [col+'.npy' for col in COLUMNS] + list_segments(root, symbol, month)
+
+
+def upload_months(bucket, root, symbol, months, cache=None,
+				prefix=GS_STORE_PREFIX):
+	"""Mirror changed months of an asset to GCS bucket.
+	Objects of a month that no longer exist in the store, e.g. a removed
+	month or compacted segments, are deleted from the bucket once all
+	files are uploaded. If an upload fails, the segments of a compacted
+	month are still in the bucket, so it still holds the data it held
+	before.
+
+	Parameters:
+	bucket : bucket for asset files, see object_store.py
+	root : string, path of the store
+	symbol : string, asset symbol
+	months : list, months returned by append_frame
+	cache : ObjectCache, optional. Uploaded objects are recorded in it so
+			that they are not downloaded again, and files that are still
+			the same as in the bucket, e.g. columns of a month that only
+			got a new segment, are not uploaded again
+	prefix : string, prefix of the store objects in the bucket
+	"""
+	stale = []
+	for month in months:
+		path = os.path.join(root, symbol, month)
+		month_prefix = _blob_prefix(symbol, month, prefix)
+		remote = {fblob.name: fblob
+				for fblob in list_objects(bucket, prefix=month_prefix)}
+		names = _month_files(root, symbol, month) if os.path.isdir(path) else []
+		stale += [remote[name] for name in
+				sorted(set(remote) - set(month_prefix + name for name in names))]
+		for name in names:
+			filename = os.path.join(path, name)
+			fblob = remote.get(month_prefix + name)
+			if (fblob is not None and cache is not None
+					and cache.is_current(fblob, filename)):
+				continue
+			fblob = put(bucket, month_prefix + name, filename)
+			if cache is not None:
+				cache.record(fblob, filename)
+	for fblob in stale:
+		fblob.delete()
+
+
+def sync_symbol(bucket, root, symbol, cache, prefix=GS_STORE_PREFIX,
+				fblobs=None):
+	"""Sync the local store of an asset with GCS bucket in place.
+	Objects are only downloaded if they changed in the bucket since they
+	were recorded in cache, or were never recorded. Local changes not in
+	the bucket yet, e.g. left by a failed upload, are kept: files changed
+	since they were recorded, segments removed by a compaction and files
+	never uploaded. Local files that were uploaded and are no longer in the
+	bucket are removed.
+
+	Parameters:
+	bucket : bucket for asset files, see object_store.py
+	root : string, path of the store
+	symbol : string, asset symbol
+	cache : ObjectCache
+	prefix : string, prefix of the store objects in the bucket
+	fblobs : list, store objects of the asset if already listed, optional
+
+	Returns:
+	pending : list, sorted months with local changes to upload, see
+			upload_months
+	"""
+	path = os.path.join(root, symbol)
+	if fblobs is None:
+		fblobs = list_objects(bucket, prefix=prefix + symbol + '/')
+	downloaded = 0
+	remote = {}
+	pending = set()
+	for fblob in fblobs:
+		month, name = fblob.name.split('/')[-2:]
+		remote.setdefault(month, set()).add(name)
+		month_path = os.path.join(path, month)
+		filename = os.path.join(month_path, name)
+		if cache.is_current(fblob, filename):
+			continue
+		version = cache.recorded_version(fblob.name, filename)
+		if version is not None and version == blob_version(fblob) and (
+				os.path.isfile(filename) or (name.startswith(SEGMENT_PREFIX)
+											and os.path.isdir(month_path))):
+			# not changed in the bucket, but changed or compacted locally
+			pending.add(month)
+			continue
+		if not os.path.exists(month_path):
+			os.makedirs(month_path)
+		downloaded += cache.download(fblob, filename)
+
+	for month in list_months(root, symbol):
+		month_path = os.path.join(path, month)
+		month_prefix = _blob_prefix(symbol, month, prefix)
+		uploaded = []
+		for name in _month_files(root, symbol, month):
+			if name in remote.get(month, ()):
+				continue
+			filename = os.path.join(month_path, name)
+			version = cache.recorded_version(month_prefix + name, filename)
+			if version is None or cache.local_version(month_prefix + name,
+													filename) != version:
+				pending.add(month)  # not uploaded yet
+			else:
+				uploaded.append(name)
+		# uploaded, then removed from the bucket, e.g. by another instance
+		if month not in remote:
+			if month not in pending:
+				shutil.rmtree(month_path)
+			continue
+		for name in uploaded:
+			if name.startswith(SEGMENT_PREFIX):
+				os.remove(os.path.join(month_path, name))
+	logger.info('Synced {0}: {1} of {2} store objects downloaded, {3} months '
+				'to upload'.format(symbol, downloaded, len(fblobs), len(pending)))
+	return sorted(pending)
+
+
+def download_symbol(bucket, root, symbol, cache=None, prefix=GS_STORE_PREFIX):
+	"""Retrieve stored data of an asset from GCS bucket.
+	If the bucket has no store objects of the asset yet, the old asset price
+	file <SYMBOL>.csv is imported instead and uploaded as store objects.
+	The csv object itself is left as it was and is not updated any more.
+
+	Parameters:
+	bucket : bucket for asset files, see object_store.py
+	root : string, path of the store
+	symbol : string, asset symbol
+	cache : ObjectCache, optional. If given, the local store of the asset
+			is synced in place, see sync_symbol
+	prefix : string, prefix of the store objects in the bucket. Old asset
+			price files are only imported into the minute store, with the
+			default prefix
+
+	Returns:
+	found : bool, False if the bucket has no data of the asset
+	"""
+	path = os.path.join(root, symbol)
+	fblobs = list_objects(bucket, prefix=prefix + symbol + '/')
+	if fblobs and cache is not None:
+		sync_symbol(bucket, root, symbol, cache, prefix=prefix, fblobs=fblobs)
+		return True
+	if fblobs:
+		# download to a temporary directory, so that an interrupted
+		# download does not leave an incomplete store behind
+		tmp_path = path + '.tmp'
+		if os.path.exists(tmp_path):
+			shutil.rmtree(tmp_path)
+		for fblob in fblobs:
+			month, name = fblob.name.split('/')[-2:]
+			if not os.path.exists(os.path.join(tmp_path, month)):
+				os.makedirs(os.path.join(tmp_path, month))
+			fblob.download_to_filename(os.path.join(tmp_path, month, name))
+		_replace_dir(tmp_path, path)
+		return True
+
+	if prefix != GS_STORE_PREFIX:
+		return False
+	if not os.path.exists(root):
+		os.makedirs(root)
+	csv_path = os.path.join(root, symbol+'.csv')
+	if get(bucket, symbol+'.csv', csv_path) is None:
+		return False
+	import_csv(root, symbol, csv_path)
+	os.remove(csv_path)
+	logger.info('Imported '+symbol+'.csv into price store')
+	upload_months(bucket, root, symbol, list_months(root, symbol), cache=cache)
+	return True
@@ -163,20 +163,56 @@ $( function() {
     inginfo.attr("style", "color:black;");
     inginfo.html("Ingesting data... Please do not close the page");
 
-    url = ingbutton.attr("data-url");
-    // send get request to target url
-    $.get(url, function(data) {
+    // show the result of ingestion and enable buttons
+    function ingestDone(message) {
       // set info label text color
-      if (data.indexOf("Error") !== -1) {  // "Error" in response
+      if (message.indexOf("Error") !== -1) {  // "Error" in response
         inginfo.attr("style", "color:red;");
       } else {
         inginfo.attr("style", "color:green;");
       }
       // set info label content
-      inginfo.html(data);
+      inginfo.html(message);
       // enable buttons
       ingbutton.button("option", "disabled", false);
       $( "#submitparams" ).removeAttr('disabled');
+    }
+
+    // poll progress of the ingest job until it is finished
+    function pollStatus(statusUrl) {
+      $.getJSON(statusUrl, function(job) {
+        if (job.state == "done" || job.state == "failed") {
+          ingestDone(job.message);
+          return;
+        }
+        var text = "Ingesting data... Please do not close the page";
+        if (job.stage) {
+          text += " (" + job.stage;
+          if (job.total) {
+            text += " " + job.done + "/" + job.total;
+          }
+          if (job.detail) {
+            text += " " + job.detail;
+          }
+          text += ")";
+        }
+        inginfo.html(text);
+        setTimeout(function() { pollStatus(statusUrl); }, 2000);
+      }).fail(function() {
+        ingestDone("Error: Lost track of ingestion. Please refresh the page.");
+      });
+    }
+
+    url = ingbutton.attr("data-url");
+    // start ingest job, then poll its status
+    $.getJSON(url, function(data) {
+      if (data.error) {
+        ingestDone(data.error);
+      } else {
+        pollStatus(data.status_url);
+      }
+    }).fail(function() {
+      ingestDone("Error: Cannot start ingestion. Please try again.");
     });
   });
 });
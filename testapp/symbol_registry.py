@@ -0,0 +1,152 @@
+"""Registry of trading pairs available for backtesting.
+Trading pairs are discovered from crawler data during ingestion, so that
+new pairs need no code change. The registry is a JSON file in MEDIA_ROOT,
+symbol -> date of the first crawler data of the pair and its OHLC ratio,
+and is kept in GCS bucket for asset files like last_ingest.txt.
+
+Minute bars store prices times the OHLC ratio of the asset as uint32, so
+every pair needs a ratio that fits its price magnitude. Pairs without a
+ratio are not available, and are not ingested.
+"""
+import json
+import logging
+import os
+import re
+
+import numpy as np
+
+from .csv_concat import default_symbols
+from .object_store import get, put
+
+
+# Get an instance of a logger
+logger = logging.getLogger('django')
+
+# name of the registry in GCS bucket for asset files
+GS_REGISTRY_NAME = 'symbols.json'
+
+# symbols are used in file names, anything else in crawler data is ignored
+_valid_symbol = re.compile(r'^[A-Z0-9]{2,20}$')
+
+# OHLC ratios of default_symbols, as in ohlc_ratios of minute_bars.py
+DEFAULT_OHLC_RATIOS = {'BTCUSDT': 1000, 'ETHBTC': 10**6,
+					'XLMBTC': 10**8, 'XRPBTC': 10**8}
+
+# largest price times OHLC ratio of a new pair, leaves room in uint32 for
+# the price to rise 1000 times
+MAX_SCALED_PRICE = 2**32 // 1000
+
+
+def is_valid_symbol(symbol):
+	return isinstance(symbol, str) and _valid_symbol.match(symbol) is not None
+
+
+def _read(path):
+	try:
+		with open(path, 'r') as f:
+			return json.load(f)
+	except (IOError, ValueError):
+		return None
+
+
+def ohlc_ratio_for_price(price):
+	"""OHLC ratio of a new trading pair, the largest power of 10 that keeps
+	prices up to 1000 times price within uint32 once scaled.
+
+	Parameters:
+	price : float, highest price of the pair seen so far
+
+	Returns:
+	ratio : int, None if price is not a positive number
+	"""
+	if not price > 0:
+		return None
+	return 10 ** max(0, int(np.floor(np.log10(MAX_SCALED_PRICE / price))))
+
+
+def _ohlc_ratio(symbol, entry):
+	# entries written before OHLC ratios were registered hold the first date
+	if isinstance(entry, dict) and entry.get('ohlc_ratio'):
+		return int(entry['ohlc_ratio'])
+	return DEFAULT_OHLC_RATIOS.get(symbol)
+
+
+def read_ohlc_ratios(path):
+	"""OHLC ratios of the symbols in the registry.
+
+	Returns:
+	ratios : dict, symbol -> OHLC ratio, ratios of default_symbols if there
+			is no registry file
+	"""
+	registry = _read(path)
+	if registry is None:
+		return dict(DEFAULT_OHLC_RATIOS)
+	ratios = {}
+	for symbol, entry in registry.items():
+		ratio = _ohlc_ratio(symbol, entry)
+		if ratio is not None:
+			ratios[symbol] = ratio
+	return ratios
+
+
+def read_symbols(path):
+	"""Symbols in the registry that have an OHLC ratio, sorted.
+
+	Returns:
+	symbols : list, None if there is no registry file
+	"""
+	if _read(path) is None:
+		return None
+	return sorted(read_ohlc_ratios(path))
+
+
+def register_symbols(path, first_dates, ohlc_ratios):
+	"""Add symbols to the registry. The registry is created with
+	default_symbols if it does not exist. Symbols without an OHLC ratio are
+	not added.
+
+	Parameters:
+	path : string, path of the registry file
+	first_dates : dict, symbol -> date of the first crawler data seen
+	ohlc_ratios : dict, symbol -> OHLC ratio the symbol was ingested with
+
+	Returns:
+	new_symbols : list, symbols not in the registry before, sorted
+	"""
+	registry = _read(path)
+	if registry is None:
+		registry = {symbol: None for symbol in default_symbols}
+	new_symbols = sorted(symbol for symbol in first_dates
+						if _ohlc_ratio(symbol, registry.get(symbol)) is None
+						and is_valid_symbol(symbol) and ohlc_ratios.get(symbol))
+	if not new_symbols and os.path.isfile(path):
+		return new_symbols
+
+	for symbol in new_symbols:
+		registry[symbol] = {'first_date': str(first_dates[symbol]),
+							'ohlc_ratio': int(ohlc_ratios[symbol])}
+	tmp_file = path+'.tmp'
+	with open(tmp_file, 'w') as f:
+		json.dump(registry, f, indent=0, sort_keys=True)
+	os.replace(tmp_file, path)
+	if new_symbols:
+		logger.info('New trading pairs: '+', '.join(new_symbols))
+	return new_symbols
+
+
+def download_registry(bucket, path, cache=None):
+	"""Retrieve the registry from GCS bucket.
+	With an ObjectCache, it is only downloaded if it changed.
+
+	Returns:
+	found : bool, False if the bucket has no registry yet
+	"""
+	if cache is not None:
+		return cache.get(bucket, GS_REGISTRY_NAME, path)
+	return get(bucket, GS_REGISTRY_NAME, path) is not None
+
+
+def upload_registry(bucket, path, cache=None):
+	fblob = put(bucket, GS_REGISTRY_NAME, path)
+	if cache is not None:
+		cache.record(fblob, path)
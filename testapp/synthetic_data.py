@@ -0,0 +1,106 @@
+"""Synthetic crawler data, for running and benchmarking ingestion offline.
+Files look like the *-aggregates.csv files the crawler writes to
+idp_crypto bucket, including its flaws: late and duplicate rows, empty
+files and files with missing columns.
+"""
+import calendar
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from .csv_concat import EVENT_TIME_FORMAT, default_symbols
+
+
+def synthetic_symbols(count):
+	"""count asset symbols, default_symbols first."""
+	symbols = list(default_symbols[:count])
+	symbols += ['S{0:03d}BTC'.format(i) for i in range(count - len(symbols))]
+	return symbols
+
+
+def generate_aggregates(dest_path, start='2018-11-01 00:20:00', days=1,
+						symbols=None, files_per_day=96, late_rate=0.01,
+						duplicate_rate=0.01, empty_rate=0.01, defect_rate=0.01,
+						seed=0):
+	"""Write synthetic *-aggregates.csv files.
+	Every file holds one row per asset and minute of its interval, and is
+	named after the UNIX timestamp of the end of its interval, like the
+	files of the crawler. The same parameters always give the same files.
+
+	Parameters:
+	dest_path : string, directory to write files to, e.g. the directory of
+			a LocalBucket standing in for idp_crypto bucket
+	start : string, UTC, time of the first row
+	days : int, number of days of data
+	symbols : list, asset symbols, default_symbols by default
+	files_per_day : int, number of files per day
+	late_rate : float, share of rows whose eventTime is some minutes late
+	duplicate_rate : float, share of rows written twice
+	empty_rate : float, share of empty files
+	defect_rate : float, share of files without volume column
+	seed : int, seed of the random generator
+
+	Returns:
+	names : list, names of the files written, in order
+	rows : int, number of rows written
+	"""
+	if symbols is None:
+		symbols = default_symbols
+	if not os.path.exists(dest_path):
+		os.makedirs(dest_path)
+	rng = np.random.RandomState(seed)
+
+	startstamp = calendar.timegm(datetime.strptime(start, '%Y-%m-%d %H:%M:%S')
+								.timetuple())
+	interval = 86400 // files_per_day
+	minutes = max(1, interval // 60)
+	prices = 1 + rng.rand(len(symbols)) * 100
+
+	names = []
+	rows = 0
+	for idx in range(days * files_per_day):
+		begin = startstamp + idx * interval
+		name = '{0}-aggregates.csv'.format(begin + interval)
+		names.append(name)
+		path = os.path.join(dest_path, name)
+		if rng.rand() < empty_rate:  # crawler error
+			open(path, 'w').close()
+			continue
+
+		# one row per asset and minute, eventTime some seconds in the minute
+		n = minutes * len(symbols)
+		minute = begin + 60 * np.repeat(np.arange(minutes), len(symbols))
+		times = minute + rng.randint(0, 60, n)
+		late = rng.rand(n) < late_rate
+		times[late] += 60 * rng.randint(1, 4, late.sum())
+
+		steps = 1 + rng.randn(minutes, len(symbols)) * 0.001
+		closes = prices * np.cumprod(steps, axis=0)
+		opens = np.vstack((prices, closes[:-1]))
+		prices = closes[-1]
+		closes, opens = closes.ravel(), opens.ravel()
+		spread = np.abs(rng.randn(n)) * 0.0005 * closes
+
+		part = pd.DataFrame({
+			'eventType': '24hrTicker',
+			'eventTime': pd.to_datetime(times, unit='s').strftime(EVENT_TIME_FORMAT),
+			'symbol': np.tile(symbols, minutes),
+			'priceChange': closes - opens,
+			'openPrice': opens,
+			'highPrice': np.maximum(opens, closes) + spread,
+			'lowPrice': np.minimum(opens, closes) - spread,
+			'price': closes,
+			'volume': rng.rand(n) * 1000,
+			'quoteVolume': rng.rand(n) * 1000,
+		}, columns=['eventType', 'eventTime', 'symbol', 'priceChange', 'openPrice',
+					'highPrice', 'lowPrice', 'price', 'volume', 'quoteVolume'])
+		duplicate = rng.rand(n) < duplicate_rate
+		if duplicate.any():
+			part = pd.concat([part, part[duplicate]]).sort_index(kind='mergesort')
+		if rng.rand() < defect_rate:
+			part = part.drop(columns=['volume'])
+		part.to_csv(path, index=False)
+		rows += len(part)
+	return names, rows
@@ -1,3 +1,932 @@
-from django.test import TestCase
+import os
+import shutil
+import sqlite3
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+from django.test import SimpleTestCase
+from trading_calendars import get_calendar
+from zipline.data import minute_bars
+from zipline.data.bar_reader import NoDataOnDate
+from zipline.data.minute_bars import (
+	BcolzMinuteBarReader,
+	BcolzMinuteBarWriter,
+	_calc_minute_index,
+	_ContinuousMinuteIndex,
+)
+
+from .blob_download import fetch_blobs
+from . import bundle_ingest
+from .csv_concat import repair_timestamps, repair_timestamps_loop
+from . import ingest_jobs
+from .object_cache import ObjectCache
+from .object_store import LocalBlob, LocalBucket
+from . import price_store
+
+
+def _minute_dates(steps, start='2018-11-01 00:20:00'):
+	"""Dates starting at start, each steps[i] minutes after the previous."""
+	minutes = np.cumsum(np.concatenate(([0], steps)))
+	return pd.Timestamp(start) + pd.to_timedelta(minutes, unit='m')
+
+
+class RepairTimestampsTest(SimpleTestCase):
+	"""repair_timestamps gives the same result as repair_timestamps_loop."""
+
+	def assertSameRepair(self, dates):
+		dates = pd.Series(dates)
+		data = pd.DataFrame({'date': dates.copy()})
+		repair_timestamps_loop(data)
+		repaired = repair_timestamps(dates)
+		self.assertTrue(repaired.index.equals(dates.index))
+		self.assertEqual(list(repaired), list(data['date']))
+
+	def test_random_frames(self):
+		rng = np.random.RandomState(0)
+		# duplicates, gaps of 2 and 3 minutes, negative and larger gaps
+		choices = np.array([0, 1, 1, 1, 2, 3, 4, 10, -1, -5])
+		for _ in range(300):
+			steps = rng.choice(choices, rng.randint(0, 200))
+			self.assertSameRepair(_minute_dates(steps))
+
+	def test_duplicates(self):
+		self.assertSameRepair(_minute_dates([0, 0, 0, 1, 0, 1]))
+
+	def test_runs(self):
+		# a run of regular minutes after shifted rows, and a run going back
+		self.assertSameRepair(_minute_dates([1, 1, 2, 1, 1, 3, 1, 1, -2, 1, 1, 1]))
+
+	def test_single_row(self):
+		self.assertSameRepair(_minute_dates([]))
+
+	def test_empty(self):
+		dates = pd.Series([], dtype='datetime64[ns]')
+		self.assertEqual(len(repair_timestamps(dates)), 0)
+
+
+class FailingBlob(LocalBlob):
+	"""LocalBlob whose download fails the first failures times."""
+
+	def __init__(self, root, name, failures):
+		super(FailingBlob, self).__init__(root, name)
+		self.failures = failures
+		self.attempts = 0
+
+	def download_as_string(self):
+		self.attempts += 1
+		if self.attempts <= self.failures:
+			raise IOError('download of '+self.name+' failed')
+		return super(FailingBlob, self).download_as_string()
+
+
+class FetchBlobsTest(SimpleTestCase):
+	"""fetch_blobs against a LocalBucket standing in for GCS."""
+
+	def setUp(self):
+		self.root = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.root)
+		self.bucket = LocalBucket(self.root)
+		self.contents = {}
+		for i in range(20):
+			name = '{0}-aggregates.csv'.format(1541031600 + 900*i)
+			self.contents[name] = ('x' * i).encode('utf-8')
+			self.bucket.blob(name).upload_from_string(self.contents[name])
+
+	def test_result_order(self):
+		# reversed names, and the largest blobs arrive last
+		blobs = self.bucket.list_blobs()[::-1]
+		outputs = fetch_blobs(blobs, lambda name, raw: (name, raw), max_workers=4)
+		self.assertEqual(outputs, [(blob.name, self.contents[blob.name])
+								for blob in blobs])
+
+	def test_byte_count(self):
+		with self.assertLogs('django', level='INFO') as logs:
+			fetch_blobs(self.bucket.list_blobs(), lambda name, raw: raw)
+		total = sum(len(raw) for raw in self.contents.values())
+		self.assertIn('Downloaded 20 files, {0} bytes'.format(total),
+					'\n'.join(logs.output))
+
+	@mock.patch('testapp.blob_download.time.sleep')
+	def test_retry_with_backoff(self, sleep):
+		blobs = self.bucket.list_blobs()
+		failing = FailingBlob(self.root, blobs[3].name, failures=2)
+		blobs[3] = failing
+		outputs = fetch_blobs(blobs, lambda name, raw: raw, retries=3, backoff=0.5)
+		self.assertEqual(outputs[3], self.contents[failing.name])
+		self.assertEqual(failing.attempts, 3)
+		self.assertEqual([call[0][0] for call in sleep.call_args_list], [0.5, 1.0])
+
+	@mock.patch('testapp.blob_download.time.sleep')
+	def test_retries_exhausted(self, sleep):
+		blobs = self.bucket.list_blobs()
+		failing = FailingBlob(self.root, blobs[0].name, failures=5)
+		blobs[0] = failing
+		with self.assertRaises(IOError):
+			fetch_blobs(blobs, lambda name, raw: raw, retries=2, backoff=0.5)
+		self.assertEqual(failing.attempts, 3)
+		self.assertEqual([call[0][0] for call in sleep.call_args_list], [0.5, 1.0])
+
+
+class ReadJobTest(SimpleTestCase):
+	"""read_job marks a job failed once no process runs it."""
+
+	def setUp(self):
+		self.jobs_path = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.jobs_path)
+		lock_file = os.path.join(self.jobs_path, 'running.lock')
+		for patcher in (mock.patch.object(ingest_jobs, 'jobs_path', self.jobs_path),
+						mock.patch.object(ingest_jobs, '_running_lock_file', lock_file)):
+			patcher.start()
+			self.addCleanup(patcher.stop)
+
+	def new_job(self, state, age=0):
+		progress = ingest_jobs.JobProgress(ingest_jobs.new_job_id())
+		progress._state['state'] = state
+		with mock.patch('testapp.ingest_jobs.time.time',
+						return_value=ingest_jobs.time.time() - age):
+			progress._write()
+		return progress.job_id
+
+	def test_running_job_with_lock(self):
+		job_id = self.new_job('running')
+		with ingest_jobs._flock(ingest_jobs._running_lock_file):
+			self.assertEqual(ingest_jobs.read_job(job_id)['state'], 'running')
+
+	def test_running_job_without_lock(self):
+		job_id = self.new_job('running')
+		self.assertEqual(ingest_jobs.read_job(job_id)['state'], 'failed')
+		# the failure is written, not only reported
+		with ingest_jobs._flock(ingest_jobs._running_lock_file):
+			self.assertEqual(ingest_jobs.read_job(job_id)['state'], 'failed')
+
+	def test_queued_job(self):
+		job_id = self.new_job('queued')
+		self.assertEqual(ingest_jobs.read_job(job_id)['state'], 'queued')
+		job_id = self.new_job('queued', age=ingest_jobs.QUEUED_TIMEOUT + 1)
+		self.assertEqual(ingest_jobs.read_job(job_id)['state'], 'failed')
+
+	def test_finished_job(self):
+		job_id = self.new_job('done')
+		self.assertEqual(ingest_jobs.read_job(job_id)['state'], 'done')
+		self.assertIsNone(ingest_jobs.read_job('missing'))
+
+
+def _market_minutes(calendar, start_session, end_session):
+	"""All minutes from market open to close of the sessions in
+	[start_session, end_session]."""
+	schedule = calendar.schedule.loc[start_session:end_session]
+	return pd.DatetimeIndex(np.concatenate([
+		pd.date_range(market_open, market_close, freq='min').values
+		for market_open, market_close
+		in zip(schedule.market_open, schedule.market_close)])).tz_localize('UTC')
+
+
+class _Asset(object):
+	"""The parts of an Equity the minute bar reader uses."""
+
+	def __init__(self, sid, start_date):
+		self.sid = sid
+		self.start_date = start_date
+
+	def __int__(self):
+		return self.sid
+
+
+class MinuteBarsTestCase(SimpleTestCase):
+	"""Minute bars of 3 sids with random gaps, written for a calendar open
+	around the clock (AOC) and for one with early closes (NYSE).
+	Sid n starts trading n days after the first session.
+	"""
+	start_session = pd.Timestamp('2018-12-03', tz='UTC')
+	end_session = pd.Timestamp('2018-12-31', tz='UTC')
+	# last session with data, later sessions have no minutes written
+	data_end_session = pd.Timestamp('2018-12-27', tz='UTC')
+	calendars = {'AOC': 1440, 'NYSE': 390}
+
+	@classmethod
+	def setUpClass(cls):
+		super(MinuteBarsTestCase, cls).setUpClass()
+		cls.rootdir = tempfile.mkdtemp()
+		rng = np.random.RandomState(0)
+		cls.readers = {}
+		cls.minutes = {}
+		for name, minutes_per_day in cls.calendars.items():
+			calendar = get_calendar(name)
+			rootdir = os.path.join(cls.rootdir, name)
+			os.makedirs(rootdir)
+			writer = BcolzMinuteBarWriter(rootdir, calendar, cls.start_session,
+										cls.end_session, minutes_per_day)
+			minutes = _market_minutes(calendar, cls.start_session,
+									cls.data_end_session)
+			for sid in range(3):
+				sid_minutes = minutes[minutes >= minutes[0] + pd.Timedelta(days=sid)]
+				keep = np.sort(rng.choice(len(sid_minutes), len(sid_minutes) // 3,
+										replace=False))
+				n = len(keep)
+				closes = 1 + rng.rand(n)
+				writer.write_sid(sid, pd.DataFrame({
+					'open': closes, 'high': closes + 0.5, 'low': closes - 0.5,
+					'close': closes, 'volume': rng.randint(1, 100, n).astype(float),
+				}, index=sid_minutes[keep]))
+			cls.readers[name] = BcolzMinuteBarReader(rootdir)
+			cls.minutes[name] = _market_minutes(calendar, cls.start_session,
+												cls.end_session)
+
+	@classmethod
+	def tearDownClass(cls):
+		shutil.rmtree(cls.rootdir)
+		super(MinuteBarsTestCase, cls).tearDownClass()
+
+	def generic_reader(self, name):
+		"""Reader that uses the generic searches of zipline."""
+		reader = BcolzMinuteBarReader(self.readers[name]._rootdir)
+		reader._continuous = False
+		return reader
+
+	def random_dts(self, name, count, seed=1):
+		"""Random trading minutes, with random seconds."""
+		rng = np.random.RandomState(seed)
+		minutes = self.minutes[name]
+		return (minutes[rng.randint(0, len(minutes), count)]
+				+ pd.to_timedelta(rng.randint(0, 60, count), unit='s'))
+
+	def assertSameValue(self, first, second, msg=None):
+		if not (np.isnan(first) and np.isnan(second)):
+			self.assertEqual(first, second, msg)
+
+
+class ContinuousPositionsTest(MinuteBarsTestCase):
+	"""Positions calculated for a continuous calendar are those found by
+	the generic searches."""
+
+	def test_continuous(self):
+		self.assertTrue(self.readers['AOC']._continuous)
+		self.assertFalse(self.readers['NYSE']._continuous)
+
+	def test_find_position_of_minute(self):
+		reader = self.readers['AOC']
+		generic = self.generic_reader('AOC')
+		for dt in self.random_dts('AOC', 2000):
+			pos = reader._find_position_of_minute(dt)
+			self.assertEqual(pos, generic._find_position_of_minute(dt), dt)
+			self.assertEqual(reader._pos_to_minute(pos), generic._pos_to_minute(pos))
+
+	def test_minute_out_of_range(self):
+		reader = self.readers['AOC']
+		for dt in (self.start_session - pd.Timedelta(minutes=1),
+				self.end_session + pd.Timedelta(days=1)):
+			with self.assertRaises(ValueError):
+				reader._find_position_of_minute(dt)
+			with self.assertRaises(NoDataOnDate):
+				reader.get_value(0, dt, 'close')
+
+	def test_get_value(self):
+		reader = self.readers['AOC']
+		generic = self.generic_reader('AOC')
+		for i, dt in enumerate(self.random_dts('AOC', 1000)):
+			for field in ('close', 'volume'):
+				self.assertSameValue(reader.get_value(i % 3, dt, field),
+									generic.get_value(i % 3, dt, field))
+
+	def test_get_last_traded_dt(self):
+		reader = self.readers['AOC']
+		generic = self.generic_reader('AOC')
+		rng = np.random.RandomState(2)
+		for i, dt in enumerate(self.random_dts('AOC', 1000)):
+			sid = i % 3
+			start_date = (self.start_session + pd.Timedelta(days=sid)
+						+ pd.Timedelta(minutes=int(rng.randint(0, 3000))))
+			asset = _Asset(sid, start_date)
+			# without positions known to have no volume from earlier calls
+			reader._known_zero_volume_dict.clear()
+			generic._known_zero_volume_dict.clear()
+			expected = generic.get_last_traded_dt(asset, dt)
+			actual = reader.get_last_traded_dt(asset, dt)
+			if pd.isnull(expected):
+				self.assertTrue(pd.isnull(actual), dt)
+			else:
+				self.assertEqual(actual, expected, dt)
+
+
+class GetValuesTest(MinuteBarsTestCase):
+	"""get_values gives the values of get_value."""
+
+	def test_get_values(self):
+		fields = ['open', 'high', 'low', 'close', 'volume']
+		sids = [2, 0, 1]
+		for name in self.calendars:
+			reader = self.readers[name]
+			dts = self.random_dts(name, 500)
+			values = reader.get_values(sids, dts, fields)
+			self.assertEqual(values.shape, (len(fields), len(dts), len(sids)))
+			for i, field in enumerate(fields):
+				for j, sid in enumerate(sids):
+					for k, dt in enumerate(dts):
+						self.assertSameValue(values[i, k, j],
+											reader.get_value(sid, dt, field),
+											(name, field, sid, dt))
+
+	def test_find_positions_of_minutes(self):
+		for name in self.calendars:
+			reader = self.readers[name]
+			generic = self.generic_reader(name)
+			dts = self.random_dts(name, 1000)
+			minutes = dts.values.astype('datetime64[m]').astype(np.int64)
+			self.assertEqual(list(reader._find_positions_of_minutes(minutes)),
+							[generic._find_position_of_minute(dt) for dt in dts])
+
+	def test_no_dts(self):
+		values = self.readers['AOC'].get_values([0, 1], [], ['close'])
+		self.assertEqual(values.shape, (1, 0, 2))
+
+	def test_minute_out_of_range(self):
+		with self.assertRaises(NoDataOnDate):
+			self.readers['AOC'].get_values(
+				[0], [self.start_session - pd.Timedelta(minutes=1)], ['close'])
+
+	def test_read_positions(self):
+		reader = self.readers['AOC']
+		carray = reader._open_minute_file('close', 1)
+		values = carray[:]
+		rng = np.random.RandomState(3)
+		# unsorted and repeated, some past the end of the data
+		positions = rng.randint(0, len(values) + 2000, 3000)
+		expected = np.zeros(len(positions), dtype=np.uint32)
+		valid = positions < len(values)
+		expected[valid] = values[positions[valid]]
+		for column in (carray, values):
+			self.assertTrue(np.array_equal(
+				reader._read_positions(column, positions), expected))
+
+
+def _load_raw_arrays_per_field(reader, fields, start_dt, end_dt, sids):
+	"""load_raw_arrays as zipline implements it, field by field and sid by
+	sid, with one np.delete per range of minutes excluded after an early
+	close."""
+	start_idx = reader._find_position_of_minute(start_dt)
+	end_idx = reader._find_position_of_minute(end_dt)
+	exclusions = reader._exclusion_indices_for_range(start_idx, end_idx) or []
+	num_minutes = end_idx - start_idx + 1 - sum(
+		excl_stop - excl_start + 1 for excl_start, excl_stop in exclusions)
+	results = []
+	for field in fields:
+		if field != 'volume':
+			out = np.full((num_minutes, len(sids)), np.nan)
+		else:
+			out = np.zeros((num_minutes, len(sids)), dtype=np.uint32)
+		for i, sid in enumerate(sids):
+			values = reader._open_minute_file(field, sid)[start_idx:end_idx + 1]
+			for excl_start, excl_stop in exclusions[::-1]:
+				values = np.delete(values, np.s_[
+					excl_start - start_idx:excl_stop - start_idx + 1])
+			where = values != 0
+			if field != 'volume':
+				out[:len(where), i][where] = (
+					values[where] * reader._ohlc_ratio_inverse_for_sid(sid))
+			else:
+				out[:len(where), i][where] = values[where]
+		results.append(out)
+	return results
+
+
+class LoadRawArraysTest(MinuteBarsTestCase):
+	"""load_raw_arrays gives the arrays of the field by field version."""
+	fields = ['open', 'high', 'low', 'close', 'volume']
+	sids = [1, 0, 2]
+
+	def assertSameArrays(self, actual, expected, msg=None):
+		self.assertEqual(len(actual), len(expected))
+		for actual_array, expected_array in zip(actual, expected):
+			self.assertEqual(actual_array.shape, expected_array.shape, msg)
+			self.assertEqual(actual_array.dtype, expected_array.dtype, msg)
+			self.assertTrue(np.array_equal(np.isnan(actual_array.astype(float)),
+										np.isnan(expected_array.astype(float))), msg)
+			self.assertTrue(np.array_equal(np.nan_to_num(actual_array),
+										np.nan_to_num(expected_array)), msg)
+
+	def windows(self, name, count):
+		"""Random windows, and one around the early close of NYSE."""
+		minutes = self.minutes[name]
+		rng = np.random.RandomState(4)
+		windows = [(minutes[start], minutes[end]) for start, end
+				in np.sort(rng.randint(0, len(minutes), (count, 2)), axis=1)]
+		windows.append((pd.Timestamp('2018-12-21 15:00', tz='UTC'),
+						pd.Timestamp('2018-12-26 20:00', tz='UTC')))
+		return windows
+
+	def test_load_raw_arrays(self):
+		for name in self.calendars:
+			reader = self.readers[name]
+			for start_dt, end_dt in self.windows(name, 50):
+				self.assertSameArrays(
+					reader.load_raw_arrays(self.fields, start_dt, end_dt, self.sids),
+					_load_raw_arrays_per_field(reader, self.fields, start_dt,
+											end_dt, self.sids),
+					(name, start_dt, end_dt))
+
+	def test_early_close_excluded(self):
+		reader = self.readers['NYSE']
+		start_dt = pd.Timestamp('2018-12-21 15:00', tz='UTC')
+		end_dt = pd.Timestamp('2018-12-26 20:00', tz='UTC')
+		start_idx = reader._find_position_of_minute(start_dt)
+		end_idx = reader._find_position_of_minute(end_dt)
+		self.assertIsNotNone(reader._exclusion_indices_for_range(start_idx, end_idx))
+
+	def test_no_exclusions_on_continuous_calendar(self):
+		reader = self.readers['AOC']
+		self.assertIsNone(reader._exclusion_indices_for_range(
+			0, len(self.minutes['AOC']) - 1))
+
+	def test_output_buffers(self):
+		for name in self.calendars:
+			reader = self.readers[name]
+			minutes = self.minutes[name]
+			buffers = None
+			for start in range(0, len(minutes) - 600, 997):
+				start_dt, end_dt = minutes[start], minutes[start + 599]
+				expected = reader.load_raw_arrays(self.fields, start_dt, end_dt,
+												self.sids)
+				if buffers is None or buffers[0].shape != expected[0].shape:
+					buffers = [np.empty_like(array) for array in expected]
+				results = reader.load_raw_arrays(self.fields, start_dt, end_dt,
+												self.sids, out=buffers)
+				self.assertIs(results, buffers)
+				self.assertSameArrays(results, expected, (name, start_dt))
+
+	def test_ctable_opened_once(self):
+		reader = BcolzMinuteBarReader(self.readers['AOC']._rootdir)
+		start_dt, end_dt = self.minutes['AOC'][100], self.minutes['AOC'][5000]
+		with mock.patch('zipline.data.minute_bars.bcolz.ctable',
+						wraps=minute_bars.bcolz.ctable) as ctable:
+			for fields in (self.fields, ['close'], ['volume', 'open']):
+				reader.load_raw_arrays(fields, start_dt, end_dt, self.sids)
+			reader.get_value(0, end_dt, 'high')
+		self.assertEqual(sorted(call[1]['rootdir'] for call in ctable.call_args_list),
+						sorted(os.path.join(reader._rootdir, minute_bars._sid_subdir_path(sid))
+								for sid in self.sids))
+
+	def test_output_buffers_mismatch(self):
+		reader = self.readers['AOC']
+		start_dt, end_dt = self.minutes['AOC'][0], self.minutes['AOC'][9]
+		with self.assertRaises(ValueError):
+			reader.load_raw_arrays(['close'], start_dt, end_dt, [0],
+								out=[np.empty((9, 1))])
+		with self.assertRaises(ValueError):
+			reader.load_raw_arrays(['close', 'volume'], start_dt, end_dt, [0],
+								out=[np.empty((10, 1))])
+
+
+class ContinuousMinuteIndexTest(SimpleTestCase):
+	"""_ContinuousMinuteIndex behaves like the DatetimeIndex of
+	_calc_minute_index."""
+
+	def setUp(self):
+		calendar = get_calendar('AOC')
+		market_opens = calendar.schedule.loc[
+			'2018-12-03':'2018-12-31'].market_open
+		self.expected = _calc_minute_index(market_opens, 1440)
+		first_minute = int(market_opens.values.astype('datetime64[m]')
+						.astype(np.int64)[0])
+		self.index = _ContinuousMinuteIndex(first_minute, len(market_opens) * 1440)
+		self.rng = np.random.RandomState(5)
+
+	def test_length_and_values(self):
+		self.assertEqual(len(self.index), len(self.expected))
+		self.assertEqual(self.index.size, self.expected.size)
+		self.assertTrue(np.array_equal(self.index.values, self.expected.values))
+
+	def test_getitem(self):
+		for pos in self.rng.randint(-len(self.expected), len(self.expected), 500):
+			self.assertEqual(self.index[int(pos)], self.expected[int(pos)])
+		with self.assertRaises(IndexError):
+			self.index[len(self.expected)]
+
+	def test_slices(self):
+		n = len(self.expected)
+		for key in (slice(0, 10), slice(5, 3), slice(100, None),
+					slice(None, -7), slice(-20, None), slice(n - 5, n + 5),
+					slice(10, 1000, 7)):
+			sliced = self.index[key]
+			self.assertEqual(len(sliced), len(self.expected[key]), key)
+			self.assertTrue(np.array_equal(sliced.values, self.expected[key].values),
+							key)
+
+	def random_dts(self, count):
+		"""Datetimes in and around the index, with random seconds."""
+		seconds = self.rng.randint(-100000, len(self.expected) * 60 + 100000, count)
+		return self.expected[0] + pd.to_timedelta(seconds, unit='s')
+
+	def test_searchsorted(self):
+		dts = self.random_dts(500)
+		values = dts.tz_convert(None).values
+		for side in ('left', 'right'):
+			for dt, value in zip(dts, values):
+				self.assertEqual(self.index.searchsorted(dt, side=side),
+								self.expected.values.searchsorted(value, side=side),
+								(dt, side))
+			self.assertTrue(np.array_equal(
+				self.index.searchsorted(values, side=side),
+				self.expected.values.searchsorted(values, side=side)))
+
+	def test_get_loc(self):
+		dts = list(self.random_dts(500)) + list(self.expected[::997])
+		for dt in dts:
+			try:
+				expected = self.expected.get_loc(dt)
+			except KeyError:
+				with self.assertRaises(KeyError):
+					self.index.get_loc(dt)
+			else:
+				self.assertEqual(self.index.get_loc(dt), expected)
+
+	def test_writer_index(self):
+		writer = BcolzMinuteBarWriter(tempfile.mkdtemp(), get_calendar('AOC'),
+						pd.Timestamp('2018-12-03', tz='UTC'),
+						pd.Timestamp('2018-12-31', tz='UTC'), 1440,
+						write_metadata=False)
+		self.assertIsInstance(writer._minute_index, _ContinuousMinuteIndex)
+		writer = BcolzMinuteBarWriter(tempfile.mkdtemp(), get_calendar('NYSE'),
+						pd.Timestamp('2018-12-03', tz='UTC'),
+						pd.Timestamp('2018-12-31', tz='UTC'), 390,
+						write_metadata=False)
+		self.assertIsInstance(writer._minute_index, pd.DatetimeIndex)
+
+
+def _price_frame(start, periods, base, rng):
+	"""Price data of one asset in the columns of the price store, a row
+	every minute from start with a few minutes missing. Prices are exact
+	in binary, so that they are the same once scaled by the OHLC ratio."""
+	dates = pd.date_range(start, periods=periods, freq='min')
+	keep = np.sort(rng.choice(periods, periods * 9 // 10, replace=False))
+	closes = base + rng.randint(0, 64, len(keep)) / 8.0
+	return pd.DataFrame({
+		'date': dates[keep].values.astype('datetime64[ns]'), 'open': closes,
+		'high': closes + 0.5, 'low': closes - 0.5, 'close': closes,
+		'volume': rng.randint(1, 100, len(keep)).astype(float),
+	}, columns=price_store.COLUMNS)
+
+
+class IngestIncrementalTest(SimpleTestCase):
+	"""ingest_incremental drops minutes from the middle of a day on and
+	appends the price store, the bundle then holds the stored data."""
+	start_session = pd.Timestamp('2018-12-03', tz='UTC')
+	symbols = ['AAA', 'BBB']
+
+	def setUp(self):
+		self.tmpdir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.tmpdir)
+		self.store_path = os.path.join(self.tmpdir, 'store')
+		self.minute_path = os.path.join(self.tmpdir, 'minute_equities.bcolz')
+		self.db_path = os.path.join(self.tmpdir, 'assets.sqlite')
+		self.rng = np.random.RandomState(3)
+
+		# the bundle ends at noon of the third day, as in the store then
+		os.makedirs(self.minute_path)
+		writer = BcolzMinuteBarWriter(self.minute_path, get_calendar('AOC'),
+						self.start_session, pd.Timestamp('2018-12-05', tz='UTC'),
+						1440)
+		for sid, symbol in enumerate(self.symbols):
+			data = _price_frame('2018-12-03', 2 * 1440 + 12 * 60, sid + 1, self.rng)
+			price_store.append_frame(self.store_path, symbol, data)
+			data = data.set_index('date')
+			data.index = data.index.tz_localize('UTC')
+			writer.write_sid(sid, data)
+
+		with sqlite3.connect(self.db_path) as conn:
+			conn.execute('CREATE TABLE equities '
+						'(sid INTEGER, end_date INTEGER, auto_close_date INTEGER)')
+			conn.execute('CREATE TABLE equity_symbol_mappings '
+						'(symbol TEXT, sid INTEGER, end_date INTEGER)')
+			for sid, symbol in enumerate(self.symbols):
+				conn.execute('INSERT INTO equities VALUES (?, 0, 0)', (sid,))
+				conn.execute('INSERT INTO equity_symbol_mappings VALUES (?, ?, 0)',
+							(symbol, sid))
+
+		for name, value in (('latest_ingestion', 'ingestion'),
+							('asset_db_path', self.db_path),
+							('minute_equity_path', self.minute_path)):
+			patcher = mock.patch.object(bundle_ingest, name, return_value=value)
+			patcher.start()
+			self.addCleanup(patcher.stop)
+
+	def assertBundleMatchesStore(self):
+		reader = BcolzMinuteBarReader(self.minute_path)
+		start = self.start_session
+		end = pd.Timestamp('2018-12-06 23:59', tz='UTC')
+		self.assertEqual(reader.last_available_dt, end)
+		fields = ['open', 'high', 'low', 'close', 'volume']
+		arrays = reader.load_raw_arrays(fields, start, end, [0, 1])
+		minutes = pd.date_range(start.tz_localize(None), end.tz_localize(None),
+								freq='min')
+		for sid, symbol in enumerate(self.symbols):
+			stored = price_store.read_frame(self.store_path, symbol)
+			stored = stored.set_index('date').reindex(minutes)
+			stored['volume'] = stored['volume'].fillna(0)
+			for field, values in zip(fields, arrays):
+				np.testing.assert_array_equal(values[:, sid], stored[field].values,
+											err_msg=symbol+' '+field)
+
+	def test_truncate_and_append(self):
+		# new data of AAA replaces stored rows from 06:30 of the third day
+		# on, BBB only gets rows after those already in the bundle
+		since = pd.Timestamp('2018-12-05 06:30')
+		price_store.append_frame(self.store_path, 'AAA',
+						_price_frame(since, 1440 + 17 * 60 + 30, 10, self.rng))
+		price_store.append_frame(self.store_path, 'BBB',
+						_price_frame('2018-12-05 12:00', 1440 + 12 * 60, 20, self.rng))
+
+		self.assertTrue(bundle_ingest.ingest_incremental('csvdir',
+						self.store_path, self.symbols, since={'AAA': since}))
+		self.assertBundleMatchesStore()
+		with sqlite3.connect(self.db_path) as conn:
+			end_dates = dict(conn.execute('SELECT sid, end_date FROM equities'))
+		for sid, symbol in enumerate(self.symbols):
+			self.assertEqual(pd.Timestamp(end_dates[sid]),
+							price_store.last_date(self.store_path, symbol))
+
+	def test_new_asset(self):
+		price_store.append_frame(self.store_path, 'CCC',
+						_price_frame('2018-12-05', 1440, 1, self.rng))
+		self.assertFalse(bundle_ingest.ingest_incremental('csvdir',
+						self.store_path, self.symbols + ['CCC']))
+
+
+class PriceStoreTestCase(SimpleTestCase):
+	"""A price store in a temporary directory, mirrored to a LocalBucket
+	with an ObjectCache, as concat_new_frames does."""
+	symbol = 'AAA'
+	month = '2019-02'
+
+	def setUp(self):
+		self.tmpdir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.tmpdir)
+		self.root = os.path.join(self.tmpdir, 'store')
+		self.bucket = LocalBucket(os.path.join(self.tmpdir, 'bucket'))
+		self.cache = ObjectCache(os.path.join(self.tmpdir, 'cache.sqlite3'))
+		self.rng = np.random.RandomState(7)
+
+	def day(self, day):
+		"""Price data of one day of the month."""
+		return _price_frame(pd.Timestamp(self.month) + pd.Timedelta(days=day - 1),
+							1440, 1, self.rng)
+
+	def append(self, data, root=None, cache=None):
+		"""Add new data to the store and upload it, like a daily ingest.
+		root and cache are those of another instance if given."""
+		root = root or self.root
+		months = price_store.append_frame(root, self.symbol, data, segments=True)
+		price_store.upload_months(self.bucket, root, self.symbol, months,
+								cache=cache or self.cache)
+		return months
+
+	def fail_put(self, name):
+		"""Make uploads of objects ending with name fail."""
+		real_put = price_store.put
+		def put(bucket, object_name, filename):
+			if object_name.endswith(name):
+				raise IOError('upload of '+object_name+' failed')
+			return real_put(bucket, object_name, filename)
+		return mock.patch.object(price_store, 'put', side_effect=put)
+
+	def read_bucket(self):
+		"""Price data of the asset downloaded from the bucket."""
+		root = tempfile.mkdtemp(dir=self.tmpdir)
+		self.assertTrue(price_store.download_symbol(self.bucket, root, self.symbol))
+		return price_store.read_frame(root, self.symbol)
+
+	def assertSameFrame(self, first, second):
+		pd.testing.assert_frame_equal(first.reset_index(drop=True),
+									second.reset_index(drop=True))
+
+
+class SyncSymbolTest(PriceStoreTestCase):
+	"""sync_symbol pulls changes from the bucket and keeps local changes
+	that are not uploaded yet."""
+
+	def test_retry_after_failed_upload(self):
+		# the ninth day compacts eight segments into the month columns
+		for day in range(1, 10):
+			self.append(self.day(day))
+		self.assertEqual(len(price_store.list_segments(self.root, self.symbol,
+													self.month)), 8)
+		with self.fail_put('close.npy'):
+			with self.assertRaises(IOError):
+				self.append(self.day(10))
+		self.assertEqual(price_store.list_segments(self.root, self.symbol,
+												self.month), [])
+		expected = price_store.read_frame(self.root, self.symbol)
+
+		# the next ingest syncs before appending, local data is kept
+		pending = price_store.sync_symbol(self.bucket, self.root, self.symbol,
+										self.cache)
+		self.assertEqual(pending, [self.month])
+		self.assertSameFrame(price_store.read_frame(self.root, self.symbol),
+							expected)
+		new = self.day(11)
+		months = price_store.append_frame(self.root, self.symbol, new,
+										segments=True)
+		price_store.upload_months(self.bucket, self.root, self.symbol,
+								sorted(set(months) | set(pending)), cache=self.cache)
+		expected = pd.concat([expected, new])
+		self.assertSameFrame(price_store.read_frame(self.root, self.symbol),
+							expected)
+		self.assertSameFrame(self.read_bucket(), expected)
+		self.assertEqual(price_store.sync_symbol(self.bucket, self.root,
+												self.symbol, self.cache), [])
+
+	def test_segment_not_uploaded(self):
+		self.append(self.day(1))
+		with self.fail_put('.npz'):
+			with self.assertRaises(IOError):
+				self.append(self.day(2))
+		expected = price_store.read_frame(self.root, self.symbol)
+		self.assertEqual(price_store.sync_symbol(self.bucket, self.root,
+												self.symbol, self.cache), [self.month])
+		self.assertSameFrame(price_store.read_frame(self.root, self.symbol),
+							expected)
+
+	def test_changes_in_bucket(self):
+		for day in range(1, 4):
+			self.append(self.day(day))
+		# another instance replaces the last two days
+		other_root = os.path.join(self.tmpdir, 'other')
+		other_cache = ObjectCache(os.path.join(self.tmpdir, 'other.sqlite3'))
+		price_store.download_symbol(self.bucket, other_root, self.symbol,
+									cache=other_cache)
+		self.append(self.day(2), root=other_root, cache=other_cache)
+		expected = price_store.read_frame(other_root, self.symbol)
+
+		self.assertEqual(price_store.sync_symbol(self.bucket, self.root,
+												self.symbol, self.cache), [])
+		self.assertSameFrame(price_store.read_frame(self.root, self.symbol),
+							expected)
+		self.assertEqual(
+			price_store.list_segments(self.root, self.symbol, self.month),
+			price_store.list_segments(other_root, self.symbol, self.month))
+
+
+class UploadMonthsTest(PriceStoreTestCase):
+	"""A failed upload leaves the bucket with the data it held before, and
+	the next ingest uploads the rest."""
+
+	def assertFailedCompaction(self, name):
+		for day in range(1, 10):
+			self.append(self.day(day))
+		before = price_store.read_frame(self.root, self.symbol)
+		self.assertSameFrame(self.read_bucket(), before)
+
+		# the tenth day compacts the month, one of its columns fails
+		with self.fail_put(name):
+			with self.assertRaises(IOError):
+				self.append(self.day(10))
+		self.assertSameFrame(self.read_bucket(), before)
+
+		# retry as _prepare_symbol does
+		pending = price_store.sync_symbol(self.bucket, self.root, self.symbol,
+										self.cache)
+		price_store.upload_months(self.bucket, self.root, self.symbol, pending,
+								cache=self.cache)
+		self.assertSameFrame(self.read_bucket(),
+							price_store.read_frame(self.root, self.symbol))
+		self.assertEqual(len(self.read_bucket()), len(before) + len(self.day(10)))
+
+	def test_date_upload_fails(self):
+		self.assertFailedCompaction('date.npy')
+
+	def test_close_upload_fails(self):
+		self.assertFailedCompaction('close.npy')
+
+
+
+def _merge_frames(old, new):
+	"""New data merged into old as append_frame does: old rows dated within
+	the range of new data are dropped, rows before and after are kept."""
+	dates = new['date']
+	old = old[(old['date'] < dates.iloc[0]) | (old['date'] > dates.iloc[-1])]
+	return pd.concat([old, new]).sort_values('date', kind='mergesort')
+
+
+class AppendFrameTest(PriceStoreTestCase):
+	"""append_frame gives the same data as merging frames, and read_frame
+	reads back what was appended."""
+
+	def frame(self, start, periods):
+		return _price_frame(start, periods, 1, self.rng)
+
+	def assertStored(self, expected):
+		self.assertSameFrame(price_store.read_frame(self.root, self.symbol),
+							expected)
+
+	def test_round_trip(self):
+		data = self.frame('2019-01-20', 60 * 1440)
+		self.assertEqual(price_store.append_frame(self.root, self.symbol, data),
+						['2019-01', '2019-02', '2019-03'])
+		self.assertStored(data)
+		self.assertEqual(price_store.last_date(self.root, self.symbol),
+						data['date'].iloc[-1])
+		for start, end in (('2019-02-01', '2019-02-28 23:59'),
+						('2019-01-25 10:00:30', '2019-03-02'),
+						(None, '2019-01-31 23:59'), ('2019-03-10', None)):
+			selected = data
+			if start is not None:
+				selected = selected[selected['date'] >= pd.Timestamp(start)]
+			if end is not None:
+				selected = selected[selected['date'] <= pd.Timestamp(end)]
+			self.assertSameFrame(price_store.read_frame(self.root, self.symbol,
+											start=start, end=end), selected)
+		self.assertEqual(len(price_store.read_frame(self.root, self.symbol,
+												start='2019-05-01')), 0)
+
+	def test_overlap_at_tail(self):
+		old = self.frame('2019-01-20', 20 * 1440)
+		price_store.append_frame(self.root, self.symbol, old)
+		new = self.frame('2019-02-05 13:07', 10 * 1440)
+		self.assertEqual(price_store.append_frame(self.root, self.symbol, new),
+						['2019-02'])
+		self.assertStored(_merge_frames(old, new))
+
+	def test_backfill(self):
+		# backfilled data spans two months in the middle of history
+		old = self.frame('2019-01-01', 90 * 1440)
+		price_store.append_frame(self.root, self.symbol, old)
+		new = self.frame('2019-01-30 06:00', 3 * 1440)
+		self.assertEqual(price_store.append_frame(self.root, self.symbol, new),
+						['2019-01', '2019-02'])
+		self.assertStored(_merge_frames(old, new))
+		# within a month that has segments
+		newer = self.frame('2019-04-01', 1440)
+		price_store.append_frame(self.root, self.symbol, newer, segments=True)
+		self.assertEqual(len(price_store.list_segments(self.root, self.symbol,
+													'2019-04')), 0)
+		stored = _merge_frames(_merge_frames(old, new), newer)
+		newest = self.frame('2019-04-02', 1440)
+		price_store.append_frame(self.root, self.symbol, newest, segments=True)
+		self.assertEqual(len(price_store.list_segments(self.root, self.symbol,
+													'2019-04')), 1)
+		stored = _merge_frames(stored, newest)
+		backfill = self.frame('2019-04-01 20:00', 60)
+		price_store.append_frame(self.root, self.symbol, backfill, segments=True)
+		self.assertStored(_merge_frames(stored, backfill))
+
+	def test_segments(self):
+		expected = self.day(1)
+		price_store.append_frame(self.root, self.symbol, expected, segments=True)
+		for day in range(2, price_store.MAX_SEGMENTS + 2):
+			new = self.day(day)
+			self.assertEqual(price_store.append_frame(self.root, self.symbol, new,
+											segments=True), [self.month])
+			expected = _merge_frames(expected, new)
+			self.assertEqual(len(price_store.list_segments(self.root, self.symbol,
+										self.month)), day - 1)
+			self.assertStored(expected)
+			if day == 3:
+				# a re-ingest from the evening before replaces the last segment
+				new = self.frame('2019-02-02 20:00', 1440 + 240)
+				price_store.append_frame(self.root, self.symbol, new, segments=True)
+				expected = _merge_frames(expected, new)
+				self.assertEqual(len(price_store.list_segments(self.root,
+										self.symbol, self.month)), day - 1)
+				self.assertStored(expected)
+
+		# the month is compacted once it has MAX_SEGMENTS segments
+		new = self.day(price_store.MAX_SEGMENTS + 2)
+		price_store.append_frame(self.root, self.symbol, new, segments=True)
+		expected = _merge_frames(expected, new)
+		self.assertEqual(price_store.list_segments(self.root, self.symbol,
+												self.month), [])
+		self.assertStored(expected)
+
+	def test_next_month(self):
+		expected = self.day(1)
+		price_store.append_frame(self.root, self.symbol, expected, segments=True)
+		# rows of the month go to a segment, the next month is new
+		new = self.frame('2019-02-28 12:00', 1440)
+		self.assertEqual(price_store.append_frame(self.root, self.symbol, new,
+										segments=True), ['2019-02', '2019-03'])
+		expected = _merge_frames(expected, new)
+		self.assertEqual(len(price_store.list_segments(self.root, self.symbol,
+													self.month)), 1)
+		self.assertStored(expected)
+		# data of the next month only compacts the month before
+		new = self.frame('2019-03-01 18:00', 1440)
+		self.assertEqual(price_store.append_frame(self.root, self.symbol, new,
+										segments=True), ['2019-02', '2019-03'])
+		expected = _merge_frames(expected, new)
+		self.assertEqual(price_store.list_segments(self.root, self.symbol,
+												self.month), [])
+		self.assertEqual(len(price_store.list_segments(self.root, self.symbol,
+													'2019-03')), 1)
+		self.assertStored(expected)
+
+	def test_random_appends(self):
+		expected = None
+		start = pd.Timestamp('2019-01-01')
+		for i in range(40):
+			first = start + pd.Timedelta(minutes=int(self.rng.randint(0, 90 * 1440)))
+			new = self.frame(first, int(self.rng.randint(1, 5 * 1440)))
+			price_store.append_frame(self.root, self.symbol, new,
+									segments=bool(i % 2))
+			expected = new if expected is None else _merge_frames(expected, new)
+			self.assertStored(expected)
@@ -9,5 +9,6 @@ urlpatterns = [
     url(r'^processing/$', views.processing, name='processing'),
     url(r'^export/$', views.export, name='export'),
     url(r'^ingest/$', views.ingest, name='ingest'),
+    url(r'^ingest/status/$', views.ingest_status, name='ingest_status'),
     url(r'^getdata/$', views.getdata, name='getdata')
 ]
\ No newline at end of file
@@ -2,50 +2,37 @@
 """
 import csv
 import gc
-import glob
 import json
 import logging
 import os
-import requests
-import time
 import zipfile
 from datetime import datetime, timedelta
 from io import BytesIO, StringIO
 
 import pandas as pd
-from django.conf import settings as djangoSettings
 from django.shortcuts import render
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseRedirect, JsonResponse
 from django.urls import reverse
-from google.cloud import storage
 
-from .csv_concat import concat_new_csvs
 from .execute_backtest import execute_backtest, compare
-from .get_prefixes import get_prefixes
-from .zipline_commands import *
+from .ingest_jobs import read_job, start_job
+from .ingest_pipeline import (available_assets, GS_ASSETS_BUCKET_NAME, aggr_path,
+							arranged_path, object_cache_file, record_name,
+							record_file, store_path)
+from .object_cache import ObjectCache
+from .object_store import get_bucket
+from . import price_store
 
 
 
 # Get an instance of a logger
 logger = logging.getLogger('django')
 
-# available trading pairs
-assets_list = ['BTCUSDT','ETHBTC','XLMBTC','XRPBTC']
-
 # css class for rendering dataframe to html string
 df_class = 'dfstyle'
 
-# for using Google Cloud Storage
-GS_CRAWLERDATA_BUCKET_NAME = 'idp_crypto'
-GS_ASSETS_BUCKET_NAME = 'idp_backtest_assets'
 # GS_RESULTS_BUCKET_NAME = 'idp_backtest_results'  # deprecated
 
-# for saving *aggregates.csv
-aggr_path = djangoSettings.MEDIA_ROOT
-# record file of ingest time
-record_name = 'last_ingest.txt'
-record_file = aggr_path+record_name
-
 
 
 # Create your views here.
@@ -64,10 +51,8 @@ def index(request):
 	except:
 		try:
 			# retrieve latest ingest date from GCS
-			client = storage.Client()
-			bucket = client.get_bucket(GS_ASSETS_BUCKET_NAME)
-			fblob = bucket.get_blob(record_name)
-			fblob.download_to_filename(record_file)
+			bucket = get_bucket(GS_ASSETS_BUCKET_NAME)
+			ObjectCache(object_cache_file).get(bucket, record_name, record_file)
 
 			with open(record_file,'r') as record:
 				max_to = record.read()
@@ -90,7 +75,7 @@ def index(request):
 	request.session['max_to'] = max_to_str
 	request.session['max_from'] = max_from_str
 
-	context = {'assets': assets_list, 
+	context = {'assets': available_assets(), 
 				'max_to': max_to_str,
 				'max_from': max_from_str}
 
@@ -105,186 +90,29 @@ def index(request):
 
 
 def ingest(request):
-	"""Data (collection and) ingestion. 
-	Run by user manually after starting the instance every time.
+	"""Start data (collection and) ingestion as a background job.
+	Normally run every day by the ingest_scheduler command, this view
+	starts or attaches to an ingest on demand.
+	Progress of the job is polled from ingest_status view.
 	"""
-	
-	# path for saving *aggregates.csv
-	if not os.path.exists(aggr_path):
-		os.makedirs(aggr_path)
-	# path of old asset price files
-	arranged_path = os.path.join(aggr_path, 'arranged/minute/')
-	if not os.path.exists(arranged_path):
-		os.makedirs(arranged_path)
-	# path for data ingestion
-	ingest_path = os.path.join(aggr_path, 'arranged/')
-	# data bundle name. In case change, also change bundle_name in execute_backtest.py
-	bname = 'csvdir'
-
-	# client for GCS
-	client = storage.Client()
-
-	start_ingest = time.time()  # start time of ingest
-
-
-	# retrieve latest ingest time from GCS
-	try:
-		bucket = client.get_bucket(GS_ASSETS_BUCKET_NAME)
-		fblob = bucket.get_blob(record_name)
-		fblob.download_to_filename(record_file)
-
-		with open(record_file,'r') as record:
-			# time of last ingestion, UTC
-			starttime = record.read()
-		# remove possible line break char
-		starttime = starttime[:len('YYYY-MM-DD HH:MM:SS')]
-	except:
-		logger.exception('Cannot read last ingest time from file correctly')
-		return HttpResponse('Error: Connection failed when '
-					'trying to access Google Cloud Storage. Please try again.')
-	
-	# get and ingest data from starttime to endtime
-	starttimestamp = datetime.strptime(starttime, '%Y-%m-%d %H:%M:%S')
-	endtimestamp = datetime.utcnow()  # actual time
-	endtime = endtimestamp.date().strftime('%Y-%m-%d')+' 00:20:00'
-
-	# last ingestion was less than 1 day ago
-	if endtimestamp - starttimestamp < timedelta(days=1):
-		# check if there is ingestion, if yes, return
-		if check_not_empty(bname):
-			return HttpResponse('Data is already up to date')
-
-		# if no, check if there are asset files, if no, download them
-		download_list = [asset for asset in assets_list 
-						if not os.path.isfile(arranged_path+asset+'.csv')]
-		try:
-			bucket = client.get_bucket(GS_ASSETS_BUCKET_NAME)
-			for symbol in download_list:
-				fblob = bucket.get_blob(symbol+'.csv')
-				fblob.download_to_filename(arranged_path+symbol+'.csv')
-		except requests.exceptions.ChunkedEncodingError:
-			logger.exception('Network fails')
-			return HttpResponse('Error: Connection failed. '
-							'Please refresh the page and try to ingest again.')
-		except:
-			logger.exception('Cannot get assets data from Google Cloud Storage')
-			return HttpResponse('Error: Cannot get pricing data from Cloud Storage bucket '
-						+GS_ASSETS_BUCKET_NAME)
-		
-		# do the ingestion, return
-		stdout,stderr = run_ingest(ingest_path, bname)
-		stdout = stdout.decode('utf-8')
-		logger.info(stdout)
-		if stderr is not None:
-			stderr = stderr.decode('utf-8')
-			if stderr != '':
-				logger.warning(stderr)
-				# return HttpResponse(status=500)  # Internal Server Error, cannot ingest
-				# return HttpResponse('Error: Cannot finish ingestion.')
-		return HttpResponse('Ingestion completed. Please refresh the page.')
-
-	# else: get new data and ingest
-	logger.info('Attempt to ingest data from '+starttime+' to '+endtime)
-
 	try:
-		# set bucket to crawler data bucket
-		bucket = client.get_bucket(GS_CRAWLERDATA_BUCKET_NAME)
-		# get all possible prefixes of files collected between starttime and endtime
-		prefixes = get_prefixes(starttime, end=endtime)
-		aggr_names = []
-		for prefix in prefixes:
-			# logger.info(prefix)
-			# look up files in bucket using prefix to speed up searching
-			fblobs = bucket.list_blobs(prefix=prefix)
-			# download *aggregates.csv
-			for fblob in fblobs:
-				if fblob.name.endswith('aggregates.csv'):
-					fblob.download_to_filename(aggr_path+fblob.name)
-					aggr_names.append(fblob.name)
-	except requests.exceptions.ChunkedEncodingError:
-		logger.exception('Network fails')
-		return HttpResponse('Error: Connection failed. '
-						'Please refresh the page and try to ingest again.')
+		job_id = start_job()
 	except:
-		logger.exception('Cannot get crawler data from Google Cloud Storage')
-		# return HttpResponse(status=502)  # Bad Gateway  # set to 500 to get notified
-		return HttpResponse('Error: Cannot get crawler data from Cloud Storage bucket '
-						+GS_CRAWLERDATA_BUCKET_NAME)
+		logger.exception('Cannot start ingest job')
+		return JsonResponse({'error': 'Error: Cannot start ingestion. Please try again.'})
 
-	logger.info('Downloading completed')
+	return JsonResponse({'job': job_id,
+				'status_url': reverse('testapp:ingest_status')+'?job='+job_id})
 
-	# current working directory
-	cwd = os.getcwd()
-	
-	# data preparation
-	try:
-		concat_new_csvs(aggr_path, aggr_names, arranged_path, symbols=assets_list)
-	except requests.exceptions.ChunkedEncodingError:
-		logger.exception('Network fails')
-		return HttpResponse('Error: Connection failed. '
-						'Please refresh the page and try to ingest again.')
-	except:
-		logger.exception('Cannot concat new csvs')
-		return HttpResponse('Error in data preparation. '
-						'Please refresh the page and try to ingest again.')
-	logger.info('Data preparation completed')
-
-	os.chdir(cwd)
-	
-	# # clean old data ingestion
-	# _, stderr = run_clean(bname, 'after', '2019-05-20')
-	# if stderr is not None:
-	# 	stderr = stderr.decode("utf-8")
-	# 	if stderr != "":
-	# 		logger.warning(stderr)
-	
-	stdout,stderr = run_ingest(ingest_path, bname)
-	stdout = stdout.decode('utf-8')
-	logger.info(stdout)
-	if stderr is not None:
-		stderr = stderr.decode('utf-8')
-		if stderr != '':
-			logger.warning(stderr)
-			# return HttpResponse('Error: Cannot finish ingestion.')
-
-	try:
-		with open(record_file,'w') as record:
-			print(endtime, file=record)
-		logger.info('Writing last ingest time to file completed')
-	except:
-		logger.exception('Cannot write last ingest time to file')
-
-	try:
-		# rewrite new ingest time to GCS
-		bucket = client.get_bucket(GS_ASSETS_BUCKET_NAME)
-		fblob = bucket.blob(record_name)
-		fblob.upload_from_filename(record_file)
-	except:
-		logger.exception('Cannot upload last ingest to GCS')
 
 
-	# delete downloaded *aggregates.csv files
-	os.chdir(aggr_path)
-	try:
-		for f in glob.glob('*aggregates.csv'):
-			os.remove(f)
-		logger.info('*aggregates.csv files removed')
-	except:
-		logger.exception('Cannot remove *aggregates.csv files')
+def ingest_status(request):
+	"""Progress of an ingest job, as JSON."""
 
-	os.chdir(cwd)
-
-	# force the Garbage Collector to release unreferenced memory
-	gc.collect()
-	end_ingest = time.time()  # end time of ingest
-	duration = str(timedelta(seconds=int(end_ingest - start_ingest)))
-
-	msg = 'Ingestion of data from '+starttime+' to '+endtime+' completed in '+duration
-	logger.info(msg)
-	
-	return HttpResponse('Ingestion completed. Data range: ' + starttime
-				+ ' to ' + endtime + '. Duration: ' + duration
-				+ '. Please refresh the page.')
+	job = read_job(request.GET.get('job', ''))
+	if job is None:
+		return JsonResponse({'error': 'Ingest job not found.'}, status=404)
+	return JsonResponse(job)
 
 
 
@@ -295,9 +123,17 @@ def getdata(request):
 		return HttpResponseRedirect(reverse('testapp:index'))
 
 	asset = request.GET['pair']
-	asset_data = aggr_path+'arranged/minute/'+asset+'.csv'
+	assets_list = available_assets()
+	asset_data = arranged_path+asset+'.csv'
 
 	try:
+		# asset price files are exported from the price store on demand,
+		# again if the stored data changed since the last export
+		if (asset in assets_list and price_store.has_symbol(store_path, asset)
+				and not price_store.is_exported(store_path, asset, asset_data)):
+			if not os.path.exists(arranged_path):
+				os.makedirs(arranged_path)
+			price_store.export_csv(store_path, asset, asset_data)
 		with open(asset_data, 'rb') as data:
 			response = HttpResponse(data.read(), content_type='text/csv')
 			response['Content-Disposition'] = 'attachment; filename='+asset+'.csv'
@@ -362,7 +198,7 @@ def results(request):
 	if 'perf' not in request.session:
 		return HttpResponseRedirect(reverse('testapp:index'))
 
-	context = {'assets': assets_list}
+	context = {'assets': available_assets()}
 	context['perf'] = request.session['perf']
 	context['compare'] = request.session['compare']
 	context['start_date'] = request.session['start_date']